@@ -0,0 +1,30 @@
+"""
+Per document matches against matchesBatch over a homogeneous collection.
+"""
+
+from mql.base.bson import BSONDocument
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.matchExpr.columnar import np
+
+from fpy.data.either import fromRight
+
+from benchmarks.util import bestOf, sampleDocument, report
+
+QUERIES = {
+    "range": {"score": {"$gte": 100, "$lt": 5000}},
+    "and": {"c1": {"$gt": 100}, "c2": {"$lt": 900}, "address.zip": {"$gte": 10}},
+    "in": {"c3": {"$in": list(range(0, 1000, 7))}},
+    "or": {"$or": [{"c1": 7}, {"c4": {"$lt": 10}}]},
+}
+
+def main(count: int = 50000):
+    print(f"numpy: {'available' if np is not None else 'missing, scalar fallback'}")
+    docs = [sampleDocument(idx) for idx in range(count)]
+    for name, rawQuery in QUERIES.items():
+        query = fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict(rawQuery)))
+        compiled = query.compile()
+        report(f"{name} compiled per doc", bestOf(lambda: [compiled(doc) for doc in docs], repeat=3), count)
+        report(f"{name} matchesBatch", bestOf(lambda: query.matchesBatch(docs), repeat=3), count)
+
+if __name__ == "__main__":
+    main()
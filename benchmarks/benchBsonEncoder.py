@@ -0,0 +1,28 @@
+"""
+Encoder throughput, reported in docs/sec and MB/s of produced BSON.
+"""
+
+from mql.base.bsonEncoder import encodeDocument, encodeInto
+from mql.base.bsonDecoder import decodeDocument
+
+from fpy.data.either import fromRight
+
+from benchmarks.util import bestOf, sampleDocument, report
+
+def main(count: int = 20000):
+    docs = [sampleDocument(idx) for idx in range(count)]
+    encoded = [fromRight(None, encodeDocument(doc)) for doc in docs]
+    nbytes = sum(map(len, encoded))
+
+    report("encodeDocument", bestOf(lambda: [encodeDocument(doc) for doc in docs]), count, nbytes)
+
+    def encodeAllInto():
+        out = bytearray()
+        for doc in docs:
+            encodeInto(out, doc)
+    report("encodeInto (single buffer)", bestOf(encodeAllInto), count, nbytes)
+
+    report("decodeDocument", bestOf(lambda: [decodeDocument(raw) for raw in encoded]), count, nbytes)
+
+if __name__ == "__main__":
+    main()
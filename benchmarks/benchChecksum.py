@@ -0,0 +1,35 @@
+"""
+Cost of OP_MSG checksums relative to decoding the message.
+
+Builds insert messages carrying a document sequence of growing size and compares the
+time to compute the CRC-32C of the whole message with the time to decode every
+document in it, for the active backend and the pure Python fallback.
+"""
+
+from mql.base.bson import BSONDocument
+from mql.interfaces.wireprotocol.checksum import crc32c, crc32cSlicing, BACKEND
+from mql.interfaces.wireprotocol.wireprotocol import encodeMsg, parseDocSeq, MSG_HEADER, FLAG_BITS
+
+from benchmarks.util import bestOf, sampleDocument
+
+from fpy.data.either import fromRight
+
+BATCHES = [100, 1000, 10000]
+
+def main():
+    print(f"checksum backend: {BACKEND}")
+    print(f"{'docs':>6} {'MB':>8} {'decode ms':>10} {'crc ms':>10} {'crc/decode':>11} {'py crc ms':>10} {'py/decode':>10}")
+    for count in BATCHES:
+        docs = [sampleDocument(idx) for idx in range(count)]
+        raw = fromRight(None, encodeMsg(BSONDocument.fromDict({"insert": "coll"}), 1, sequences={"documents": docs}))
+        # skip the header, flags and the body section to reach the document sequence
+        bodySize = int.from_bytes(raw[MSG_HEADER.size + FLAG_BITS.size + 1:][:4], "little")
+        seqStart = MSG_HEADER.size + FLAG_BITS.size + 1 + bodySize + 1
+        decode = bestOf(lambda: sum(1 for _ in fromRight(None, parseDocSeq(raw[seqStart:]))[0].documents), 3)
+        crc = bestOf(lambda: crc32c(raw), 3)
+        pyCrc = bestOf(lambda: crc32cSlicing(raw), 3)
+        print(f"{count:>6} {len(raw) / 1e6:>8.2f} {decode * 1e3:>10.2f} {crc * 1e3:>10.2f} {crc / decode:>10.1%}"
+              f" {pyCrc * 1e3:>10.2f} {pyCrc / decode:>9.1%}")
+
+if __name__ == "__main__":
+    main()
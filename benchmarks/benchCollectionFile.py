@@ -0,0 +1,41 @@
+"""
+Opening and scanning a memory-mapped collection file: building the offset index on the
+first open against loading the persisted one, scans through lazy and fully decoded
+documents, and random access by document number.
+"""
+
+import os
+import random
+import tempfile
+import time
+
+from mql.base.bson import BSONDocument
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.storage.collectionFile import openCollectionFile, writeCollectionFile
+
+from fpy.data.either import fromRight
+
+from benchmarks.util import bestOf, sampleDocument, report
+
+def main(count: int = 200000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.bson")
+        writeCollectionFile(path, (sampleDocument(idx) for idx in range(count)))
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        fromRight(None, openCollectionFile(path)).close()
+        report("open, build index", time.perf_counter() - start, count, size)
+        start = time.perf_counter()
+        coll = fromRight(None, openCollectionFile(path))
+        report("open, load index", time.perf_counter() - start, count, size)
+
+        with coll:
+            compiled = fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict({"address.zip": {"$lt": 100}}))).compile()
+            report("lazy scan + match", bestOf(lambda: sum(1 for _ in coll.find(compiled)), repeat=3), count, size)
+            report("decoded scan", bestOf(lambda: sum(1 for _ in coll.documents()), repeat=3), count, size)
+            order = [random.randrange(count) for _ in range(count)]
+            report("random access", bestOf(lambda: [coll[idx]["_id"] for idx in order], repeat=3), count)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Interpreted MatchableExpression.matches against the closure produced by compile(), and
+the closure compiled after the optimizer has rewritten the query.
+"""
+
+from mql.base.bson import BSONDocument
+from mql.matchExpr.optimizer import optimize
+from mql.matchExpr.parser import parsePredicateTopLevel
+
+from fpy.data.either import fromRight
+
+from benchmarks.util import bestOf, sampleDocument, report
+
+QUERIES = {
+    "eq": {"c3": 5},
+    "range": {"score": {"$gte": 100, "$lt": 5000}},
+    "nested": {"address.zip": {"$gt": 500}},
+    "bounds": {"score": {"$gt": 10, "$gte": 100, "$lt": 5000}, "address.zip": {"$gte": 10, "$lte": 90000}},
+    "or": {"$or": [{"c1": 7}, {"address.zip": {"$lt": 10}}, {"tags": "3\x00"}]},
+}
+
+def main(count: int = 20000):
+    docs = [sampleDocument(idx) for idx in range(count)]
+    for name, rawQuery in QUERIES.items():
+        query = fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict(rawQuery)))
+        compiled = query.compile()
+        report(f"{name} matches", bestOf(lambda: [query.matches(doc) for doc in docs]), count)
+        report(f"{name} compiled", bestOf(lambda: [compiled(doc) for doc in docs]), count)
+        optimized = optimize(query).compile()
+        report(f"{name} optimized", bestOf(lambda: [optimized(doc) for doc in docs]), count)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+CPU / bandwidth trade-off of the OP_COMPRESSED codecs.
+
+Compresses reply-sized OP_MSG messages with every available codec and reports the
+compression ratio next to compression and decompression throughput (in MB of
+uncompressed message per second). Codecs whose modules are not installed are skipped.
+"""
+
+from mql.base.bson import BSONDocument
+from mql.interfaces.wireprotocol.compression import compressMsg, MessageDecompressor, availableCodecs
+from mql.interfaces.wireprotocol.wireprotocol import encodeMsg
+
+from benchmarks.util import bestOf, sampleDocument
+
+from fpy.data.either import fromRight
+
+BATCHES = [100, 1000, 10000]
+
+def main():
+    print(f"{'codec':<8} {'docs':>6} {'MB':>8} {'ratio':>7} {'comp MB/s':>10} {'decomp MB/s':>12}")
+    for count in BATCHES:
+        docs = [sampleDocument(idx) for idx in range(count)]
+        raw = fromRight(None, encodeMsg(BSONDocument.fromDict({"ok": 1.0}), 1, sequences={"documents": docs}))
+        for codec in availableCodecs():
+            compressed = fromRight(None, compressMsg(raw, codec))
+            decompressor = MessageDecompressor()
+            comp = bestOf(lambda: compressMsg(raw, codec))
+            decomp = bestOf(lambda: decompressor.decompress(compressed))
+            print(f"{codec:<8} {count:>6} {len(raw) / 1e6:>8.2f} {len(raw) / len(compressed):>7.2f}"
+                  f" {len(raw) / comp / 1e6:>10.1f} {len(raw) / decomp / 1e6:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Sweeps document width to find where the lazily built field name index starts to beat
+a linear scan over BSONDocument.elements. Every field of each document is looked up
+once, on a fresh document, so the cost of building the index is included.
+"""
+
+import mql.base.bson as bson
+from mql.base.bson import BSONDocument
+
+from benchmarks.util import bestOf
+
+WIDTHS = [1, 2, 4, 8, 12, 16, 32, 64, 128, 256, 512]
+
+def lookupAll(docs, names):
+    for doc in docs:
+        for name in names:
+            doc[name]
+
+def timeLookups(width: int, threshold: int, docCount: int) -> float:
+    names = [f"field{idx}" for idx in range(width)]
+    raw = {name: idx for idx, name in enumerate(names)}
+    saved = bson.INDEX_THRESHOLD
+    bson.INDEX_THRESHOLD = threshold
+    try:
+        docs = [BSONDocument.fromDict(raw) for _ in range(docCount)]
+        return bestOf(lambda: lookupAll([BSONDocument(d.elements) for d in docs], names), repeat=3)
+    finally:
+        bson.INDEX_THRESHOLD = saved
+
+def main(lookups: int = 200000):
+    print(f"{'width':>6} {'linear ns/lookup':>18} {'indexed ns/lookup':>18} {'speedup':>8}")
+    for width in WIDTHS:
+        docCount = max(1, lookups // (width * width) + 1)
+        total = docCount * width
+        linear = timeLookups(width, threshold=2**31, docCount=docCount)
+        indexed = timeLookups(width, threshold=0, docCount=docCount)
+        print(f"{width:>6} {linear / total * 1e9:>18.0f} {indexed / total * 1e9:>18.0f} {linear / indexed:>8.2f}")
+
+if __name__ == "__main__":
+    main()
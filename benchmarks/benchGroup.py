@@ -0,0 +1,39 @@
+"""
+Throughput and peak heap of $group over a high cardinality key, fully in memory and
+spilling to temporary files under a memory limit. Documents are generated on the fly so
+the peak reflects the stage's own state.
+"""
+
+import time
+import tracemalloc
+
+from mql.agg.pipeline import parsePipeline, PipelineOptions
+from mql.base.bson import BSONDocument
+
+from benchmarks.util import report
+
+from fpy.data.either import fromRight
+
+SPEC = {"$group": {"_id": "$k", "total": {"$sum": "$v"}, "avg": {"$avg": "$v"}, "hi": {"$max": "$v"}}}
+
+def source(count: int, keys: int):
+    for idx in range(count):
+        yield BSONDocument.fromDict({"k": (idx * 7919) % keys, "v": idx % 1000})
+
+def run(name: str, count: int, keys: int, options: PipelineOptions):
+    pipeline = fromRight(None, parsePipeline([BSONDocument.fromDict(SPEC)], options))
+    tracemalloc.start()
+    start = time.perf_counter()
+    groups = sum(1 for _ in pipeline.stream(source(count, keys)))
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    report(name, elapsed, count)
+    print(f"{'':<40} {groups:>12,} groups {peak / 1e6:>8.1f} MB peak, {pipeline.stages[0].spills} spills")
+
+def main(count: int = 200000, keys: int = 100000):
+    run("$group in memory", count, keys, PipelineOptions())
+    run("$group spilling at 8MB", count, keys, PipelineOptions(allowDiskUse=True, maxMemoryBytes=8 * 1024 * 1024))
+
+if __name__ == "__main__":
+    main()
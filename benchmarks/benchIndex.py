@@ -0,0 +1,48 @@
+"""
+Point and range lookups on an in-memory collection, with a secondary index on the
+queried path against a collection scan.
+"""
+
+import time
+
+from mql.base.bson import BSONDocument
+from mql.base.path import Path
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.storage.collection import Collection
+
+from fpy.data.either import fromRight
+
+def build(count: int) -> Collection:
+    collection = Collection()
+    for idx in range(count):
+        collection.insert(BSONDocument.fromDict({"_id": idx, "k": (idx * 7919) % count, "tags": [idx % 97, idx % 89]}))
+    return collection
+
+def lookups(name: str, collection: Collection, queries, repeat: int):
+    exprs = [fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict(raw))) for raw in queries]
+    start = time.perf_counter()
+    found = 0
+    for _ in range(repeat):
+        for expr in exprs:
+            found += sum(1 for _ in collection.find(expr))
+    elapsed = time.perf_counter() - start
+    count = repeat * len(exprs)
+    print(f"{name:<40} {count / elapsed:>12,.1f} queries/sec {found / count:>10.1f} docs/query")
+
+def main(count: int = 200000):
+    collection = build(count)
+    points = [{"k": (idx * 31) % count} for idx in range(20)]
+    ranges = [{"k": {"$gte": idx * 1000, "$lt": idx * 1000 + 100}} for idx in range(20)]
+    multikey = [{"tags": idx} for idx in range(20)]
+    lookups("point, collection scan", collection, points, 1)
+    lookups("multikey, collection scan", collection, multikey, 1)
+    start = time.perf_counter()
+    collection.createIndex(Path.fromString("k"))
+    collection.createIndex(Path.fromString("tags"))
+    print(f"{'building 2 indexes':<40} {time.perf_counter() - start:>12.2f} s")
+    lookups("point, index scan", collection, points, 100)
+    lookups("range of 100, index scan", collection, ranges, 10)
+    lookups("multikey, index scan", collection, multikey, 1)
+
+if __name__ == "__main__":
+    main()
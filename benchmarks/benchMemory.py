@@ -0,0 +1,39 @@
+"""
+Heap cost of holding decoded documents in memory, measured with tracemalloc and
+reported per document next to the size of the same document as raw BSON.
+"""
+
+import gc
+import tracemalloc
+
+from mql.base.bsonEncoder import encodeDocument
+from mql.base.bsonDecoder import decodeDocument
+from mql.base.bsonRaw import RawBSONDocument
+
+from fpy.data.either import fromRight
+
+from benchmarks.util import sampleDocument
+
+def measure(build, count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return (after - before) / count
+
+def main(count: int = 20000):
+    encoded = [fromRight(None, encodeDocument(sampleDocument(idx))) for idx in range(count)]
+    rawSize = sum(map(len, encoded)) / count
+
+    decoded = measure(lambda: [fromRight(None, decodeDocument(raw))[0] for raw in encoded], count)
+    lazy = measure(lambda: [RawBSONDocument(raw) for raw in encoded], count)
+
+    print(f"{'raw BSON':<28} {rawSize:>10.0f} bytes/doc")
+    print(f"{'decoded BSONDocument':<28} {decoded:>10.0f} bytes/doc {decoded / rawSize:>6.1f}x")
+    print(f"{'RawBSONDocument (untouched)':<28} {lazy:>10.0f} bytes/doc {lazy / rawSize:>6.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Match throughput over serialized documents against the number of worker processes,
+with a single process compiled scan over the same bytes as the baseline.
+"""
+
+import os
+
+from mql.base.bson import BSONDocument
+from mql.base.bsonEncoder import encodeDocument
+from mql.base.bsonRaw import RawBSONDocument
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.matchExpr.parallel import ParallelMatcher
+
+from fpy.data.either import fromRight
+
+from benchmarks.util import bestOf, sampleDocument, report
+
+QUERY = {"c1": {"$gt": 100}, "c2": {"$lt": 900}, "address.zip": {"$gte": 10}, "tags": "3"}
+
+def serialScan(compiled, raw: memoryview):
+    pos = 0
+    while pos < len(raw):
+        doc = RawBSONDocument(raw, pos)
+        compiled(doc)
+        pos += len(doc.raw)
+
+def main(count: int = 200000):
+    raw = b"".join(fromRight(None, encodeDocument(sampleDocument(idx))) for idx in range(count))
+    query = BSONDocument.fromDict(QUERY)
+    compiled = fromRight(None, parsePredicateTopLevel(query)).compile()
+    report("serial", bestOf(lambda: serialScan(compiled, memoryview(raw)), repeat=3), count, len(raw))
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        with ParallelMatcher(workers) as matcher:
+            # warm up the pool and the per worker compiled query
+            matcher.match(query, raw)
+            report(f"{workers} workers", bestOf(lambda: matcher.match(query, raw), repeat=3), count, len(raw))
+        workers *= 2
+
+if __name__ == "__main__":
+    main()
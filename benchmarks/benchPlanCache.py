@@ -0,0 +1,33 @@
+"""
+Parsing repeated query shapes with and without the plan cache.
+"""
+
+import random
+
+from mql.base.bson import BSONDocument
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.matchExpr.planCache import PlanCache
+
+from benchmarks.util import bestOf
+
+SHAPES = [
+    lambda rng: {"a": rng.randrange(100), "b": {"$gt": rng.randrange(100)}},
+    lambda rng: {"user.id": {"$in": [rng.randrange(10 ** 6) for _ in range(20)]}},
+    lambda rng: {"$or": [{"status": "x"}, {"score": {"$gte": rng.random(), "$lt": 1.5}}]},
+    lambda rng: {"a.b.c": {"$not": {"$lte": rng.randrange(10)}}, "d": rng.randrange(5)},
+]
+
+def main(count: int = 20000):
+    rng = random.Random(0)
+    queries = [BSONDocument.fromDict(rng.choice(SHAPES)(rng)) for _ in range(count)]
+
+    uncached = bestOf(lambda: [parsePredicateTopLevel(q) for q in queries], repeat=3)
+    cache = PlanCache()
+    cached = bestOf(lambda: [cache.parse(q) for q in queries], repeat=3)
+
+    print(f"{'parsePredicateTopLevel':<28} {uncached / count * 1e6:>8.2f} us/query")
+    print(f"{'PlanCache.parse':<28} {cached / count * 1e6:>8.2f} us/query")
+    print(f"cache stats: {cache.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Requests/sec and latency percentiles of the asyncio wire protocol server as the number
+of concurrent client connections grows. The server runs in its own thread and event
+loop, the clients are a minimal Python stand-in that sends OP_MSG pings and waits for
+each reply before sending the next request.
+"""
+
+import asyncio
+import struct
+import threading
+import time
+
+from mql.base.bson import BSONDocument
+from mql.interfaces.wireprotocol.asyncServer import WireProtocolServer
+from mql.interfaces.wireprotocol.wireprotocol import encodeMsg
+
+from fpy.data.either import fromRight
+
+CONNECTIONS = [1, 4, 16, 64]
+
+def startServer() -> WireProtocolServer:
+    server = WireProtocolServer(port=0)
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_until_complete(server.serveForever())
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return server
+
+async def client(host: str, port: int, requests: int, latencies: list):
+    reader, writer = await asyncio.open_connection(host, port)
+    msg = fromRight(None, encodeMsg(BSONDocument.fromDict({"ping": 1, "$db": "admin"}), 1))
+    for _ in range(requests):
+        start = time.perf_counter()
+        writer.write(msg)
+        prefix = await reader.readexactly(4)
+        await reader.readexactly(struct.unpack("<i", prefix)[0] - 4)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+async def run(host: str, port: int, connections: int, requests: int):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(host, port, requests, latencies) for _ in range(connections)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e3
+    print(f"{connections:>6} {len(latencies) / elapsed:>12,.0f} {pct(0.5):>10.2f} {pct(0.99):>10.2f}")
+
+def main(totalRequests: int = 20000):
+    server = startServer()
+    print(f"{'conns':>6} {'req/sec':>12} {'p50 ms':>10} {'p99 ms':>10}")
+    for connections in CONNECTIONS:
+        asyncio.run(run(server.host, server.port, connections, totalRequests // connections))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+$sort over a large input three ways: fully in memory, as an external merge sort spilling
+runs under a memory limit, and as a top-k sort when followed by $limit.
+"""
+
+import time
+
+from mql.agg.pipeline import parsePipeline, PipelineOptions
+from mql.base.bson import BSONDocument
+
+from benchmarks.util import report
+
+from fpy.data.either import fromRight
+
+def source(count: int):
+    for idx in range(count):
+        yield BSONDocument.fromDict({"_id": idx, "k": (idx * 7919) % count, "v": f"value{idx % 1000}"})
+
+def run(name: str, stages, count: int, options: PipelineOptions):
+    pipeline = fromRight(None, parsePipeline([BSONDocument.fromDict(stage) for stage in stages], options)).optimize()
+    start = time.perf_counter()
+    out = sum(1 for _ in pipeline.stream(source(count)))
+    elapsed = time.perf_counter() - start
+    report(name, elapsed, count)
+    print(f"{'':<40} {out:>12,} documents out, {pipeline.stages[0].spills} spills")
+
+def main(count: int = 200000):
+    run("$sort in memory", [{"$sort": {"k": 1}}], count, PipelineOptions())
+    run("$sort spilling at 8MB", [{"$sort": {"k": 1}}], count,
+        PipelineOptions(allowDiskUse=True, maxMemoryBytes=8 * 1024 * 1024))
+    run("$sort + $limit 10 (top-k)", [{"$sort": {"k": 1}}, {"$limit": 10}], count, PipelineOptions())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Small helpers shared by the benchmark scripts.
+Run a benchmark from the repository root, e.g. python -m benchmarks.benchBsonEncoder
+"""
+
+import time
+from typing import Callable, Any
+
+from mql.base.bson import BSONDocument
+
+
+def bestOf(fn: Callable[[], Any], repeat: int = 5) -> float:
+    """
+    Best wall clock time of fn over repeat runs, in seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def sampleDocument(idx: int, width: int = 10) -> BSONDocument:
+    """
+    A moderately nested document with a mix of types, keyed by idx so documents differ
+    """
+    raw = {"_id": idx, "name": f"user{idx}", "score": idx * 0.5,
+           "tags": ["a", "b", str(idx % 7)],
+           "address": {"city": f"city{idx % 13}", "zip": idx % 100000}}
+    for col in range(width):
+        raw[f"c{col}"] = (idx + col) % 1000
+    return BSONDocument.fromDict(raw)
+
+def report(name: str, seconds: float, count: int, nbytes: int = 0):
+    line = f"{name:<40} {count / seconds:>12,.0f} docs/sec"
+    if nbytes:
+        line += f" {nbytes / seconds / 1e6:>10.1f} MB/s"
+    print(line)
@@ -0,0 +1 @@
+import mql.agg.stages
@@ -0,0 +1,141 @@
+"""
+$group accumulators.
+
+An accumulator keeps one state per group: init() creates it, accumulate() folds in the
+value of the accumulator's expression for one document, merge() combines two partial
+states of the same group (used when partial groups were spilled to disk) and finalize()
+produces the output value. States are BSONValues so spilled groups can be written with
+the BSON encoder and read back as they were.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable, Dict
+
+from mql.base.bson import BSONArray, BSONElement, BSONValue, BSONType, NumericTypes
+
+from fpy.data.maybe import fromJust
+
+INT32_RANGE = (-2 ** 31, 2 ** 31 - 1)
+INT64_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+NULL = BSONValue(BSONType.Null, None)
+
+def approxSize(value: BSONValue) -> int:
+    """
+    Rough in-memory footprint of a value, cheap enough to compute per accumulated value
+    """
+    bsonType = value.bsonType
+    if bsonType in (BSONType.Document, BSONType.Array):
+        return 64 + sum(48 + len(elm.fieldName) + approxSize(elm.value) for elm in value.value.elements)
+    if bsonType in (BSONType.String, BSONType.Symbol):
+        return 56 + len(value.value)
+    if bsonType == BSONType.Binary:
+        return 80 + len(value.value.body)
+    return 48
+
+# dict entry, key tuple and the per group state list
+GROUP_OVERHEAD = 200
+
+def isNullish(value: BSONValue) -> bool:
+    return value.bsonType in (BSONType.EOO, BSONType.Null, BSONType.Undefined)
+
+@dataclass(frozen=True)
+class Accumulator:
+    name: str
+    init: Callable[[], BSONValue]
+    accumulate: Callable[[BSONValue, BSONValue], BSONValue]
+    merge: Callable[[BSONValue, BSONValue], BSONValue]
+    finalize: Callable[[BSONValue], BSONValue]
+
+Accumulators: Dict[str, Accumulator] = dict()
+
+def defAccumulator(acc: Accumulator) -> Accumulator:
+    global Accumulators
+    Accumulators[acc.name] = acc
+    return acc
+
+
+# $sum keeps the narrowest integer type the total fits in, like the server
+
+def addNumbers(a: BSONValue, b: BSONValue) -> BSONValue:
+    total = a.value + b.value
+    if a.bsonType == BSONType.Number or b.bsonType == BSONType.Number:
+        return BSONValue(BSONType.Number, float(total))
+    if a.bsonType == BSONType.Int32 and b.bsonType == BSONType.Int32 and INT32_RANGE[0] <= total <= INT32_RANGE[1]:
+        return BSONValue(BSONType.Int32, total)
+    if INT64_RANGE[0] <= total <= INT64_RANGE[1]:
+        return BSONValue(BSONType.Int64, total)
+    return BSONValue(BSONType.Number, float(total))
+
+def sumAccumulate(state: BSONValue, value: BSONValue) -> BSONValue:
+    # non numeric values are ignored
+    if value.bsonType not in NumericTypes:
+        return state
+    return addNumbers(state, value)
+
+defAccumulator(Accumulator("$sum", lambda: BSONValue(BSONType.Int32, 0), sumAccumulate, addNumbers, lambda state: state))
+
+
+# $avg keeps [sum, count]
+
+def avgAccumulate(state: BSONValue, value: BSONValue) -> BSONValue:
+    if value.bsonType not in NumericTypes:
+        return state
+    total, count = state.value.elements
+    return avgState(total.value.value + value.value, count.value.value + 1)
+
+def avgMerge(a: BSONValue, b: BSONValue) -> BSONValue:
+    (totalA, countA), (totalB, countB) = a.value.elements, b.value.elements
+    return avgState(totalA.value.value + totalB.value.value, countA.value.value + countB.value.value)
+
+def avgState(total: float, count: int) -> BSONValue:
+    return BSONValue(BSONType.Array, BSONArray([BSONElement("0", BSONValue(BSONType.Number, float(total))),
+                                                BSONElement("1", BSONValue(BSONType.Int64, count))]))
+
+def avgFinalize(state: BSONValue) -> BSONValue:
+    total, count = state.value.elements
+    if count.value.value == 0:
+        return NULL
+    return BSONValue(BSONType.Number, total.value.value / count.value.value)
+
+defAccumulator(Accumulator("$avg", lambda: avgState(0.0, 0), avgAccumulate, avgMerge, avgFinalize))
+
+
+# $min / $max ignore null and missing values, the state is null until a value arrives
+
+def minAccumulate(state: BSONValue, value: BSONValue) -> BSONValue:
+    if isNullish(value):
+        return state
+    if state.bsonType == BSONType.Null or fromJust(BSONValue.compare(value, state)) < 0:
+        return value
+    return state
+
+def maxAccumulate(state: BSONValue, value: BSONValue) -> BSONValue:
+    if isNullish(value):
+        return state
+    if state.bsonType == BSONType.Null or fromJust(BSONValue.compare(value, state)) > 0:
+        return value
+    return state
+
+defAccumulator(Accumulator("$min", lambda: NULL, minAccumulate, minAccumulate, lambda state: state))
+defAccumulator(Accumulator("$max", lambda: NULL, maxAccumulate, maxAccumulate, lambda state: state))
+
+
+# $push collects every non missing value in input order
+
+def pushAccumulate(state: BSONValue, value: BSONValue) -> BSONValue:
+    if value.bsonType == BSONType.EOO:
+        return state
+    elements = state.value.elements
+    elements.append(BSONElement(f"{len(elements)}", value))
+    return state
+
+def pushMerge(a: BSONValue, b: BSONValue) -> BSONValue:
+    for elm in b.value.elements:
+        pushAccumulate(a, elm.value)
+    return a
+
+defAccumulator(Accumulator("$push", lambda: BSONValue(BSONType.Array, BSONArray([])), pushAccumulate, pushMerge,
+                           lambda state: state))
@@ -2,14 +2,15 @@ from __future__ import annotations
 
 from abc import ABC, abstractmethod
 
-from dataclasses import dataclass
-from typing import NewType, Mapping, List, Callable
+from dataclasses import dataclass, field
+from typing import NewType, Mapping, List, Callable, Tuple
 from enum import Enum
 
-from mql.base.bson import BSONDocument, BSONArray, BSONValue, BSONType
+from mql.base.bson import BSONDocument, BSONArray, BSONElement, BSONValue, BSONType
 from mql.base.path import Path
 
-from fpy.data.either import Either, Right, Left
+from fpy.data.either import Either, Right, Left, isLeft, fromRight
+from fpy.data.maybe import fromMaybe
 
 VarEnv = NewType("VarEnv", Mapping[str, BSONValue])
 
@@ -42,9 +43,113 @@ class OpExpr(AggExpr):
             return Left(f"Operator {self.op} is not defined")
         return evaluator(self.args, doc, variables)
 
+# variables that are always defined
+ROOT = "ROOT"
+CURRENT = "CURRENT"
+REMOVE = "REMOVE"
+
+MISSING = BSONValue.eoo()
+
 @dataclass
 class FieldPathExpr(AggExpr):
+    """
+    "$a.b" reads path a.b of the current document, "$$v.a.b" reads it from variable v.
+
+    Arrays along the path are traversed like the server does: the rest of the path is
+    applied to every element that is a document, nested arrays produce nested results,
+    and the collected values form an array. Path components are always field names,
+    never array positions.
+    """
     path: Path
+    variable: str = CURRENT
+    # path.parts frozen at construction, evaluate walks these without slicing the Path
+    keys: Tuple[str, ...] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.keys = tuple(self.path.parts)
+
+    def evaluate(self, doc, variables):
+        base = variables.get(self.variable, None)
+        if base is None:
+            if self.variable in (ROOT, CURRENT):
+                return Right(walkDocument(doc, self.keys, 0))
+            if self.variable == REMOVE:
+                return Right(MISSING)
+            return Left(f"Use of undefined variable: {self.variable}")
+        if not self.keys:
+            return Right(base)
+        return Right(walkValue(base, self.keys, 0))
+
+def walkDocument(doc: BSONDocument, keys: Tuple[str, ...], start: int) -> BSONValue:
+    if start == len(keys):
+        return BSONValue(BSONType.Document, doc)
+    elem = fromMaybe(None, doc[keys[start]])
+    if elem is None:
+        return MISSING
+    return walkValue(elem.value, keys, start + 1)
+
+def walkValue(value: BSONValue, keys: Tuple[str, ...], start: int) -> BSONValue:
+    nKeys = len(keys)
+    idx = start
+    while idx < nKeys:
+        bsonType = value.bsonType
+        if bsonType == BSONType.Document:
+            elem = fromMaybe(None, value.value[keys[idx]])
+            if elem is None:
+                return MISSING
+            value = elem.value
+            idx += 1
+        elif bsonType == BSONType.Array:
+            return walkArray(value.value, keys, idx)
+        else:
+            return MISSING
+    return value
+
+def walkArray(arr: BSONArray, keys: Tuple[str, ...], start: int) -> BSONValue:
+    out = []
+    for elm in arr.elements:
+        bsonType = elm.value.bsonType
+        if bsonType == BSONType.Document:
+            res = walkValue(elm.value, keys, start)
+            if res.bsonType != BSONType.EOO:
+                out.append(res)
+        elif bsonType == BSONType.Array:
+            out.append(walkArray(elm.value.value, keys, start))
+    return BSONValue(BSONType.Array, BSONArray([BSONElement(f"{idx}", value) for idx, value in enumerate(out)]))
+
+@dataclass
+class ObjectExpr(AggExpr):
+    """
+    A document whose field values are expressions, fields evaluating to missing are left out
+    """
+    fields: List[Tuple[str, AggExpr]]
+
+    def evaluate(self, doc, variables):
+        elements = []
+        for fieldName, expr in self.fields:
+            res = expr.evaluate(doc, variables)
+            if isLeft(res):
+                return res
+            value = fromRight(None, res)
+            if value.bsonType != BSONType.EOO:
+                elements.append(BSONElement(fieldName, value))
+        return Right(BSONValue(BSONType.Document, BSONDocument(elements)))
+
+@dataclass
+class ArrayExpr(AggExpr):
+    """
+    An array whose elements are expressions, missing elements become null
+    """
+    items: List[AggExpr]
 
     def evaluate(self, doc, variables):
-        return Left("Not yet implemented")
+        elements = []
+        for idx, expr in enumerate(self.items):
+            res = expr.evaluate(doc, variables)
+            if isLeft(res):
+                return res
+            value = fromRight(None, res)
+            if value.bsonType == BSONType.EOO:
+                value = BSONValue(BSONType.Null, None)
+            elements.append(BSONElement(f"{idx}", value))
+        return Right(BSONValue(BSONType.Array, BSONArray(elements)))
@@ -0,0 +1,199 @@
+"""
+The $group stage.
+
+Groups live in a dict keyed by the sort key of their _id, so values the server
+considers equal (1 and 1.0, null and missing) share a group. Memory use is estimated as
+groups are created and grow. Once it crosses maxMemoryBytes the stage either fails, or
+with allowDiskUse hash partitions the groups it holds into temporary files. After the
+input is exhausted every partition is read back on its own, record by record, and its
+partial groups merged. Merging is bounded by maxMemoryBytes as well: a partition whose
+groups outgrow it is partitioned again with another hash seed, recursively, so however
+many distinct keys there are, only the groups of one small enough partition are held
+in memory at a time.
+
+A spilled group is written as the BSON document {k: <_id value>, s: [<state>, ...]}.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from mql.agg.accumulators import Accumulator, Accumulators, NULL, GROUP_OVERHEAD, approxSize
+from mql.agg.expr import AggExpr, ConstExpr
+from mql.agg.parser import parseAggExpr
+from mql.agg.pipeline import Stage, PipelineOptions, AggregationError, defStage, evaluate
+from mql.agg.spill import spillFile, writeRecord, readRecords
+from mql.base.bson import BSONArray, BSONDocument, BSONElement, BSONValue, BSONType
+
+from fpy.data.either import Either, Left, Right, isLeft, fromRight
+
+# the server's internalDocumentSourceGroupMaxMemoryBytes
+MAX_MEMORY_BYTES = PipelineOptions().maxMemoryBytes
+
+SPILL_PARTITIONS = 16
+
+# partitioning levels before giving up on a partition that does not fit, e.g. a single
+# group whose $push array alone is over the limit
+MAX_SPILL_DEPTH = 8
+
+@dataclass
+class Group:
+    key: BSONValue
+    states: List[BSONValue]
+
+@dataclass
+class GroupStage(Stage):
+    idExpr: AggExpr
+    # output field name, accumulator, its argument
+    accumulators: List[Tuple[str, Accumulator, AggExpr]]
+    allowDiskUse: bool = False
+    maxMemoryBytes: int = MAX_MEMORY_BYTES
+    partitions: int = SPILL_PARTITIONS
+    spillDir: Optional[str] = None
+    # number of times groups were written out, across runs
+    spills: int = field(default=0, compare=False)
+
+    def configure(self, options: PipelineOptions):
+        self.allowDiskUse = options.allowDiskUse
+        self.maxMemoryBytes = options.maxMemoryBytes
+        self.spillDir = options.tempDir
+
+    def apply(self, docs, variables):
+        groups: Dict[bytes, Group] = dict()
+        memory = 0
+        partitions: Optional[List] = None
+        try:
+            for doc in docs:
+                key = evaluate(self.idExpr, doc, variables)
+                if key.bsonType == BSONType.EOO:
+                    key = NULL
+                groupKey = key.sortKey()
+                group = groups.get(groupKey, None)
+                if group is None:
+                    group = Group(key, [acc.init() for _, acc, _ in self.accumulators])
+                    groups[groupKey] = group
+                    memory += GROUP_OVERHEAD + approxSize(key)
+                states = group.states
+                for idx, (_, acc, argExpr) in enumerate(self.accumulators):
+                    value = evaluate(argExpr, doc, variables)
+                    states[idx] = acc.accumulate(states[idx], value)
+                    if acc.name == "$push":
+                        memory += 48 + approxSize(value)
+                if memory > self.maxMemoryBytes:
+                    if not self.allowDiskUse:
+                        raise AggregationError("Exceeded memory limit for $group, but didn't allow external spilling;"
+                                               " pass allowDiskUse to opt in")
+                    if partitions is None:
+                        partitions = [spillFile(self.spillDir) for _ in range(self.partitions)]
+                    self.spill(groups, partitions, 0)
+                    groups = dict()
+                    memory = 0
+
+            if partitions is None:
+                yield from (self.output(group) for group in groups.values())
+                return
+            self.spill(groups, partitions, 0)
+            groups = dict()
+            for partition in partitions:
+                yield from self.mergePartition(partition, 1)
+        finally:
+            for partition in partitions or []:
+                partition.close()
+
+    def output(self, group: Group) -> BSONDocument:
+        elements = [BSONElement("_id", group.key)]
+        for (name, acc, _), state in zip(self.accumulators, group.states):
+            elements.append(BSONElement(name, acc.finalize(state)))
+        return BSONDocument(elements)
+
+    def spill(self, groups: Dict[bytes, Group], partitions: List, seed: int):
+        """
+        Appends every group to its partition, chosen by a hash of its key salted with seed
+        """
+        self.spills += 1
+        for groupKey, group in groups.items():
+            record = BSONDocument([BSONElement("k", group.key),
+                                   BSONElement("s", BSONValue(BSONType.Array, BSONArray(
+                                       [BSONElement(f"{idx}", state) for idx, state in enumerate(group.states)])))])
+            writeRecord(partitions[hash((seed, groupKey)) % len(partitions)], record)
+
+    def mergePartition(self, partition, depth: int) -> Iterator[BSONDocument]:
+        """
+        The merged groups of a partition, partitioned again with depth as the seed while
+        they do not fit in maxMemoryBytes
+        """
+        groups: Dict[bytes, Group] = dict()
+        memory = 0
+        subPartitions: Optional[List] = None
+        try:
+            for record in readRecords(partition):
+                key, states = record.elements[0].value, [elm.value for elm in record.elements[1].value.value.elements]
+                groupKey = key.sortKey()
+                group = groups.get(groupKey, None)
+                if group is None:
+                    groups[groupKey] = Group(key, states)
+                    memory += GROUP_OVERHEAD + approxSize(key) + sum(map(approxSize, states))
+                else:
+                    for idx, (_, acc, _) in enumerate(self.accumulators):
+                        group.states[idx] = acc.merge(group.states[idx], states[idx])
+                        if acc.name == "$push":
+                            memory += approxSize(states[idx])
+                if memory > self.maxMemoryBytes:
+                    if depth >= MAX_SPILL_DEPTH:
+                        raise AggregationError("Exceeded memory limit for $group while merging spilled groups")
+                    if subPartitions is None:
+                        subPartitions = [spillFile(self.spillDir) for _ in range(self.partitions)]
+                    self.spill(groups, subPartitions, depth)
+                    groups = dict()
+                    memory = 0
+
+            if subPartitions is None:
+                yield from (self.output(group) for group in groups.values())
+                return
+            self.spill(groups, subPartitions, depth)
+            groups = dict()
+            for subPartition in subPartitions:
+                yield from self.mergePartition(subPartition, depth + 1)
+        finally:
+            for subPartition in subPartitions or []:
+                subPartition.close()
+
+
+def parseAccumulator(name: str, value: BSONValue) -> Either[str, Tuple[str, Accumulator, AggExpr]]:
+    if value.bsonType != BSONType.Document or len(value.value.elements) != 1:
+        return Left(f"The field {name!r} must be an accumulator object")
+    elm = value.value.elements[0]
+    if elm.fieldName == "$count":
+        if elm.value.bsonType != BSONType.Document or elm.value.value.elements:
+            return Left("$count takes no arguments, i.e. $count:{}")
+        return Right((name, Accumulators["$sum"], ConstExpr(BSONValue(BSONType.Int32, 1))))
+    acc = Accumulators.get(elm.fieldName, None)
+    if acc is None:
+        return Left(f"Unknown group operator {elm.fieldName!r}")
+    if elm.value.bsonType == BSONType.Array:
+        return Left(f"The {elm.fieldName} accumulator is a unary operator")
+    return parseAggExpr(elm.value) | (lambda expr: (name, acc, expr))
+
+@defStage("$group")
+def parseGroup(value: BSONValue) -> Either[str, Stage]:
+    if value.bsonType != BSONType.Document:
+        return Left("A group's fields must be specified in an object")
+    idExpr = None
+    accumulators = []
+    for elm in value.value.elements:
+        if elm.fieldName == "_id":
+            res = parseAggExpr(elm.value)
+            if isLeft(res):
+                return res
+            idExpr = fromRight(None, res)
+            continue
+        if "." in elm.fieldName or elm.fieldName.startswith("$"):
+            return Left(f"Invalid group output field name {elm.fieldName!r}")
+        res = parseAccumulator(elm.fieldName, elm.value)
+        if isLeft(res):
+            return res
+        accumulators.append(fromRight(None, res))
+    if idExpr is None:
+        return Left("A group specification must include an _id")
+    return Right(GroupStage(idExpr, accumulators))
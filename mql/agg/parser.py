@@ -0,0 +1,72 @@
+from mql.agg.expr import AggExpr, AggOperator, ConstExpr, OpExpr, FieldPathExpr, ObjectExpr, ArrayExpr
+from mql.base.bson import BSONValue, BSONType, stringValue
+from mql.base.path import Path
+
+from fpy.data.either import Either, Left, Right, isLeft, fromRight
+
+def parseAggExpr(value: BSONValue) -> Either[str, AggExpr]:
+    """
+Expression := FieldPath                ("$a.b")
+            | Variable                 ("$$ROOT", "$$v.a.b")
+            | { $literal: <value> }
+            | { $operator: <args> }
+            | { field: Expression * }
+            | [ Expression * ]
+            | <constant>
+    """
+    if value.bsonType == BSONType.String:
+        s = stringValue(value)
+        if s.startswith("$$"):
+            variable, _, rest = s[2:].partition(".")
+            if not variable or (rest and "" in rest.split(".")):
+                return Left(f"Invalid variable reference {s!r}")
+            return Right(FieldPathExpr(Path.fromString(rest) if rest else Path(), variable))
+        if s.startswith("$"):
+            if len(s) == 1 or "" in s[1:].split("."):
+                return Left(f"Invalid field path {s!r}")
+            return Right(FieldPathExpr(Path.fromString(s[1:])))
+        return Right(ConstExpr(value))
+
+    if value.bsonType == BSONType.Document:
+        elements = value.value.elements
+        if elements and elements[0].fieldName.startswith("$"):
+            return parseOperatorExpr(value)
+        fields = []
+        for elm in elements:
+            if "." in elm.fieldName or elm.fieldName.startswith("$"):
+                return Left(f"Invalid field name {elm.fieldName!r} in expression object")
+            res = parseAggExpr(elm.value)
+            if isLeft(res):
+                return res
+            fields.append((elm.fieldName, fromRight(None, res)))
+        return Right(ObjectExpr(fields))
+
+    if value.bsonType == BSONType.Array:
+        items = []
+        for elm in value.value.elements:
+            res = parseAggExpr(elm.value)
+            if isLeft(res):
+                return res
+            items.append(fromRight(None, res))
+        return Right(ArrayExpr(items))
+
+    return Right(ConstExpr(value))
+
+def parseOperatorExpr(value: BSONValue) -> Either[str, AggExpr]:
+    elements = value.value.elements
+    if len(elements) != 1:
+        return Left(f"An expression object with an operator must have exactly one field, got {len(elements)}")
+    name, argument = elements[0].fieldName, elements[0].value
+    if name == "$literal":
+        return Right(ConstExpr(argument))
+    operator = next((op for op in AggOperator if op.value == name), None)
+    if operator is None:
+        return Left(f"Unknown expression operator {name}")
+    argElements = argument.value.elements if argument.bsonType == BSONType.Array else None
+    args = []
+    for arg in ([elm.value for elm in argElements] if argElements is not None else [argument]):
+        res = parseAggExpr(arg)
+        if isLeft(res):
+            return res
+        args.append(fromRight(None, res))
+    return Right(OpExpr(operator, args))
@@ -0,0 +1,453 @@
+"""
+Streaming execution of aggregation pipelines.
+
+Every stage turns an iterator of documents into another one, and the pipeline chains
+them as generators: a document travels through all stages before the next one is pulled
+from the source, so memory stays bounded by whatever state a single stage keeps. $limit
+is an islice, once it is satisfied nothing upstream is pulled anymore, so a lazy source
+(a DocumentSequence, a cursor over a file) stops decoding as well.
+
+Before running, optimize() rewrites the stage list the way the server does:
+  - adjacent $match stages merge into a single $and
+  - $match moves ahead of $project / $addFields that leave the fields it reads untouched
+  - $limit / $skip move ahead of stages that map documents one to one
+  - $limit folds into a preceding $sort, which then only keeps the top documents
+  - adjacent $limit / $skip stages coalesce, $skip n + $limit m becomes $limit n+m + $skip n
+
+Evaluation errors are raised as AggregationError while streaming, run() surfaces them
+as a Left.
+"""
+
+from __future__ import annotations
+
+import itertools
+import math
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Callable, ClassVar, Dict, Iterable, Iterator, List, Optional, Union
+
+from mql.agg.expr import AggExpr, VarEnv
+from mql.agg.parser import parseAggExpr
+from mql.base.bson import BSONDocument, BSONArray, BSONElement, BSONValue, BSONType, NumericTypes
+from mql.base.path import Path
+from mql.matchExpr.querySelector import (MatchableExpression, PathMatchExpression, TreeExpression, TreeOperator,
+                                         NotExpression)
+from mql.matchExpr.planCache import parsePredicateCached
+
+from fpy.data.either import Either, Left, Right, isLeft, fromLeft, fromRight
+
+class AggregationError(Exception):
+    """
+    Raised while streaming documents through a pipeline, surfaced by Pipeline.run as a Left
+    """
+    pass
+
+def evaluate(expr: AggExpr, doc: BSONDocument, variables: VarEnv) -> BSONValue:
+    res = expr.evaluate(doc, variables)
+    if isLeft(res):
+        raise AggregationError(fromLeft(None, res))
+    return fromRight(None, res)
+
+
+@dataclass
+class PipelineOptions:
+    # let blocking stages spill to temporary files instead of failing at their memory limit
+    allowDiskUse: bool = False
+    maxMemoryBytes: int = 100 * 1024 * 1024
+    tempDir: Optional[str] = None
+
+class Stage(ABC):
+    # emits exactly one document per input document, in order
+    oneToOne: ClassVar[bool] = False
+
+    def configure(self, options: PipelineOptions):
+        """
+        Called before the stage runs, for stages that depend on the pipeline's options
+        """
+        pass
+
+    @abstractmethod
+    def apply(self, docs: Iterator[BSONDocument], variables: VarEnv) -> Iterator[BSONDocument]:
+        raise NotImplementedError
+
+    def canSwapMatch(self, paths: List[Path]) -> bool:
+        """
+        Whether a $match reading only paths gives the same result before this stage
+        """
+        return False
+
+    def absorbLimit(self, limit: int) -> Optional[Stage]:
+        """
+        A single stage doing the work of this stage followed by $limit, if there is one
+        """
+        return None
+
+
+@dataclass
+class MatchStage(Stage):
+    expr: MatchableExpression
+
+    def apply(self, docs, variables):
+        return filter(self.expr.compile(), docs)
+
+@dataclass
+class LimitStage(Stage):
+    limit: int
+
+    def apply(self, docs, variables):
+        return itertools.islice(docs, self.limit)
+
+@dataclass
+class SkipStage(Stage):
+    skip: int
+
+    def apply(self, docs, variables):
+        return itertools.islice(docs, self.skip, None)
+
+
+# A projection / $addFields specification with dotted paths expanded into nested dicts.
+# Leaves are True / False for inclusion / exclusion, or an expression to compute.
+FieldTree = Dict[str, Union[bool, AggExpr, "FieldTree"]]
+
+def isMissing(value: BSONValue) -> bool:
+    return value.bsonType == BSONType.EOO
+
+def toArray(values: List[BSONValue]) -> BSONValue:
+    return BSONValue(BSONType.Array, BSONArray([BSONElement(f"{idx}", value) for idx, value in enumerate(values)]))
+
+def treeHasComputed(tree: FieldTree) -> bool:
+    return any(isinstance(spec, AggExpr) or (isinstance(spec, dict) and treeHasComputed(spec)) for spec in tree.values())
+
+@dataclass
+class ProjectStage(Stage):
+    tree: FieldTree
+    inclusion: bool
+    oneToOne: ClassVar[bool] = True
+
+    def apply(self, docs, variables):
+        if self.inclusion:
+            return (self.include(doc, self.tree, doc, variables) for doc in docs)
+        return (self.exclude(doc, self.tree) for doc in docs)
+
+    def include(self, doc: BSONDocument, tree: FieldTree, root: BSONDocument, variables: VarEnv) -> BSONDocument:
+        out = []
+        for elm in doc.elements:
+            spec = tree.get(elm.fieldName, None)
+            if spec is True:
+                out.append(elm)
+            elif isinstance(spec, dict):
+                value = self.includeValue(elm.value, spec, root, variables)
+                if value is not None:
+                    out.append(BSONElement(elm.fieldName, value))
+        # computed fields come after the ones kept from the input, in specification order
+        for fieldName, spec in tree.items():
+            if isinstance(spec, AggExpr):
+                value = evaluate(spec, root, variables)
+                if not isMissing(value):
+                    out.append(BSONElement(fieldName, value))
+            elif isinstance(spec, dict) and fieldName not in doc and treeHasComputed(spec):
+                sub = self.include(BSONDocument([]), spec, root, variables)
+                out.append(BSONElement(fieldName, BSONValue(BSONType.Document, sub)))
+        return BSONDocument(out)
+
+    def includeValue(self, value: BSONValue, tree: FieldTree, root: BSONDocument, variables: VarEnv) -> Optional[BSONValue]:
+        if value.bsonType == BSONType.Document:
+            return BSONValue(BSONType.Document, self.include(value.value, tree, root, variables))
+        if value.bsonType == BSONType.Array:
+            values = [self.includeValue(elm.value, tree, root, variables) for elm in value.value.elements]
+            return toArray([v for v in values if v is not None])
+        # scalars have no sub fields to keep
+        return None
+
+    def exclude(self, doc: BSONDocument, tree: FieldTree) -> BSONDocument:
+        out = []
+        for elm in doc.elements:
+            spec = tree.get(elm.fieldName, None)
+            if spec is False:
+                continue
+            if isinstance(spec, dict):
+                out.append(BSONElement(elm.fieldName, self.excludeValue(elm.value, spec)))
+            else:
+                out.append(elm)
+        return BSONDocument(out)
+
+    def excludeValue(self, value: BSONValue, tree: FieldTree) -> BSONValue:
+        if value.bsonType == BSONType.Document:
+            return BSONValue(BSONType.Document, self.exclude(value.value, tree))
+        if value.bsonType == BSONType.Array:
+            return toArray([self.excludeValue(elm.value, tree) for elm in value.value.elements])
+        return value
+
+    def canSwapMatch(self, paths):
+        if self.inclusion:
+            # only fields passed through unchanged, computed ones may shadow the input
+            return all(self.tree.get(path.head(), None) is True for path in paths)
+        return all(path.head() not in self.tree for path in paths)
+
+@dataclass
+class AddFieldsStage(Stage):
+    tree: FieldTree
+    oneToOne: ClassVar[bool] = True
+
+    def apply(self, docs, variables):
+        return (self.addFields(doc, self.tree, doc, variables) for doc in docs)
+
+    def addFields(self, doc: BSONDocument, tree: FieldTree, root: BSONDocument, variables: VarEnv) -> BSONDocument:
+        out = list(doc.elements)
+        for fieldName, spec in tree.items():
+            idx = next((idx for idx, elm in enumerate(out) if elm.fieldName == fieldName), -1)
+            if isinstance(spec, dict):
+                value = self.addFieldsValue(out[idx].value if idx >= 0 else None, spec, root, variables)
+            else:
+                value = evaluate(spec, root, variables)
+            if isMissing(value):
+                if idx >= 0:
+                    del out[idx]
+            elif idx >= 0:
+                out[idx] = BSONElement(fieldName, value)
+            else:
+                out.append(BSONElement(fieldName, value))
+        return BSONDocument(out)
+
+    def addFieldsValue(self, value: Optional[BSONValue], tree: FieldTree, root: BSONDocument, variables: VarEnv) -> BSONValue:
+        if value is not None and value.bsonType == BSONType.Document:
+            return BSONValue(BSONType.Document, self.addFields(value.value, tree, root, variables))
+        if value is not None and value.bsonType == BSONType.Array:
+            return toArray([self.addFieldsValue(elm.value, tree, root, variables) for elm in value.value.elements])
+        # missing fields and scalars are replaced by a document holding the new fields
+        return BSONValue(BSONType.Document, self.addFields(BSONDocument([]), tree, root, variables))
+
+    def canSwapMatch(self, paths):
+        return all(path.head() not in self.tree for path in paths)
+
+
+def matchPaths(expr: MatchableExpression) -> Optional[List[Path]]:
+    """
+    Every path expr reads, None if it contains an expression we cannot see through
+    """
+    if isinstance(expr, PathMatchExpression):
+        return [expr.path]
+    if isinstance(expr, NotExpression):
+        return matchPaths(expr.expr)
+    if isinstance(expr, TreeExpression):
+        res = []
+        for child in expr.children:
+            paths = matchPaths(child)
+            if paths is None:
+                return None
+            res.extend(paths)
+        return res
+    return None
+
+def rewrite(first: Stage, second: Stage) -> Optional[List[Stage]]:
+    """
+    Replacement for the adjacent stages first, second, or None to keep them as they are
+    """
+    if isinstance(first, MatchStage) and isinstance(second, MatchStage):
+        return [MatchStage(TreeExpression(TreeOperator.AND, [first.expr, second.expr]))]
+    if isinstance(second, MatchStage):
+        paths = matchPaths(second.expr)
+        if paths is not None and first.canSwapMatch(paths):
+            return [second, first]
+    if isinstance(second, LimitStage):
+        absorbed = first.absorbLimit(second.limit)
+        if absorbed is not None:
+            return [absorbed]
+    if first.oneToOne and isinstance(second, (LimitStage, SkipStage)):
+        return [second, first]
+    if isinstance(first, LimitStage) and isinstance(second, LimitStage):
+        return [LimitStage(min(first.limit, second.limit))]
+    if isinstance(first, SkipStage) and isinstance(second, SkipStage):
+        return [SkipStage(first.skip + second.skip)]
+    if isinstance(first, SkipStage) and isinstance(second, LimitStage):
+        return [LimitStage(first.skip + second.limit), first]
+    return None
+
+
+@dataclass
+class Pipeline:
+    stages: List[Stage]
+    options: PipelineOptions = field(default_factory=PipelineOptions)
+
+    def optimize(self) -> Pipeline:
+        stages = list(self.stages)
+        changed = True
+        while changed:
+            changed = False
+            for idx in range(len(stages) - 1):
+                replacement = rewrite(stages[idx], stages[idx + 1])
+                if replacement is not None:
+                    stages[idx:idx + 2] = replacement
+                    changed = True
+                    break
+        return Pipeline(stages, self.options)
+
+    def stream(self, source: Iterable[BSONDocument], variables: Optional[VarEnv] = None) -> Iterator[BSONDocument]:
+        """
+        Lazily runs the pipeline over source, raises AggregationError on evaluation errors
+        """
+        variables = variables if variables is not None else dict()
+        docs = iter(source)
+        for stage in self.stages:
+            stage.configure(self.options)
+            docs = stage.apply(docs, variables)
+        return docs
+
+    def run(self, source: Iterable[BSONDocument], variables: Optional[VarEnv] = None) -> Either[str, List[BSONDocument]]:
+        try:
+            return Right(list(self.stream(source, variables)))
+        except AggregationError as e:
+            return Left(str(e))
+
+
+# Stage parsers
+
+StageParsers: Dict[str, Callable[[BSONValue], Either[str, Stage]]] = dict()
+
+def defStage(name: str):
+    global StageParsers
+    def res(fn):
+        StageParsers[name] = fn
+        return fn
+    return res
+
+def parseStage(spec: BSONDocument) -> Either[str, Stage]:
+    if len(spec.elements) != 1:
+        return Left(f"A pipeline stage specification must have exactly one field, got {len(spec.elements)}")
+    elm = spec.elements[0]
+    stageParser = StageParsers.get(elm.fieldName, None)
+    if stageParser is None:
+        return Left(f"Unrecognized pipeline stage name: {elm.fieldName!r}")
+    return stageParser(elm.value)
+
+def parsePipeline(stages: Union[BSONArray, List[BSONDocument]], options: Optional[PipelineOptions] = None) -> Either[str, Pipeline]:
+    specs = [elm.value for elm in stages.elements] if isinstance(stages, BSONArray) else \
+        [BSONValue(BSONType.Document, doc) for doc in stages]
+    res = []
+    for spec in specs:
+        if spec.bsonType != BSONType.Document:
+            return Left(f"Each element of the pipeline must be an object, got {spec.bsonType}")
+        stage = parseStage(spec.value)
+        if isLeft(stage):
+            return stage
+        res.append(fromRight(None, stage))
+    return Right(Pipeline(res, options if options is not None else PipelineOptions()))
+
+def integralValue(name: str, value: BSONValue, minimum: int) -> Either[str, int]:
+    if (value.bsonType not in NumericTypes or not math.isfinite(value.value)
+            or value.value != int(value.value)):
+        return Left(f"{name} requires an integral number, got {value}")
+    if value.value < minimum:
+        return Left(f"{name} must be at least {minimum}, got {value.value}")
+    return Right(int(value.value))
+
+@defStage("$match")
+def parseMatch(value: BSONValue) -> Either[str, Stage]:
+    if value.bsonType != BSONType.Document:
+        return Left("$match requires an object")
+    return parsePredicateCached(value.value) | MatchStage
+
+@defStage("$limit")
+def parseLimit(value: BSONValue) -> Either[str, Stage]:
+    return integralValue("$limit", value, 1) | LimitStage
+
+@defStage("$skip")
+def parseSkip(value: BSONValue) -> Either[str, Stage]:
+    return integralValue("$skip", value, 0) | SkipStage
+
+def mergeInto(node: FieldTree, name: str, spec) -> bool:
+    """
+    Sets node[name] = spec, merging sub trees. False on a collision.
+    """
+    if name not in node:
+        node[name] = spec
+        return True
+    existing = node[name]
+    if not (isinstance(existing, dict) and isinstance(spec, dict)):
+        return False
+    return all(mergeInto(existing, childName, childSpec) for childName, childSpec in spec.items())
+
+def insertPath(tree: FieldTree, path: str, spec) -> Optional[str]:
+    """
+    Adds spec under the dotted path, returns an error on collision
+    """
+    parts = path.split(".")
+    if "" in parts or parts[0].startswith("$"):
+        return f"Invalid field path {path!r}"
+    node = tree
+    for part in parts[:-1]:
+        child = node.setdefault(part, dict())
+        if not isinstance(child, dict):
+            return f"Path collision at {path}"
+        node = child
+    if not mergeInto(node, parts[-1], spec):
+        return f"Path collision at {path}"
+    return None
+
+def isExpressionObject(value: BSONValue) -> bool:
+    return (value.bsonType == BSONType.Document and bool(value.value.elements)
+            and value.value.elements[0].fieldName.startswith("$"))
+
+def parseFieldTree(value: BSONValue, leaf: Callable[[BSONValue], Either[str, object]], prefix: str = "") -> Either[str, FieldTree]:
+    """
+    Expands a specification into a FieldTree, nested plain objects become sub trees
+    """
+    tree: FieldTree = dict()
+    for elm in value.value.elements:
+        if elm.value.bsonType == BSONType.Document and not isExpressionObject(elm.value):
+            if not elm.value.value.elements:
+                return Left(f"An empty object is not a valid value for {prefix + elm.fieldName!r}")
+            spec = parseFieldTree(elm.value, leaf, prefix + elm.fieldName + ".")
+        else:
+            spec = leaf(elm.value)
+        if isLeft(spec):
+            return spec
+        err = insertPath(tree, elm.fieldName, fromRight(None, spec))
+        if err is not None:
+            return Left(prefix + err)
+    return Right(tree)
+
+def projectionLeaf(value: BSONValue) -> Either[str, object]:
+    if value.bsonType in NumericTypes or value.bsonType == BSONType.Boolean:
+        return Right(bool(value.value))
+    return parseAggExpr(value)
+
+def treeLeaves(tree: FieldTree, top: bool = True):
+    for fieldName, spec in tree.items():
+        if isinstance(spec, dict):
+            yield from treeLeaves(spec, False)
+        else:
+            yield top and fieldName == "_id", spec
+
+@defStage("$project")
+def parseProject(value: BSONValue) -> Either[str, Stage]:
+    if value.bsonType != BSONType.Document:
+        return Left("$project specification must be an object")
+    if not value.value.elements:
+        return Left("$project requires at least one output field")
+    res = parseFieldTree(value, projectionLeaf)
+    if isLeft(res):
+        return res
+    tree = fromRight(None, res)
+    leaves = list(treeLeaves(tree))
+    excluded = any(spec is False for isId, spec in leaves if not isId)
+    included = any(spec is not False for isId, spec in leaves if not isId)
+    if excluded and included:
+        return Left("Cannot mix inclusion and exclusion in a $project specification")
+    if not excluded and not included:
+        # only _id was specified
+        inclusion = tree["_id"] is not False
+    else:
+        inclusion = included
+    if inclusion and "_id" not in tree:
+        tree = {"_id": True, **tree}
+    return Right(ProjectStage(tree, inclusion))
+
+@defStage("$addFields")
+def parseAddFields(value: BSONValue) -> Either[str, Stage]:
+    if value.bsonType != BSONType.Document:
+        return Left("$addFields specification must be an object")
+    res = parseFieldTree(value, parseAggExpr)
+    return res | AddFieldsStage
+
+StageParsers["$set"] = parseAddFields
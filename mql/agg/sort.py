@@ -0,0 +1,265 @@
+"""
+The $sort stage.
+
+Documents are ordered by the sort key of each sort field (see BSONValue.sortKey), which
+follows the server's comparison order across types. An array sorts by its smallest
+element in an ascending sort and by its largest in a descending one, a missing field
+sorts like null and an empty array below both. Paths are resolved like the matcher
+resolves them: a numeric part such as the 0 of a.0 picks that element of an array, any
+other part is looked up in each document element. The sort is stable, equal documents
+keep their input order.
+
+A $limit directly after $sort is folded into the stage: only the top limit documents are
+kept, in a heap. Otherwise documents are buffered until their estimated size crosses
+maxMemoryBytes. The stage then either fails, or with allowDiskUse sorts the buffer and
+writes it to a temporary file as a run of BSON documents. A heap that grows past
+maxMemoryBytes, for a large limit, is handled the same way: the top-k sort turns into
+an external one.
+
+Runs are merged at most fanIn at a time, reading one document per run at once. Every
+fanIn runs of a level are merged into one run of the next level as soon as they are
+written, so the number of open run files grows with the log of the input size. Once the
+input is exhausted the remaining runs are merged, in passes of fanIn if there are still
+more than that, and streamed out.
+"""
+
+from __future__ import annotations
+
+import heapq
+from dataclasses import dataclass, field
+from itertools import chain, islice
+from typing import Iterator, List, Optional, Tuple
+
+from mql.agg.accumulators import approxSize
+from mql.agg.pipeline import Stage, PipelineOptions, AggregationError, defStage
+from mql.agg.spill import spillFile, writeRecord, readRecords
+from mql.base.bson import BSONDocument, BSONValue, BSONType, NumericTypes
+from mql.base.path import Path
+
+from fpy.data.either import Either, Left, Right
+from fpy.data.maybe import fromMaybe
+
+# the server's internalQueryMaxBlockingSortMemoryUsageBytes
+MAX_MEMORY_BYTES = PipelineOptions().maxMemoryBytes
+
+# runs merged at once
+MERGE_FAN_IN = 64
+
+# sort key of a missing field
+NULL_KEY = BSONValue(BSONType.Null, None).sortKey()
+# an empty array sorts below null, above MinKey, like the server's undefined
+EMPTY_ARRAY_KEY = bytes([NULL_KEY[0] - 1, 1])
+
+class Descending:
+    """
+    Wraps the key of a descending sort field, inverting its order
+    """
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other: Descending) -> bool:
+        return other.key < self.key
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Descending) and self.key == other.key
+
+def collectValues(value: BSONValue, parts: Tuple[str, ...], idx: int, out: List[BSONValue]) -> bool:
+    """
+    Appends the values parts[idx:] reaches from value to out, an array at the end of the
+    path contributing its elements. Returns whether an empty array was reached.
+    """
+    while idx < len(parts):
+        bsonType = value.bsonType
+        if bsonType == BSONType.Document:
+            elem = fromMaybe(None, value.value[parts[idx]])
+            if elem is None:
+                return False
+            value = elem.value
+            idx += 1
+        elif bsonType == BSONType.Array:
+            part = parts[idx]
+            if part.isdigit():
+                elem = fromMaybe(None, value.value[int(part)])
+                return elem is not None and collectValues(elem.value, parts, idx + 1, out)
+            empty = False
+            for elm in value.value.elements:
+                if elm.value.bsonType == BSONType.Document:
+                    empty = collectValues(elm.value, parts, idx, out) or empty
+            return empty
+        else:
+            return False
+    if value.bsonType == BSONType.Array:
+        out.extend(elm.value for elm in value.value.elements)
+        return not value.value.elements
+    if value.bsonType != BSONType.EOO:
+        out.append(value)
+    return False
+
+@dataclass
+class SortStage(Stage):
+    # path, ascending
+    fields: List[Tuple[Path, bool]]
+    limit: Optional[int] = None
+    allowDiskUse: bool = False
+    maxMemoryBytes: int = MAX_MEMORY_BYTES
+    spillDir: Optional[str] = None
+    fanIn: int = MERGE_FAN_IN
+    # number of runs written out, across runs of the stage
+    spills: int = field(default=0, compare=False)
+    # path parts frozen at construction, next to their direction
+    keys: List[Tuple[Tuple[str, ...], bool]] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.keys = [(tuple(path.parts), ascending) for path, ascending in self.fields]
+
+    def configure(self, options: PipelineOptions):
+        self.allowDiskUse = options.allowDiskUse
+        self.maxMemoryBytes = options.maxMemoryBytes
+        self.spillDir = options.tempDir
+
+    def canSwapMatch(self, paths):
+        return True
+
+    def absorbLimit(self, limit):
+        return SortStage(self.fields, limit if self.limit is None else min(self.limit, limit), fanIn=self.fanIn)
+
+    def sortKey(self, doc: BSONDocument) -> Tuple:
+        key = []
+        for parts, ascending in self.keys:
+            values: List[BSONValue] = []
+            empty = collectValues(BSONValue(BSONType.Document, doc), parts, 0, values)
+            if values:
+                valueKeys = [value.sortKey() for value in values]
+                fieldKey = min(valueKeys) if ascending else max(valueKeys)
+            else:
+                fieldKey = EMPTY_ARRAY_KEY if empty else NULL_KEY
+            key.append(fieldKey if ascending else Descending(fieldKey))
+        return tuple(key)
+
+    def apply(self, docs, variables):
+        if self.limit is not None:
+            return self.topK(iter(docs))
+        return self.externalSort(docs)
+
+    def topK(self, docs: Iterator[BSONDocument]) -> Iterator[BSONDocument]:
+        # a max heap of the best limit documents so far, with ties broken by input order:
+        # entries are (Descending(key), Descending(position), size, doc)
+        heap: List[Tuple] = []
+        memory = 0
+        for position, doc in enumerate(docs):
+            key = self.sortKey(doc)
+            if len(heap) == self.limit:
+                if not key < heap[0][0].key:
+                    continue
+                memory -= heap[0][2]
+                size = approxSize(BSONValue(BSONType.Document, doc))
+                heapq.heapreplace(heap, (Descending(key), Descending(position), size, doc))
+            else:
+                size = approxSize(BSONValue(BSONType.Document, doc))
+                heapq.heappush(heap, (Descending(key), Descending(position), size, doc))
+            memory += size
+            if memory > self.maxMemoryBytes:
+                if not self.allowDiskUse:
+                    raise AggregationError("Exceeded memory limit for $sort, but didn't allow external sorting;"
+                                           " pass allowDiskUse to opt in")
+                # the documents kept so far, back in input order, ahead of the rest
+                kept = [entry[3] for entry in sorted(heap, key=lambda entry: entry[1].key)]
+                heap = []
+                yield from islice(self.externalSort(chain(kept, docs)), self.limit)
+                return
+        # the heap orders from worst to best
+        for entry in sorted(heap, reverse=True):
+            yield entry[3]
+
+    def externalSort(self, docs: Iterator[BSONDocument]) -> Iterator[BSONDocument]:
+        buffered: List[BSONDocument] = []
+        memory = 0
+        # levels[i] holds runs merged from fanIn runs of level i - 1, a higher level only
+        # holds documents from earlier in the input than a lower one
+        levels: List[List] = []
+        try:
+            for doc in docs:
+                buffered.append(doc)
+                memory += approxSize(BSONValue(BSONType.Document, doc))
+                if memory > self.maxMemoryBytes:
+                    if not self.allowDiskUse:
+                        raise AggregationError("Exceeded memory limit for $sort, but didn't allow external sorting;"
+                                               " pass allowDiskUse to opt in")
+                    self.addRun(levels, self.spill(buffered))
+                    buffered = []
+                    memory = 0
+
+            buffered.sort(key=self.sortKey)
+            if not levels:
+                yield from buffered
+                return
+            self.addRun(levels, self.spill(buffered))
+            buffered = []
+            # in input order, merge takes equal keys from earlier runs first, keeping the sort stable
+            runs = [run for level in reversed(levels) for run in level]
+            levels = [runs]
+            while len(runs) > self.fanIn:
+                runs[:self.fanIn] = [self.mergeRuns(runs[:self.fanIn])]
+            yield from heapq.merge(*(readRecords(run) for run in runs), key=self.sortKey)
+        finally:
+            for level in levels:
+                for run in level:
+                    run.close()
+
+    def addRun(self, levels: List[List], run):
+        level = 0
+        while True:
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(run)
+            if len(levels[level]) < self.fanIn:
+                return
+            run = self.mergeRuns(levels[level])
+            levels[level] = []
+            level += 1
+
+    def mergeRuns(self, runs: List):
+        """
+        Merges runs into a new one and closes them
+        """
+        self.spills += 1
+        out = spillFile(self.spillDir)
+        try:
+            for doc in heapq.merge(*(readRecords(run) for run in runs), key=self.sortKey):
+                writeRecord(out, doc)
+        except BaseException:
+            out.close()
+            raise
+        for run in runs:
+            run.close()
+        return out
+
+    def spill(self, docs: List[BSONDocument]):
+        self.spills += 1
+        docs.sort(key=self.sortKey)
+        run = spillFile(self.spillDir)
+        try:
+            for doc in docs:
+                writeRecord(run, doc)
+        except BaseException:
+            run.close()
+            raise
+        return run
+
+
+@defStage("$sort")
+def parseSort(value: BSONValue) -> Either[str, Stage]:
+    if value.bsonType != BSONType.Document:
+        return Left("the $sort key specification must be an object")
+    if not value.value.elements:
+        return Left("$sort stage must have at least one sort key")
+    fields = []
+    for elm in value.value.elements:
+        if not elm.fieldName or elm.fieldName.startswith("$") or "" in elm.fieldName.split("."):
+            return Left(f"Invalid $sort field name {elm.fieldName!r}")
+        if elm.value.bsonType not in NumericTypes or elm.value.value not in (1, -1):
+            return Left(f"$sort key ordering must be 1 (for ascending) or -1 (for descending), got {elm.value}")
+        fields.append((Path.fromString(elm.fieldName), elm.value.value == 1))
+    return Right(SortStage(fields))
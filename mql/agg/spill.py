@@ -0,0 +1,61 @@
+"""
+Temporary files of BSON records, for the stages that spill to disk.
+
+Records are written to the file one at a time as they are produced and read back one
+at a time, so neither direction holds more than a single record in memory beyond what
+the file object buffers.
+
+Documents read back are equal to the ones written. The decoder keeps the terminating NUL
+of a string while the encoder only adds one when it is missing, so "s" and "s\x00" would
+both come back as "s\x00". Every string is therefore written with one more NUL than it
+has and has exactly one stripped when it is read.
+"""
+
+from __future__ import annotations
+
+import tempfile
+from typing import Callable, Iterator, Optional
+
+from mql.agg.pipeline import AggregationError
+from mql.base.bson import BSONDocument, BSONArray, BSONElement, BSONValue, BSONType
+from mql.base.bsonDecoder import readDocument
+from mql.base.bsonEncoder import encodeInto
+
+from fpy.data.either import isLeft, fromLeft
+
+def mapStrings(doc: BSONDocument, fn: Callable[[str], str]) -> BSONDocument:
+    return BSONDocument([BSONElement(elm.fieldName, mapStringValue(elm.value, fn)) for elm in doc.elements])
+
+def mapStringValue(value: BSONValue, fn: Callable[[str], str]) -> BSONValue:
+    bsonType = value.bsonType
+    if bsonType == BSONType.String:
+        return BSONValue(bsonType, fn(value.value))
+    if bsonType == BSONType.Document:
+        return BSONValue(bsonType, mapStrings(value.value, fn))
+    if bsonType == BSONType.Array:
+        return BSONValue(bsonType, BSONArray([BSONElement(elm.fieldName, mapStringValue(elm.value, fn))
+                                              for elm in value.value.elements]))
+    return value
+
+def spillFile(spillDir: Optional[str]):
+    return tempfile.TemporaryFile(dir=spillDir)
+
+def writeRecord(out, doc: BSONDocument):
+    buf = bytearray()
+    res = encodeInto(buf, mapStrings(doc, lambda s: s + "\x00"))
+    if isLeft(res):
+        raise AggregationError(f"Cannot spill to disk: {fromLeft(None, res)}")
+    out.write(buf)
+
+def readRecords(file) -> Iterator[BSONDocument]:
+    """
+    The records of file from the start, decoded lazily
+    """
+    file.seek(0)
+    while True:
+        header = file.read(4)
+        if not header:
+            return
+        body = header + file.read(int.from_bytes(header, "little") - 4)
+        doc, _ = readDocument(body, 0)
+        yield mapStrings(doc, lambda s: s[:-1])
@@ -0,0 +1,12 @@
+"""
+Registers every pipeline stage with mql.agg.pipeline.
+
+$match, $limit, $skip, $project and $addFields are defined in the pipeline module
+itself, the stages with a module of their own add their parsers to StageParsers when
+imported here. The package imports this module, so any import from mql.agg sees the
+full set of stages.
+"""
+
+import mql.agg.pipeline
+import mql.agg.group
+import mql.agg.sort
@@ -1,12 +1,17 @@
 """
 This is an abstraction of BSON, not it's actual serialized format
+
+The classes are slotted dataclasses: a process may hold hundreds of thousands of
+decoded documents, and dropping the per-instance __dict__ shrinks each element
+considerably.
 """
 
 from __future__ import annotations
 
-from dataclasses import dataclass
+import struct
+from dataclasses import dataclass, field
 from enum import Enum, IntEnum
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from fpy.data.maybe import Maybe, Just, Nothing
 
 
@@ -35,7 +40,21 @@ class BSONType(IntEnum):
     MaxKey = 127
 
 
-@dataclass
+NumericTypes = frozenset([BSONType.Number, BSONType.Int32, BSONType.Int64])
+
+# Canonical order of the types, values of different types compare by these alone. Types
+# sharing a rank (the numbers, String and Symbol, null and missing) compare by value.
+TYPE_ORDER: Dict[BSONType, int] = {
+    BSONType.MinKey: 0, BSONType.Undefined: 1, BSONType.Null: 1, BSONType.EOO: 1,
+    BSONType.Number: 2, BSONType.Int32: 2, BSONType.Int64: 2, BSONType.Decimal128: 2,
+    BSONType.Symbol: 3, BSONType.String: 3, BSONType.Document: 4, BSONType.Array: 5,
+    BSONType.Binary: 6, BSONType.ObjectId: 7, BSONType.Boolean: 8, BSONType.Datetime: 9,
+    BSONType.Timestamp: 10, BSONType.Regex: 11, BSONType.DBRef: 12, BSONType.Code: 13,
+    BSONType.CodeWS: 14, BSONType.MaxKey: 15,
+}
+NUMBER_RANK = 2
+
+@dataclass(slots=True)
 class BSONValue:
     """
     In the actual server codebase, we have Document / Value vs BSONDocument / BSONElement,
@@ -83,15 +102,30 @@ class BSONValue:
             return cls(BSONType.String, val)
         return cls.eoo()
 
+    def typeRank(self) -> int:
+        return TYPE_ORDER.get(self.bsonType, len(TYPE_ORDER))
+
     @staticmethod
     def compare(a: BSONValue, b: BSONValue) -> Maybe[int]:
-        if a.bsonType in [BSONType.Number, BSONType.Int32, BSONType.Int64] and b.bsonType in [BSONType.Number, BSONType.Int32, BSONType.Int64]:
-            return Just(0 if a.value == b.value else (-1 if a.value < b.value else 1))
-        return Nothing()
+        """
+        Total order over every value, the one the server sorts by: values of different
+        types compare by TYPE_ORDER, numbers compare exactly across Int32, Int64 and
+        Double with NaN equal to itself and below every other number. Always Just.
+        """
+        return Just(compareValues(a, b))
 
+    def sortKey(self) -> bytes:
+        """
+        Key whose byte order is the order of compare: for any values a and b,
+        compare(a, b) has the sign of comparing a.sortKey() and b.sortKey() as bytes
+        """
+        out = bytearray()
+        writeSortKey(out, self)
+        return bytes(out)
 
 
-@dataclass
+
+@dataclass(slots=True)
 class BSONElement:
     fieldName: str
     value: BSONValue
@@ -131,21 +165,62 @@ class BSONElement:
         return BSONValue.compare(a.value, b.value)
 
 
-@dataclass
+# Documents with fewer elements than this are searched linearly, for them building the
+# field name index costs more than it saves (see benchmarks/benchFieldIndex.py)
+INDEX_THRESHOLD = 12
+
+@dataclass(slots=True)
 class BSONDocument:
     elements: List[BSONElement]
+    # field name -> position of its first occurrence, built on the first lookup into a wide
+    # document and dropped whenever elements is reassigned or changes length
+    _index: Optional[Dict[str, int]] = field(default=None, init=False, repr=False, compare=False)
+    _indexedLen: int = field(default=0, init=False, repr=False, compare=False)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name == "elements":
+            object.__setattr__(self, "_index", None)
+
+    def invalidateIndex(self):
+        """
+        Must be called after renaming or reordering elements in place
+        """
+        self._index = None
+
+    def _buildIndex(self) -> Dict[str, int]:
+        index = dict()
+        for idx, elem in enumerate(self.elements):
+            # duplicate field names resolve to the first occurrence, like the linear scan
+            index.setdefault(elem.fieldName, idx)
+        self._index = index
+        self._indexedLen = len(self.elements)
+        return index
+
+    def _find(self, fieldName: str) -> int:
+        elements = self.elements
+        if len(elements) < INDEX_THRESHOLD:
+            for idx, elem in enumerate(elements):
+                if elem.fieldName == fieldName:
+                    return idx
+            return -1
+        index = self._index
+        if index is None or self._indexedLen != len(elements):
+            index = self._buildIndex()
+        idx = index.get(fieldName, -1)
+        if idx >= 0 and elements[idx].fieldName != fieldName:
+            # an element was replaced in place behind our back
+            idx = self._buildIndex().get(fieldName, -1)
+        return idx
 
     def __contains__(self, fieldName: str) -> bool:
-        for elem in self.elements:
-            if elem.fieldName == fieldName:
-                return True
-        return False
+        return self._find(fieldName) >= 0
 
     def __getitem__(self, fieldName: str) -> Maybe[BSONElement]:
-        for elem in self.elements:
-            if elem.fieldName == fieldName:
-                return Just(elem)
-        return Nothing()
+        idx = self._find(fieldName)
+        if idx < 0:
+            return Nothing()
+        return Just(self.elements[idx])
 
     def __repr__(self):
         return self.elements.__repr__()
@@ -160,7 +235,7 @@ class BSONDocument:
             elms.append(BSONElement.fromValue(v, k))
         return cls(elms)
 
-@dataclass
+@dataclass(slots=True)
 class BSONArray:
     elements: List[BSONElement]
 
@@ -185,8 +260,172 @@ class BSONArray:
             elms.append(BSONElement.fromValue(elm, f"{idx}"))
         return cls(elms)
 
-@dataclass
+@dataclass(slots=True)
 class BSONBinary:
     size: int
     subType: int
     body: bytes
+
+
+# Comparison
+#
+# String values decoded from BSON keep their terminating NUL, while those built in python
+# do not, so it is dropped before comparing.
+
+def cString(s: str) -> str:
+    return s[:-1] if s.endswith("\x00") else s
+
+def stringValue(value: BSONValue) -> str:
+    return cString(value.value)
+
+def regexParts(value: BSONValue) -> Tuple[str, str]:
+    """
+    (pattern, options) of a Regex, whose value is either that pair or a bare pattern
+    """
+    pattern, options = (value.value, "") if isinstance(value.value, str) else value.value
+    return cString(pattern), cString(options)
+
+def dbRefParts(value: BSONValue) -> Tuple[bytes, bytes]:
+    """
+    (UTF-8 namespace, ObjectId bytes) of a DBRef, whose value is the pair (namespace, id)
+    """
+    namespace, oid = value.value
+    return cString(namespace).encode("utf-8", "surrogatepass"), bytes(oid)
+
+def sign(a, b) -> int:
+    return 0 if a == b else (-1 if a < b else 1)
+
+def compareNumbers(a, b) -> int:
+    # python compares ints and floats exactly, without converting the int
+    if a != a:
+        return 0 if b != b else -1
+    if b != b:
+        return 1
+    return sign(a, b)
+
+def compareElements(a: List[BSONElement], b: List[BSONElement], withNames: bool) -> int:
+    for x, y in zip(a, b):
+        res = sign(x.value.typeRank(), y.value.typeRank())
+        if res == 0 and withNames:
+            res = sign(x.fieldName, y.fieldName)
+        if res == 0:
+            res = compareValues(x.value, y.value)
+        if res != 0:
+            return res
+    return sign(len(a), len(b))
+
+def compareValues(a: BSONValue, b: BSONValue) -> int:
+    aType = a.bsonType
+    bType = b.bsonType
+    if aType in NumericTypes and bType in NumericTypes:
+        return compareNumbers(a.value, b.value)
+    rank = a.typeRank()
+    res = sign(rank, b.typeRank())
+    if res != 0:
+        return res
+    if rank == NUMBER_RANK:
+        return compareNumbers(a.value, b.value)
+    if aType in (BSONType.String, BSONType.Symbol, BSONType.Code):
+        # code point order is the order of the UTF-8 bytes the server compares
+        return sign(stringValue(a), stringValue(b))
+    if aType == BSONType.Regex:
+        return sign(regexParts(a), regexParts(b))
+    if aType == BSONType.DBRef:
+        # the server compares the namespace's length first
+        aNamespace, aId = dbRefParts(a)
+        bNamespace, bId = dbRefParts(b)
+        return sign((len(aNamespace), aNamespace, aId), (len(bNamespace), bNamespace, bId))
+    if aType == BSONType.Document:
+        return compareElements(a.value.elements, b.value.elements, True)
+    if aType == BSONType.Array:
+        return compareElements(a.value.elements, b.value.elements, False)
+    if aType == BSONType.Binary:
+        return sign((len(a.value.body), a.value.subType, a.value.body), (len(b.value.body), b.value.subType, b.value.body))
+    if aType == BSONType.Boolean:
+        return sign(bool(a.value), bool(b.value))
+    if aType in (BSONType.MinKey, BSONType.MaxKey, BSONType.Null, BSONType.Undefined, BSONType.EOO):
+        return 0
+    try:
+        return sign(a.value, b.value)
+    except TypeError:
+        return sign(repr(a.value), repr(b.value))
+
+
+# Sort keys
+#
+# Every value is written as its type rank + 1 followed by an encoding of its value:
+#   numbers     0x00 for NaN, otherwise 0x01, the double nearest the value with its bits
+#               arranged to sort as unsigned bytes, and the signed distance of the exact
+#               integer from that double (0 for doubles), so large Int64s stay distinct
+#   strings     UTF-8 with 0x00 escaped as 0x00 0xFF, terminated by 0x00, code as well
+#   regexes     the pattern and then the options, as strings
+#   DBRefs      namespace length, namespace, ObjectId
+#   documents   (type byte, escaped field name, value) per element, terminated by 0x00
+#   arrays      each element's key, terminated by 0x00
+#   binary      length, subtype, bytes
+# The terminators sort below every type byte, so a prefix sorts first.
+
+_DOUBLE_BE = struct.Struct(">d")
+_U64_BE = struct.Struct(">Q")
+_I64_BIAS = 1 << 63
+
+def writeEscaped(out: bytearray, s: str):
+    out += s.encode("utf-8", "surrogatepass").replace(b"\x00", b"\x00\xff")
+    out.append(0)
+
+def writeNumberKey(out: bytearray, v):
+    if v != v:
+        out.append(0)
+        return
+    out.append(1)
+    nearest = float(v)
+    if nearest == 0.0:
+        # -0.0 == 0.0
+        nearest = 0.0
+    bits = _U64_BE.unpack(_DOUBLE_BE.pack(nearest))[0]
+    bits = bits ^ 0xFFFFFFFFFFFFFFFF if bits >> 63 else bits | _I64_BIAS
+    out += _U64_BE.pack(bits)
+    delta = v - int(nearest) if isinstance(v, int) else 0
+    out += _U64_BE.pack(delta + _I64_BIAS)
+
+def writeSortKey(out: bytearray, value: BSONValue):
+    rank = value.typeRank()
+    out.append(rank + 1)
+    bsonType = value.bsonType
+    if rank == NUMBER_RANK:
+        writeNumberKey(out, value.value)
+    elif bsonType in (BSONType.String, BSONType.Symbol, BSONType.Code):
+        writeEscaped(out, stringValue(value))
+    elif bsonType == BSONType.Regex:
+        pattern, options = regexParts(value)
+        writeEscaped(out, pattern)
+        writeEscaped(out, options)
+    elif bsonType == BSONType.DBRef:
+        namespace, oid = dbRefParts(value)
+        out += len(namespace).to_bytes(4, "big")
+        out += namespace
+        out += oid
+    elif bsonType == BSONType.Document:
+        for elm in value.value.elements:
+            out.append(elm.value.typeRank() + 1)
+            writeEscaped(out, elm.fieldName)
+            writeSortKey(out, elm.value)
+        out.append(0)
+    elif bsonType == BSONType.Array:
+        for elm in value.value.elements:
+            writeSortKey(out, elm.value)
+        out.append(0)
+    elif bsonType == BSONType.Binary:
+        out += len(value.value.body).to_bytes(4, "big")
+        out.append(value.value.subType)
+        out += value.value.body
+    elif bsonType == BSONType.ObjectId:
+        out += value.value
+    elif bsonType == BSONType.Boolean:
+        out.append(1 if value.value else 0)
+    elif bsonType == BSONType.Datetime and isinstance(value.value, int):
+        out += _U64_BE.pack(value.value + _I64_BIAS)
+    elif bsonType == BSONType.Timestamp and isinstance(value.value, int):
+        out += _U64_BE.pack(value.value)
+    elif bsonType not in (BSONType.MinKey, BSONType.MaxKey, BSONType.Null, BSONType.Undefined, BSONType.EOO):
+        writeEscaped(out, repr(value.value))
@@ -40,13 +40,13 @@ def takePrefixSizedBytes(payload, prefixSize = 4, sizeInclPrefix = False):
     with nBytesToInt(prefixSize)(payload) as (size, rest): 
         return takeNBytes(size - prefixSize if sizeInclPrefix else size)(rest)
 
-parseCStr = ptrans(many(toSeq(one(__ != 0))) << toSeq(one(__ == 0)), trans0(lambda lst: ''.join(map(lambda c: chr(c), lst))))
+parseCStr = ptrans(many(toSeq(one(__ != 0))) << toSeq(one(__ == 0)), trans0(lambda lst: bytes(lst).decode("utf-8")))
 
 @parser
 @do
 def parseDocument(b: Sequence[int]) -> Either[Any, Tuple[BSONDocument, Sequence[int]]]:
     with (takePrefixSizedBytes(b, sizeInclPrefix=True) as (docBytes, rest),
-          (many(toSeq(parseElement)) << EOO)(docBytes) as (elms, rest)):
+          (many(toSeq(parseElement)) << EOO)(docBytes) as (elms, _)):
         return Right((BSONDocument(elms), rest))
 
 @parser
@@ -96,6 +96,10 @@ def parseBool(payload):
     with one(const(True))(payload) as (byte, rest):
         return Right((byte == 1, rest))
 
+@defTag(BSONType.Null)
+def parseNull(payload):
+    return Right((None, payload))
+
 @defTag(BSONType.ObjectId)
 @do
 def parseOID(payload):
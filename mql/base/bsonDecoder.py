@@ -0,0 +1,231 @@
+"""
+A hand-written BSON decoder.
+
+Unlike the combinator based parser in bsonBinary, this walks a bytes-like buffer with
+integer offsets and struct.unpack_from, so decoding a document allocates objects per
+element rather than per byte. Both decoders produce the same BSONDocument tree.
+"""
+
+from __future__ import annotations
+
+import struct
+import sys
+from typing import Any, Callable, Dict, Sequence, Tuple, Union
+
+from mql.base.bson import BSONType, BSONValue, BSONArray, BSONElement, BSONDocument, BSONBinary
+from mql.base.bsonBinary import parseDocument
+
+from fpy.data.either import Either, Right, Left
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+class BSONDecodeError(Exception):
+    """
+    Raised internally while walking a buffer, surfaced to callers as a Left
+    """
+    pass
+
+_I32 = struct.Struct("<i")
+_I64 = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+
+# how many bytes of a memoryview we copy at a time while looking for a cstring terminator
+_CSTRING_CHUNK = 64
+
+TAG_DECODER: Dict[int, Tuple[BSONType, Callable[[Buffer, int], Tuple[Any, int]]]] = dict()
+
+def defDecoder(tag: BSONType):
+    def res(fn):
+        global TAG_DECODER
+        TAG_DECODER[tag.value] = (tag, fn)
+        return fn
+    return res
+
+
+def readI32(buf: Buffer, pos: int) -> int:
+    if pos + 4 > len(buf):
+        raise BSONDecodeError(f"Unexpected end of buffer reading int32 at {pos}")
+    return _I32.unpack_from(buf, pos)[0]
+
+def cstringEnd(buf: Buffer, pos: int) -> int:
+    """
+    Offset of the NUL terminating the cstring starting at pos
+    """
+    if not isinstance(buf, memoryview):
+        end = buf.find(0, pos)
+    else:
+        # memoryview has no find, copy small windows instead of the whole buffer
+        end = -1
+        scan = pos
+        while scan < len(buf):
+            idx = bytes(buf[scan:scan + _CSTRING_CHUNK]).find(0)
+            if idx >= 0:
+                end = scan + idx
+                break
+            scan += _CSTRING_CHUNK
+    if end < 0:
+        raise BSONDecodeError(f"Unterminated cstring at {pos}")
+    return end
+
+def readCStr(buf: Buffer, pos: int) -> Tuple[str, int]:
+    end = cstringEnd(buf, pos)
+    return str(buf[pos:end], "utf-8"), end + 1
+
+def documentBounds(buf: Buffer, pos: int) -> Tuple[int, int]:
+    """
+    Validates the length prefix of the document starting at pos.
+    Returns the offset of the first element and the offset just past the document.
+    """
+    size = readI32(buf, pos)
+    end = pos + size
+    if size < 5 or end > len(buf):
+        raise BSONDecodeError(f"Invalid document size {size} at {pos}")
+    if buf[end - 1] != 0:
+        raise BSONDecodeError(f"Document at {pos} is not terminated by EOO")
+    return pos + 4, end
+
+def readElement(buf: Buffer, pos: int) -> Tuple[BSONElement, int]:
+    tag = buf[pos]
+    fieldName, pos = readCStr(buf, pos + 1)
+    # documents of a collection repeat the same field names, share one string object
+    fieldName = sys.intern(fieldName)
+    decoder = TAG_DECODER.get(tag, None)
+    if decoder is None:
+        raise BSONDecodeError(f"Undefined Tag: {tag}")
+    bsonType, fn = decoder
+    val, pos = fn(buf, pos)
+    return BSONElement(fieldName, BSONValue(bsonType, val)), pos
+
+def readElements(buf: Buffer, pos: int) -> Tuple[list, int]:
+    pos, end = documentBounds(buf, pos)
+    last = end - 1
+    elms = []
+    while pos < last:
+        elm, pos = readElement(buf, pos)
+        elms.append(elm)
+    if pos != last:
+        raise BSONDecodeError(f"Element overruns its document ending at {end}")
+    return elms, end
+
+@defDecoder(BSONType.Document)
+def readDocument(buf: Buffer, pos: int) -> Tuple[BSONDocument, int]:
+    elms, pos = readElements(buf, pos)
+    return BSONDocument(elms), pos
+
+@defDecoder(BSONType.Array)
+def readArray(buf: Buffer, pos: int) -> Tuple[BSONArray, int]:
+    elms, pos = readElements(buf, pos)
+    return BSONArray(elms), pos
+
+@defDecoder(BSONType.Number)
+def readNumber(buf: Buffer, pos: int) -> Tuple[float, int]:
+    return _DOUBLE.unpack_from(buf, pos)[0], pos + 8
+
+@defDecoder(BSONType.Int32)
+def readI32Value(buf: Buffer, pos: int) -> Tuple[int, int]:
+    return _I32.unpack_from(buf, pos)[0], pos + 4
+
+@defDecoder(BSONType.Int64)
+def readI64(buf: Buffer, pos: int) -> Tuple[int, int]:
+    return _I64.unpack_from(buf, pos)[0], pos + 8
+
+@defDecoder(BSONType.String)
+def readStr(buf: Buffer, pos: int) -> Tuple[str, int]:
+    size = readI32(buf, pos)
+    start = pos + 4
+    end = start + size
+    if size < 1 or end > len(buf):
+        raise BSONDecodeError(f"Invalid string size {size} at {pos}")
+    # parseStr keeps the trailing NUL, so do we
+    return str(buf[start:end], "utf-8"), end
+
+@defDecoder(BSONType.Boolean)
+def readBool(buf: Buffer, pos: int) -> Tuple[bool, int]:
+    return buf[pos] == 1, pos + 1
+
+@defDecoder(BSONType.Null)
+def readNull(buf: Buffer, pos: int) -> Tuple[None, int]:
+    return None, pos
+
+@defDecoder(BSONType.ObjectId)
+def readOID(buf: Buffer, pos: int) -> Tuple[bytes, int]:
+    end = pos + 12
+    if end > len(buf):
+        raise BSONDecodeError(f"Unexpected end of buffer reading ObjectId at {pos}")
+    return bytes(buf[pos:end]), end
+
+@defDecoder(BSONType.Binary)
+def readBin(buf: Buffer, pos: int) -> Tuple[BSONBinary, int]:
+    bodySize = readI32(buf, pos)
+    start = pos + 5
+    end = start + bodySize
+    if bodySize < 0 or end > len(buf):
+        raise BSONDecodeError(f"Invalid binary size {bodySize} at {pos}")
+    return BSONBinary(bodySize, buf[pos + 4], bytes(buf[start:end])), end
+
+
+# payload sizes for types whose value has a fixed width
+FIXED_VALUE_SIZE: Dict[int, int] = {
+    BSONType.Number.value: 8,
+    BSONType.Undefined.value: 0,
+    BSONType.ObjectId.value: 12,
+    BSONType.Boolean.value: 1,
+    BSONType.Datetime.value: 8,
+    BSONType.Null.value: 0,
+    BSONType.Int32.value: 4,
+    BSONType.Timestamp.value: 8,
+    BSONType.Int64.value: 8,
+    BSONType.Decimal128.value: 16,
+    BSONType.MaxKey.value: 0,
+    0xFF: 0, # MinKey
+}
+
+def valueEnd(buf: Buffer, tag: int, pos: int) -> int:
+    """
+    Offset just past the value of type tag starting at pos, without decoding it.
+    This covers every BSON type, including the ones TAG_DECODER cannot materialise.
+    """
+    size = FIXED_VALUE_SIZE.get(tag, None)
+    if size is not None:
+        end = pos + size
+    elif tag in (BSONType.String.value, BSONType.Code.value, BSONType.Symbol.value):
+        end = pos + 4 + readI32(buf, pos)
+    elif tag in (BSONType.Document.value, BSONType.Array.value, BSONType.CodeWS.value):
+        end = pos + readI32(buf, pos)
+    elif tag == BSONType.Binary.value:
+        end = pos + 5 + readI32(buf, pos)
+    elif tag == BSONType.Regex.value:
+        end = cstringEnd(buf, cstringEnd(buf, pos) + 1) + 1
+    elif tag == BSONType.DBRef.value:
+        end = pos + 4 + readI32(buf, pos) + 12
+    else:
+        raise BSONDecodeError(f"Undefined Tag: {tag}")
+    if end > len(buf) or (size is None and end <= pos):
+        raise BSONDecodeError(f"Value of type {tag} at {pos} overruns the buffer")
+    return end
+
+
+def asBuffer(b: Union[Buffer, Sequence[int]]) -> Buffer:
+    if isinstance(b, (bytes, bytearray, memoryview)):
+        return b
+    return bytes(b)
+
+def decodeDocument(b: Union[Buffer, Sequence[int]]) -> Either[str, Tuple[BSONDocument, Buffer]]:
+    """
+    Drop-in alternative to bsonBinary.parseDocument: decodes the document at the start of b
+    and returns it together with the unconsumed remainder of the buffer.
+    """
+    buf = asBuffer(b)
+    try:
+        doc, end = readDocument(buf, 0)
+    except (BSONDecodeError, struct.error, IndexError, UnicodeDecodeError) as e:
+        return Left(str(e))
+    return Right((doc, buf[end:]))
+
+DOCUMENT_PARSER: Dict[str, Callable[[Any], Either[Any, Tuple[BSONDocument, Any]]]] = {
+    "parsec": parseDocument,
+    "fast": decodeDocument,
+}
+
+def getDocumentParser(name: str = "fast") -> Callable[[Any], Either[Any, Tuple[BSONDocument, Any]]]:
+    return DOCUMENT_PARSER[name]
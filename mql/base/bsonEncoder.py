@@ -0,0 +1,138 @@
+"""
+Serializes BSONDocument trees back into BSON.
+
+Everything is written into a single growable bytearray. Length prefixes of documents,
+arrays and strings are reserved up front and patched in place once the body has been
+written, so no intermediate byte strings are built per element.
+"""
+
+from __future__ import annotations
+
+import struct
+from typing import Any, Callable, Dict, Union
+
+from mql.base.bson import BSONType, BSONArray, BSONElement, BSONDocument, BSONBinary
+from mql.base.bsonRaw import RawBSONContainer
+
+from fpy.data.either import Either, Right, Left
+
+class BSONEncodeError(Exception):
+    """
+    Raised internally while writing a document, surfaced to callers as a Left
+    """
+    pass
+
+_I32 = struct.Struct("<i")
+_I64 = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+
+TAG_ENCODER: Dict[BSONType, Callable[[bytearray, Any], None]] = dict()
+
+def defEncoder(tag: BSONType):
+    def res(fn):
+        global TAG_ENCODER
+        TAG_ENCODER[tag] = fn
+        return fn
+    return res
+
+
+def writeCStr(out: bytearray, s: str):
+    raw = s.encode("utf-8")
+    if b"\x00" in raw:
+        raise BSONEncodeError(f"cstring {s!r} contains a NUL byte")
+    out += raw
+    out.append(0)
+
+def writeElement(out: bytearray, elem: BSONElement):
+    bsonType = elem.value.bsonType
+    encoder = TAG_ENCODER.get(bsonType, None)
+    if encoder is None:
+        raise BSONEncodeError(f"Cannot encode {bsonType} for field {elem.fieldName!r}")
+    out.append(bsonType.value)
+    writeCStr(out, elem.fieldName)
+    encoder(out, elem.value.value)
+
+def writeElements(out: bytearray, container: Union[BSONDocument, BSONArray]):
+    if isinstance(container, RawBSONContainer):
+        # already serialized, copy the bytes over verbatim
+        out += container.raw
+        return
+    start = len(out)
+    out += b"\x00\x00\x00\x00"
+    for elem in container.elements:
+        writeElement(out, elem)
+    out.append(0)
+    _I32.pack_into(out, start, len(out) - start)
+
+@defEncoder(BSONType.Document)
+def writeDocument(out: bytearray, doc: BSONDocument):
+    writeElements(out, doc)
+
+@defEncoder(BSONType.Array)
+def writeArray(out: bytearray, arr: BSONArray):
+    writeElements(out, arr)
+
+@defEncoder(BSONType.Number)
+def writeNumber(out: bytearray, val: float):
+    out += _DOUBLE.pack(val)
+
+@defEncoder(BSONType.Int32)
+def writeI32(out: bytearray, val: int):
+    if not -2**31 <= val < 2**31:
+        raise BSONEncodeError(f"Int32 value {val} out of range")
+    out += _I32.pack(val)
+
+@defEncoder(BSONType.Int64)
+def writeI64(out: bytearray, val: int):
+    if not -2**63 <= val < 2**63:
+        raise BSONEncodeError(f"Int64 value {val} out of range")
+    out += _I64.pack(val)
+
+@defEncoder(BSONType.String)
+def writeStr(out: bytearray, val: str):
+    start = len(out)
+    out += b"\x00\x00\x00\x00"
+    out += val.encode("utf-8")
+    # the parser keeps the terminating NUL as part of the decoded string,
+    # only add one if it is not already there
+    if not val.endswith("\x00"):
+        out.append(0)
+    _I32.pack_into(out, start, len(out) - start - 4)
+
+@defEncoder(BSONType.Boolean)
+def writeBool(out: bytearray, val: bool):
+    out.append(1 if val else 0)
+
+@defEncoder(BSONType.Null)
+def writeNull(out: bytearray, val: None):
+    pass
+
+@defEncoder(BSONType.ObjectId)
+def writeOID(out: bytearray, val: bytes):
+    if len(val) != 12:
+        raise BSONEncodeError(f"ObjectId must be 12 bytes, got {len(val)}")
+    out += val
+
+@defEncoder(BSONType.Binary)
+def writeBin(out: bytearray, val: BSONBinary):
+    out += _I32.pack(len(val.body))
+    out.append(val.subType)
+    out += val.body
+
+
+def encodeInto(out: bytearray, doc: BSONDocument) -> Either[str, int]:
+    """
+    Appends the serialized doc to out, returns the number of bytes written
+    """
+    start = len(out)
+    try:
+        writeElements(out, doc)
+    except (BSONEncodeError, struct.error, ValueError, UnicodeEncodeError) as e:
+        del out[start:]
+        return Left(str(e))
+    return Right(len(out) - start)
+
+def encodeDocument(doc: BSONDocument) -> Either[str, bytes]:
+    out = bytearray()
+    res = encodeInto(out, doc)
+    return res | (lambda _: bytes(out))
@@ -0,0 +1,172 @@
+"""
+Lazy views over serialized BSON.
+
+A RawBSONDocument keeps a memoryview of the bytes it was read from and only decodes a
+field when it is looked up. Element headers are scanned on demand and their offsets
+remembered, so looking up a field costs time proportional to the fields in front of it
+rather than to the size of the document. Nested documents and arrays are returned as
+further raw views over the same buffer, nothing is copied until a leaf value is decoded.
+
+Both views expose the same interface as BSONDocument / BSONArray, so they can be used
+wherever a decoded document is expected, e.g. PathMatchExpression.iterPath.
+Since values are decoded late, a malformed value raises BSONDecodeError when it is
+first looked up instead of failing the whole document up front.
+"""
+
+from __future__ import annotations
+
+import struct
+import sys
+from typing import Dict, List, Sequence, Tuple, Union
+
+from mql.base.bson import BSONType, BSONValue, BSONElement, BSONDocument
+from mql.base.bsonDecoder import (Buffer, BSONDecodeError, TAG_DECODER, DOCUMENT_PARSER,
+                                  asBuffer, documentBounds, cstringEnd, valueEnd, readDocument)
+
+from fpy.data.maybe import Maybe, Just, Nothing
+from fpy.data.either import Either, Right, Left
+
+
+class RawBSONContainer:
+    """
+    Shared header scanning for raw documents and arrays
+    """
+    __slots__ = ("raw", "_positions", "_offsets", "_decoded", "_scanPos", "_elements")
+
+    def __init__(self, buf: Buffer, offset: int = 0):
+        view = memoryview(buf)
+        if view.format != "B":
+            view = view.cast("B")
+        start, end = documentBounds(view, offset)
+        self.raw = view[offset:end]
+        # offsets (relative to self.raw) of every element header scanned so far, in order
+        self._positions: List[int] = []
+        # first occurrence of each field name scanned so far
+        self._offsets: Dict[str, int] = dict()
+        self._decoded: Dict[int, BSONElement] = dict()
+        self._scanPos = start - offset
+        self._elements = None
+
+    def _scanNext(self) -> bool:
+        """
+        Records the next element header, returns False once the EOO is reached
+        """
+        raw = self.raw
+        pos = self._scanPos
+        if pos >= len(raw) - 1:
+            return False
+        nameEnd = cstringEnd(raw, pos + 1)
+        fieldName = str(raw[pos + 1:nameEnd], "utf-8")
+        self._positions.append(pos)
+        self._offsets.setdefault(fieldName, pos)
+        self._scanPos = valueEnd(raw, raw[pos], nameEnd + 1)
+        if self._scanPos > len(raw) - 1:
+            raise BSONDecodeError(f"Element at {pos} overruns its document")
+        return True
+
+    def _findField(self, fieldName: str) -> int:
+        pos = self._offsets.get(fieldName, None)
+        while pos is None and self._scanNext():
+            pos = self._offsets.get(fieldName, None)
+        return -1 if pos is None else pos
+
+    def _findIndex(self, idx: int) -> int:
+        while len(self._positions) <= idx and self._scanNext():
+            pass
+        return self._positions[idx] if idx < len(self._positions) else -1
+
+    def _scanAll(self):
+        while self._scanNext():
+            pass
+
+    def _elementAt(self, pos: int) -> BSONElement:
+        elm = self._decoded.get(pos, None)
+        if elm is None:
+            elm = decodeRawElement(self.raw, pos)
+            self._decoded[pos] = elm
+        return elm
+
+    @property
+    def elements(self) -> List[BSONElement]:
+        if self._elements is None:
+            self._scanAll()
+            self._elements = [self._elementAt(pos) for pos in self._positions]
+        return self._elements
+
+    def __len__(self):
+        self._scanAll()
+        return len(self._positions)
+
+    def __repr__(self):
+        return self.elements.__repr__()
+
+    def __eq__(self, other):
+        if not hasattr(other, "elements"):
+            return NotImplemented
+        return self.elements == other.elements
+
+
+class RawBSONDocument(RawBSONContainer):
+    __slots__ = ()
+
+    def __contains__(self, fieldName: str) -> bool:
+        return self._findField(fieldName) >= 0
+
+    def __getitem__(self, fieldName: str) -> Maybe[BSONElement]:
+        pos = self._findField(fieldName)
+        if pos < 0:
+            return Nothing()
+        return Just(self._elementAt(pos))
+
+    def toDocument(self) -> BSONDocument:
+        """
+        Fully decodes the view into an owning BSONDocument
+        """
+        return readDocument(self.raw, 0)[0]
+
+
+class RawBSONArray(RawBSONContainer):
+    __slots__ = ()
+
+    def __contains__(self, idx: int) -> bool:
+        return idx >= 0 and self._findIndex(idx) >= 0
+
+    def __getitem__(self, idx: int) -> Maybe[BSONElement]:
+        if idx < 0:
+            return Nothing()
+        pos = self._findIndex(idx)
+        if pos < 0:
+            return Nothing()
+        return Just(self._elementAt(pos))
+
+
+def decodeRawElement(raw: memoryview, pos: int) -> BSONElement:
+    tag = raw[pos]
+    nameEnd = cstringEnd(raw, pos + 1)
+    fieldName = sys.intern(str(raw[pos + 1:nameEnd], "utf-8"))
+    valuePos = nameEnd + 1
+    if tag == BSONType.Document.value:
+        return BSONElement(fieldName, BSONValue(BSONType.Document, RawBSONDocument(raw, valuePos)))
+    if tag == BSONType.Array.value:
+        return BSONElement(fieldName, BSONValue(BSONType.Array, RawBSONArray(raw, valuePos)))
+    decoder = TAG_DECODER.get(tag, None)
+    if decoder is None:
+        raise BSONDecodeError(f"Undefined Tag: {tag}")
+    bsonType, fn = decoder
+    val, _ = fn(raw, valuePos)
+    return BSONElement(fieldName, BSONValue(bsonType, val))
+
+
+def decodeRawDocument(b: Union[Buffer, Sequence[int]]) -> Either[str, Tuple[RawBSONDocument, Buffer]]:
+    """
+    Same contract as bsonDecoder.decodeDocument, but only validates the outer length
+    prefix and returns a lazy view instead of decoding the elements.
+    """
+    buf = asBuffer(b)
+    try:
+        doc = RawBSONDocument(buf)
+    except (BSONDecodeError, struct.error, IndexError) as e:
+        return Left(str(e))
+    return Right((doc, buf[len(doc.raw):]))
+
+DOCUMENT_PARSER["raw"] = decodeRawDocument
@@ -0,0 +1,146 @@
+"""
+A push style BSON decoder for documents arriving in arbitrary chunks.
+
+feed() takes whatever bytes the socket produced and returns what they completed: every
+top level element of the current document as soon as all of its bytes are in, then the
+document itself once its terminating EOO arrives. A stream may hold any number of
+documents back to back.
+
+Decoded elements are handed out right away and their bytes are dropped from the buffer
+in batches of COMPACT_THRESHOLD, so beyond those the decoder only holds the element in
+progress. That element is bounded by maxDocumentSize, which is checked against the
+length prefix before any of the document is buffered.
+"""
+
+from __future__ import annotations
+
+import struct
+from dataclasses import dataclass
+from typing import List, Optional, Union
+
+from mql.base.bson import BSONDocument, BSONElement
+from mql.base.bsonDecoder import BSONDecodeError, readElement, readI32, valueEnd
+
+# the server's BSONObjMaxInternalSize
+MAX_DOCUMENT_SIZE = 16 * 1024 * 1024 + 16 * 1024
+
+# drop consumed bytes from the front of the buffer once there are this many
+COMPACT_THRESHOLD = 64 * 1024
+
+@dataclass
+class ElementDecoded:
+    element: BSONElement
+
+@dataclass
+class DocumentDecoded:
+    document: BSONDocument
+
+Event = Union[ElementDecoded, DocumentDecoded]
+
+class StreamingDecoder:
+    def __init__(self, maxDocumentSize: int = MAX_DOCUMENT_SIZE, emitElements: bool = True):
+        self.maxDocumentSize = maxDocumentSize
+        self.emitElements = emitElements
+        self.buf = bytearray()
+        self.pos = 0
+        # bytes of the current document not consumed yet, None between documents
+        self.remaining: Optional[int] = None
+        self.elements: List[BSONElement] = []
+
+    @property
+    def buffered(self) -> int:
+        return len(self.buf) - self.pos
+
+    @property
+    def idle(self) -> bool:
+        """
+        Whether the stream ended on a document boundary
+        """
+        return self.remaining is None and self.buffered == 0
+
+    def feed(self, chunk) -> List[Event]:
+        """
+        Appends chunk to the stream and decodes everything it completes, raises
+        BSONDecodeError on malformed input
+        """
+        self.buf += chunk
+        events: List[Event] = []
+        try:
+            while self.step(events):
+                pass
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise BSONDecodeError(f"Malformed element: {e}") from e
+        if self.pos == len(self.buf):
+            self.buf.clear()
+            self.pos = 0
+        elif self.pos >= COMPACT_THRESHOLD:
+            del self.buf[:self.pos]
+            self.pos = 0
+        return events
+
+    def close(self):
+        """
+        Marks the end of the stream, raises BSONDecodeError if it stopped inside a document
+        """
+        if not self.idle:
+            raise BSONDecodeError(f"Stream ended inside a document, {self.buffered} bytes pending")
+
+    def step(self, events: List[Event]) -> bool:
+        buf = self.buf
+        pos = self.pos
+        available = len(buf) - pos
+        remaining = self.remaining
+
+        if remaining is None:
+            if available < 4:
+                return False
+            size = readI32(buf, pos)
+            if size < 5 or size > self.maxDocumentSize:
+                raise BSONDecodeError(f"Invalid document size {size}")
+            self.pos = pos + 4
+            self.remaining = size - 4
+            self.elements = []
+            return True
+
+        if remaining == 1:
+            if available < 1:
+                return False
+            if buf[pos] != 0:
+                raise BSONDecodeError("Document is not terminated by EOO")
+            self.pos = pos + 1
+            self.remaining = None
+            events.append(DocumentDecoded(BSONDocument(self.elements)))
+            return True
+
+        end = self.elementEnd(pos, available >= remaining)
+        if end is None:
+            return False
+        if end - pos > remaining - 1:
+            raise BSONDecodeError("Element overruns its document")
+        elm, after = readElement(buf, pos)
+        if after != end:
+            raise BSONDecodeError(f"Element decoded to {after - pos} bytes, expected {end - pos}")
+        self.pos = end
+        self.remaining = remaining - (end - pos)
+        self.elements.append(elm)
+        if self.emitElements:
+            events.append(ElementDecoded(elm))
+        return True
+
+    def elementEnd(self, pos: int, documentComplete: bool) -> Optional[int]:
+        """
+        Offset just past the element at pos, None until enough of it has arrived to tell
+        and all of it is buffered
+        """
+        buf = self.buf
+        nameEnd = buf.find(0, pos + 1)
+        try:
+            if nameEnd < 0:
+                raise BSONDecodeError(f"Unterminated field name at {pos}")
+            end = valueEnd(buf, buf[pos], nameEnd + 1)
+        except BSONDecodeError:
+            # with all of the document buffered, this is not for lack of bytes
+            if documentComplete:
+                raise
+            return None
+        return end
@@ -18,6 +18,14 @@ class Path:
     def __bool__(self):
         return bool(self.parts)
 
+    def __eq__(self, other):
+        if not isinstance(other, Path):
+            return NotImplemented
+        return self.parts == other.parts
+
+    def __hash__(self):
+        return hash(tuple(self.parts))
+
     def __repr__(self):
         return self.__str__()
 
@@ -0,0 +1,178 @@
+"""
+An asyncio based wire protocol server.
+
+Every connection runs two tasks: a reader that frames messages by their length prefix
+with StreamReader.readexactly, and a responder that hands them to the handler one at a
+time and writes the replies back in request order. The reader keeps going while the
+responder works, so clients can pipeline requests, bounded by pipelineDepth.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import struct
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from mql.base.bson import BSONDocument
+from mql.interfaces.wireprotocol.wireprotocol import (parseMsg, encodeMsg, OpCode, MSG_HEADER, FLAG_BITS,
+                                                      MAX_MESSAGE_SIZE)
+from mql.interfaces.wireprotocol.compression import MessageDecompressor, compressMsg, COMPRESSED_HEADER
+
+from fpy.data.either import isLeft, fromLeft, fromRight
+
+@dataclass
+class ConnectionState:
+    connectionId: int
+    peer: Any
+    requests: int = 0
+    decompressor: MessageDecompressor = field(default_factory=MessageDecompressor)
+    # free form per connection data for handlers, e.g. cursors
+    data: Dict[str, Any] = field(default_factory=dict)
+
+Handler = Callable[[ConnectionState, bytes], Awaitable[Optional[bytes]]]
+
+_replyIds = itertools.count(1)
+
+def replyTo(raw: bytes, body: BSONDocument, compressorId: Optional[int] = None) -> Optional[bytes]:
+    """
+    Encodes body as the reply to raw, checksummed if the request was and compressed
+    with compressorId if given
+    """
+    _, requestId, _, opCode = MSG_HEADER.unpack_from(raw, 0)
+    checksum = (opCode == OpCode.Msg.value and len(raw) >= MSG_HEADER.size + FLAG_BITS.size
+                and FLAG_BITS.unpack_from(raw, MSG_HEADER.size)[0] & 1 == 1)
+    reply = encodeMsg(body, next(_replyIds), requestId, checksum=checksum)
+    if isLeft(reply):
+        return None
+    if compressorId is not None:
+        reply = compressMsg(fromRight(None, reply), compressorId)
+    return None if isLeft(reply) else fromRight(None, reply)
+
+def errorReply(raw: bytes, errmsg: str, compressorId: Optional[int] = None) -> Optional[bytes]:
+    return replyTo(raw, BSONDocument.fromDict({"ok": 0.0, "errmsg": errmsg}), compressorId)
+
+async def defaultHandler(state: ConnectionState, raw: bytes) -> Optional[bytes]:
+    """
+    Acknowledges every OP_MSG, or reports why it could not be parsed.
+    Compressed requests get a reply compressed the same way.
+    """
+    compressorId = None
+    if MSG_HEADER.unpack_from(raw, 0)[3] == OpCode.Compressed.value:
+        decompressed = state.decompressor.decompress(raw)
+        if isLeft(decompressed):
+            return errorReply(raw, str(fromLeft(None, decompressed)))
+        compressorId = COMPRESSED_HEADER.unpack_from(raw, 0)[6]
+        raw = fromRight(None, decompressed)
+    if len(raw) >= MSG_HEADER.size + FLAG_BITS.size:
+        flags = FLAG_BITS.unpack_from(raw, MSG_HEADER.size)[0]
+        if flags & 2:
+            # moreToCome, the client does not expect a reply
+            return None
+    msg = parseMsg(raw)
+    if isLeft(msg):
+        return errorReply(raw, str(fromLeft(None, msg)), compressorId)
+    return replyTo(raw, BSONDocument.fromDict({"ok": 1.0}), compressorId)
+
+
+class WireProtocolServer:
+    def __init__(self, handler: Handler = defaultHandler, host: str = "127.0.0.1", port: int = 27017,
+                 pipelineDepth: int = 16, maxMessageSize: int = MAX_MESSAGE_SIZE):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.pipelineDepth = pipelineDepth
+        self.maxMessageSize = maxMessageSize
+        self.connections: Dict[int, ConnectionState] = dict()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connectionIds = itertools.count(1)
+
+    async def start(self) -> Tuple[str, int]:
+        """
+        Starts listening, returns the bound address. Passing port 0 picks a free port.
+        """
+        self._server = await asyncio.start_server(self._serveConnection, self.host, self.port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        return self.host, self.port
+
+    async def serveForever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def readMessage(self, reader: asyncio.StreamReader) -> Optional[bytes]:
+        """
+        Next complete message on the stream, None once the peer has closed it
+        """
+        try:
+            prefix = await reader.readexactly(4)
+        except asyncio.IncompleteReadError:
+            return None
+        msgLen = struct.unpack("<i", prefix)[0]
+        if msgLen < MSG_HEADER.size or msgLen > self.maxMessageSize:
+            raise ValueError(f"Invalid message length {msgLen}")
+        try:
+            return prefix + await reader.readexactly(msgLen - 4)
+        except asyncio.IncompleteReadError:
+            return None
+
+    async def _serveConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        state = ConnectionState(next(self._connectionIds), writer.get_extra_info("peername"))
+        self.connections[state.connectionId] = state
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.pipelineDepth)
+        responder = asyncio.create_task(self._respond(state, queue, writer))
+        try:
+            while True:
+                raw = await self.readMessage(reader)
+                if raw is None:
+                    break
+                await queue.put(raw)
+        except (ValueError, ConnectionError):
+            pass
+        finally:
+            await queue.put(None)
+            await asyncio.gather(responder, return_exceptions=True)
+            del self.connections[state.connectionId]
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _respond(self, state: ConnectionState, queue: asyncio.Queue, writer: asyncio.StreamWriter):
+        failed = False
+        while True:
+            raw = await queue.get()
+            if raw is None:
+                return
+            if failed:
+                # keep draining so the reader never blocks on a full queue
+                continue
+            state.requests += 1
+            try:
+                reply = await self.handler(state, raw)
+                if reply is not None:
+                    writer.write(reply)
+                    await writer.drain()
+            except Exception:
+                # closing the transport ends the reader with an EOF
+                failed = True
+                writer.close()
+
+
+async def serveAsync(host: str = "127.0.0.1", port: int = 27017, handler: Handler = defaultHandler):
+    server = WireProtocolServer(handler, host, port)
+    await server.start()
+    print(f"listening on {server.host}:{server.port}")
+    await server.serveForever()
+
+
+if __name__ == "__main__":
+    asyncio.run(serveAsync())
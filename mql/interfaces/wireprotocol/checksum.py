@@ -0,0 +1,70 @@
+"""
+CRC-32C (Castagnoli), the checksum OP_MSG appends when checksumPresent is set.
+
+Uses a native implementation when one of the crc32c / google_crc32c modules is
+installed, both pick up the SSE4.2 / ARMv8 CRC instructions. Otherwise falls back to a
+pure Python slicing-by-8 implementation, which consumes 8 bytes per loop iteration
+through eight 256 entry lookup tables.
+"""
+
+from __future__ import annotations
+
+import struct
+from typing import Callable, List, Union
+
+from mql.base.bsonDecoder import Buffer
+
+# reversed Castagnoli polynomial
+POLYNOMIAL = 0x82F63B78
+
+def makeTables() -> List[List[int]]:
+    first = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ POLYNOMIAL if crc & 1 else crc >> 1
+        first.append(crc)
+    tables = [first]
+    for _ in range(7):
+        prev = tables[-1]
+        tables.append([(crc >> 8) ^ first[crc & 0xFF] for crc in prev])
+    return tables
+
+TABLES = makeTables()
+
+_PAIRS = struct.Struct("<II")
+
+def crc32cSlicing(data: Buffer, crc: int = 0) -> int:
+    """
+    Pure Python CRC-32C of data, continuing from crc
+    """
+    t0, t1, t2, t3, t4, t5, t6, t7 = TABLES
+    view = memoryview(data).cast("B")
+    crc ^= 0xFFFFFFFF
+    aligned = len(view) - len(view) % 8
+    for lo, hi in _PAIRS.iter_unpack(view[:aligned]):
+        crc ^= lo
+        crc = (t7[crc & 0xFF] ^ t6[(crc >> 8) & 0xFF] ^ t5[(crc >> 16) & 0xFF] ^ t4[crc >> 24] ^
+               t3[hi & 0xFF] ^ t2[(hi >> 8) & 0xFF] ^ t1[(hi >> 16) & 0xFF] ^ t0[hi >> 24])
+    for byte in view[aligned:]:
+        crc = (crc >> 8) ^ t0[(crc ^ byte) & 0xFF]
+    return crc ^ 0xFFFFFFFF
+
+def nativeCrc32c() -> Union[Callable[[Buffer, int], int], None]:
+    try:
+        import crc32c as native
+        return lambda data, crc=0: native.crc32c(data, crc)
+    except ImportError:
+        pass
+    try:
+        import google_crc32c as native
+        return lambda data, crc=0: native.extend(crc, bytes(data))
+    except ImportError:
+        pass
+    return None
+
+_native = nativeCrc32c()
+
+BACKEND = "native" if _native is not None else "slicing-by-8"
+
+crc32c: Callable[[Buffer, int], int] = _native if _native is not None else crc32cSlicing
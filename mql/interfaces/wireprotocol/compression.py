@@ -0,0 +1,149 @@
+"""
+OP_COMPRESSED, a wrapper around any other message with its body compressed:
+
+    MsgHeader header           (opCode 2012)
+    int32     originalOpcode
+    int32     uncompressedSize (size of the wrapped message without its header)
+    uint8     compressorId
+    char      compressedMessage[]
+
+Codecs are looked up by compressorId in CODECS. noop and zlib are always available,
+snappy and zstd are registered when python-snappy / zstandard are installed.
+"""
+
+from __future__ import annotations
+
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Union
+
+from mql.base.bsonDecoder import Buffer
+from mql.interfaces.wireprotocol.wireprotocol import OpCode, MSG_HEADER, MAX_MESSAGE_SIZE
+
+from fpy.data.either import Either, Left, Right
+
+COMPRESSED_HEADER = struct.Struct("<iiiiiiB")
+
+OP_COMPRESSED = OpCode.Compressed.value
+
+@dataclass(frozen=True)
+class Codec:
+    name: str
+    compressorId: int
+    compress: Callable[[Buffer], bytes]
+    # compressed bytes, expected uncompressed size -> uncompressed bytes
+    decompress: Callable[[Buffer, int], Buffer]
+
+CODECS: Dict[int, Codec] = dict()
+CODECS_BY_NAME: Dict[str, Codec] = dict()
+
+def defCodec(codec: Codec) -> Codec:
+    global CODECS, CODECS_BY_NAME
+    CODECS[codec.compressorId] = codec
+    CODECS_BY_NAME[codec.name] = codec
+    return codec
+
+def availableCodecs() -> List[str]:
+    return [codec.name for codec in CODECS.values()]
+
+def getCodec(codec: Union[int, str]) -> Optional[Codec]:
+    if isinstance(codec, str):
+        return CODECS_BY_NAME.get(codec, None)
+    return CODECS.get(codec, None)
+
+
+defCodec(Codec("noop", 0, bytes, lambda data, size: data))
+
+def zlibDecompress(data: Buffer, size: int) -> bytes:
+    decompressor = zlib.decompressobj()
+    # bounded so a forged stream cannot inflate past the announced size
+    # (a max_length of 0 would mean unbounded)
+    res = decompressor.decompress(data, size or 1)
+    if decompressor.unconsumed_tail:
+        raise ValueError("zlib stream exceeds the announced size")
+    return res
+
+defCodec(Codec("zlib", 2, zlib.compress, zlibDecompress))
+
+try:
+    import snappy
+    defCodec(Codec("snappy", 1, snappy.compress, lambda data, size: snappy.uncompress(bytes(data))))
+except ImportError:
+    pass
+
+try:
+    import zstandard
+    defCodec(Codec("zstd", 3, zstandard.ZstdCompressor().compress,
+                   lambda data, size: zstandard.ZstdDecompressor().decompress(data, max_output_size=size)))
+except ImportError:
+    pass
+
+
+def compressMsg(raw: Buffer, codec: Union[int, str]) -> Either[str, bytes]:
+    """
+    Wraps the complete message raw into an OP_COMPRESSED with the same request id
+    """
+    found = getCodec(codec)
+    if found is None:
+        return Left(f"Unknown compressor {codec}")
+    if len(raw) < MSG_HEADER.size:
+        return Left(f"Message too short: {len(raw)} bytes")
+    _, requestId, responseTo, opCode = MSG_HEADER.unpack_from(raw, 0)
+    if opCode == OP_COMPRESSED:
+        return Left("Message is already compressed")
+    try:
+        body = found.compress(memoryview(raw)[MSG_HEADER.size:])
+    except Exception as e:
+        return Left(f"{found.name} compression failed: {e}")
+    out = bytearray(COMPRESSED_HEADER.size)
+    COMPRESSED_HEADER.pack_into(out, 0, COMPRESSED_HEADER.size + len(body), requestId, responseTo, OP_COMPRESSED,
+                                opCode, len(raw) - MSG_HEADER.size, found.compressorId)
+    out += body
+    return Right(bytes(out))
+
+
+class MessageDecompressor:
+    """
+    Turns OP_COMPRESSED messages back into the message they wrap.
+
+    The result is written into a buffer owned by the decompressor and reused for every
+    message, so a connection does not allocate a fresh buffer per request. The returned
+    view is only valid until the next call to decompress.
+    """
+
+    def __init__(self, maxSize: int = MAX_MESSAGE_SIZE):
+        self.maxSize = maxSize
+        self.buffer = bytearray()
+
+    def decompress(self, raw: Buffer) -> Either[str, memoryview]:
+        if len(raw) < COMPRESSED_HEADER.size:
+            return Left(f"Compressed message too short: {len(raw)} bytes")
+        _, requestId, responseTo, opCode, originalOpCode, size, compressorId = COMPRESSED_HEADER.unpack_from(raw, 0)
+        if opCode != OP_COMPRESSED:
+            return Left(f"Not a compressed message: op code {opCode}")
+        if size < 0 or size > self.maxSize:
+            return Left(f"Invalid uncompressed size {size}")
+        codec = CODECS.get(compressorId, None)
+        if codec is None:
+            return Left(f"Unsupported compressor id {compressorId}")
+        try:
+            body = codec.decompress(memoryview(raw)[COMPRESSED_HEADER.size:], size)
+        except Exception as e:
+            return Left(f"{codec.name} decompression failed: {e}")
+        if len(body) != size:
+            return Left(f"Uncompressed size {len(body)} does not match the announced {size}")
+
+        total = MSG_HEADER.size + size
+        if len(self.buffer) < total:
+            # a fresh buffer rather than resizing, views handed out earlier pin the old one
+            self.buffer = bytearray(total)
+        MSG_HEADER.pack_into(self.buffer, 0, total, requestId, responseTo, originalOpCode)
+        self.buffer[MSG_HEADER.size:total] = body
+        return Right(memoryview(self.buffer)[:total])
+
+def decompressMsg(raw: Buffer) -> Either[str, bytes]:
+    """
+    The wrapped message as a standalone copy
+    """
+    return MessageDecompressor().decompress(raw) | bytes
@@ -0,0 +1,41 @@
+"""
+Logging for the wire protocol package.
+
+Everything goes through the standard logging module under the "mql.wireprotocol"
+logger, so the usual handler / level configuration applies. Events are structured: a
+short event name plus keyword fields, which are attached to the record as
+record.fields and rendered as key=value pairs in the message.
+
+Per-message logging sits behind an enabled() check at the call site, so with the level
+above DEBUG the hot path pays a cached level lookup and never formats anything:
+
+    if enabled(TRACE):
+        logEvent(TRACE, "msg.header", size=size, requestId=requestId)
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Any
+
+# below DEBUG, for per-message / per-section dumps
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+LOGGER = logging.getLogger("mql.wireprotocol")
+
+def enabled(level: int = logging.DEBUG) -> bool:
+    return LOGGER.isEnabledFor(level)
+
+def logEvent(level: int, event: str, **fields: Any):
+    if not LOGGER.isEnabledFor(level):
+        return
+    rendered = " ".join(f"{key}={value!r}" for key, value in fields.items())
+    LOGGER.log(level, f"{event} {rendered}" if rendered else event, extra={"event": event, "fields": fields})
+
+def preview(buf: Any, limit: int = 64) -> str:
+    """
+    Hex of the first limit bytes of buf, for logging payloads without dumping them whole
+    """
+    head = bytes(memoryview(buf)[:limit]).hex()
+    return head + "..." if len(buf) > limit else head
@@ -0,0 +1,255 @@
+"""
+Incremental parsing of OP_MSG messages off a connection.
+
+MessageStream.feed() takes bytes as they are received and returns events as soon as
+they are complete: the header and flag bits of a message, the start of each section,
+the elements and documents of every section (see mql.base.bsonStream), and the end of
+the message once its checksum, if present, has been verified. Section and document
+bytes are handed to a StreamingDecoder exactly as far as their length prefixes allow,
+so nothing past the current element is ever buffered and a handler can start on the
+first documents of a large insert while the rest is still on the wire.
+
+Other op codes are not parsed incrementally: their bytes are collected and returned
+whole as RawMessage, e.g. for OP_COMPRESSED to go through the decompressor.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from enum import Enum
+from typing import List, Optional, Union
+
+from mql.base.bsonDecoder import BSONDecodeError
+from mql.base.bsonStream import StreamingDecoder, ElementDecoded, DocumentDecoded, MAX_DOCUMENT_SIZE
+from mql.interfaces.wireprotocol.checksum import crc32c
+from mql.interfaces.wireprotocol.wireprotocol import (OpCode, FlagBits, SectionKind, MSG_HEADER, FLAG_BITS,
+                                                      SECTION_SIZE, CHECKSUM, MAX_MESSAGE_SIZE)
+
+@dataclass
+class MessageStart:
+    messageLength: int
+    requestId: int
+    responseTo: int
+    opCode: OpCode
+    flagBits: FlagBits
+
+@dataclass
+class SectionStart:
+    kind: SectionKind
+    # the identifier of a document sequence, None for the body
+    identifier: Optional[str]
+
+@dataclass
+class MessageEnd:
+    requestId: int
+
+@dataclass
+class RawMessage:
+    raw: bytes
+
+StreamEvent = Union[MessageStart, SectionStart, ElementDecoded, DocumentDecoded, MessageEnd, RawMessage]
+
+class State(Enum):
+    Header = 0
+    Raw = 1
+    Section = 2
+    BodySize = 3
+    SequenceSize = 4
+    SequenceIdentifier = 5
+    Documents = 6
+    Checksum = 7
+
+class MessageStream:
+    def __init__(self, maxMessageSize: int = MAX_MESSAGE_SIZE, maxDocumentSize: int = MAX_DOCUMENT_SIZE):
+        self.maxMessageSize = maxMessageSize
+        self.maxDocumentSize = maxDocumentSize
+        self.state = State.Header
+        self.pending = bytearray()
+        self.message: Optional[MessageStart] = None
+        # bytes of the message not consumed yet
+        self.remaining = 0
+        # bytes the document decoder is still owed for the current section
+        self.owed = 0
+        self.crc = 0
+        self.decoder: Optional[StreamingDecoder] = None
+
+    @property
+    def idle(self) -> bool:
+        """
+        Whether the stream ended on a message boundary
+        """
+        return self.state == State.Header and not self.pending
+
+    def feed(self, chunk) -> List[StreamEvent]:
+        """
+        Consumes chunk and returns the events it completed, raises BSONDecodeError on a
+        malformed message
+        """
+        view = memoryview(chunk).cast("B")
+        events: List[StreamEvent] = []
+        while view:
+            view = self.step(view, events)
+        return events
+
+    def take(self, view: memoryview, count: int) -> Optional[bytes]:
+        """
+        Collects up to count bytes into pending, returns them once all count are there
+        """
+        missing = count - len(self.pending)
+        self.pending += view[:missing]
+        if len(self.pending) < count:
+            return None
+        res = bytes(self.pending)
+        self.pending.clear()
+        return res
+
+    def consumed(self, data) -> None:
+        if self.message.flagBits.checksumPresent:
+            self.crc = crc32c(data, self.crc)
+        self.remaining -= len(data)
+
+    def step(self, view: memoryview, events: List[StreamEvent]) -> memoryview:
+        state = self.state
+
+        if state == State.Header:
+            size = MSG_HEADER.size + FLAG_BITS.size
+            before = len(self.pending)
+            data = self.take(view, size)
+            if data is None:
+                return view[len(view):]
+            rest = view[size - before:]
+            msgLen, requestId, responseTo, rawOpCode = MSG_HEADER.unpack_from(data, 0)
+            if msgLen < size or msgLen > self.maxMessageSize:
+                raise BSONDecodeError(f"Invalid message length {msgLen}")
+            self.remaining = msgLen
+            if rawOpCode != OpCode.Msg.value:
+                self.pending += data
+                self.remaining -= len(data)
+                self.state = State.Raw
+                if self.remaining == 0:
+                    self.endRaw(events)
+                return rest
+            bits = FLAG_BITS.unpack_from(data, MSG_HEADER.size)[0]
+            flags = FlagBits(1 == bits & 1, 1 == (bits >> 1) & 1, 1 == (bits >> 16) & 1)
+            if flags.checksumPresent and msgLen < size + CHECKSUM.size:
+                raise BSONDecodeError("Message too short for its checksum")
+            self.message = MessageStart(msgLen, requestId, responseTo, OpCode.Msg, flags)
+            self.crc = 0
+            self.consumed(data)
+            events.append(self.message)
+            self.nextSection(events)
+            return rest
+
+        if state == State.Raw:
+            taken = view[:self.remaining]
+            self.pending += taken
+            self.remaining -= len(taken)
+            if self.remaining == 0:
+                self.endRaw(events)
+            return view[len(taken):]
+
+        if state == State.Documents:
+            taken = view[:self.owed]
+            self.consumed(taken)
+            events.extend(self.decoder.feed(taken))
+            self.owed -= len(taken)
+            if self.owed == 0:
+                if not self.decoder.idle:
+                    raise BSONDecodeError("Section ends inside a document")
+                self.nextSection(events)
+            return view[len(taken):]
+
+        if state == State.Checksum:
+            before = len(self.pending)
+            data = self.take(view, CHECKSUM.size)
+            if data is None:
+                return view[len(view):]
+            expected = CHECKSUM.unpack(data)[0]
+            if expected != self.crc:
+                raise BSONDecodeError(f"Checksum mismatch: expected {expected:#010x}, computed {self.crc:#010x}")
+            self.remaining -= CHECKSUM.size
+            self.endMessage(events)
+            return view[CHECKSUM.size - before:]
+
+        if state == State.Section:
+            kind = view[0]
+            self.consumed(view[:1])
+            if kind == SectionKind.Document.value:
+                self.state = State.BodySize
+                events.append(SectionStart(SectionKind.Document, None))
+            elif kind == SectionKind.DocumentSequence.value:
+                self.state = State.SequenceSize
+            else:
+                raise BSONDecodeError(f"Unknown section kind {kind}")
+            return view[1:]
+
+        if state in (State.BodySize, State.SequenceSize):
+            before = len(self.pending)
+            data = self.take(view, SECTION_SIZE.size)
+            if data is None:
+                return view[len(view):]
+            self.consumed(data)
+            size = SECTION_SIZE.unpack(data)[0]
+            if size < 5 or size - SECTION_SIZE.size > self.sectionBytes():
+                raise BSONDecodeError(f"Invalid section size {size}")
+            self.decoder = StreamingDecoder(self.maxDocumentSize)
+            if state == State.BodySize:
+                # the decoder needs the document's length prefix too
+                events.extend(self.decoder.feed(data))
+                self.owed = size - SECTION_SIZE.size
+                self.state = State.Documents
+            else:
+                self.owed = size - SECTION_SIZE.size
+                self.state = State.SequenceIdentifier
+            return view[SECTION_SIZE.size - before:]
+
+        # State.SequenceIdentifier
+        end = bytes(view[:self.owed]).find(0)
+        if end < 0:
+            if len(view) >= self.owed:
+                raise BSONDecodeError("Unterminated document sequence identifier")
+            self.pending += view
+            self.consumed(view)
+            self.owed -= len(view)
+            return view[len(view):]
+        self.pending += view[:end]
+        self.consumed(view[:end + 1])
+        self.owed -= end + 1
+        try:
+            identifier = str(self.pending, "utf-8")
+        except UnicodeDecodeError as e:
+            raise BSONDecodeError(f"Invalid document sequence identifier: {e}") from e
+        self.pending.clear()
+        events.append(SectionStart(SectionKind.DocumentSequence, identifier))
+        self.state = State.Documents
+        if self.owed == 0:
+            self.nextSection(events)
+        return view[end + 1:]
+
+    def sectionBytes(self) -> int:
+        """
+        Bytes of the message left for sections, excluding the checksum
+        """
+        return self.remaining - (CHECKSUM.size if self.message.flagBits.checksumPresent else 0)
+
+    def nextSection(self, events: List[StreamEvent]):
+        self.decoder = None
+        left = self.sectionBytes()
+        if left > 0:
+            self.state = State.Section
+        elif left < 0:
+            raise BSONDecodeError("Sections overrun the message")
+        elif self.message.flagBits.checksumPresent:
+            self.state = State.Checksum
+        else:
+            self.endMessage(events)
+
+    def endRaw(self, events: List[StreamEvent]):
+        events.append(RawMessage(bytes(self.pending)))
+        self.pending.clear()
+        self.state = State.Header
+
+    def endMessage(self, events: List[StreamEvent]):
+        events.append(MessageEnd(self.message.requestId))
+        self.message = None
+        self.state = State.Header
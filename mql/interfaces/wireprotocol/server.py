@@ -1,12 +1,16 @@
+import logging
 import socket
 import sys
 import os
-import struct
 
-from fpy.data.either import isLeft, isRight, fromLeft, fromRight
+from mql.base.bsonDecoder import BSONDecodeError
+from mql.interfaces.wireprotocol.msgStream import MessageStream, RawMessage
+from mql.interfaces.wireprotocol.wireprotocol import MSG_HEADER
+from mql.interfaces.wireprotocol.instrumentation import TRACE, enabled, logEvent
 
-from mql.interfaces.wireprotocol.wireprotocol import parseMsg
 
+# bytes asked of the socket per recv
+RECV_SIZE = 64 * 1024
 
 def serve(port = 27017):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
@@ -15,36 +19,30 @@ def serve(port = 27017):
         print(f"listening on 127.0.0.1:{port}")
         conn, addr = sock.accept()
         with conn:
-            print(f"connection from {addr}")
+            logEvent(logging.INFO, "connection.accepted", peer=addr)
+            # messages are parsed as their bytes arrive, documents come out while the rest is still in flight
+            stream = MessageStream()
             while True:
-                if not conn:
-                    print("not conn, breaking")
+                chunk = conn.recv(RECV_SIZE)
+                if not chunk:
                     break
-                lenData = conn.recv(4)
-                if not lenData:
+                try:
+                    events = stream.feed(chunk)
+                except BSONDecodeError as e:
+                    # the stream lost its framing, there is no next message to resync on
+                    logEvent(logging.WARNING, "msg.invalid", error=str(e))
                     break
-                msgLen = struct.unpack("<i", lenData)[0]
-                print(f"size: {msgLen}")
-                rawMsg = list(lenData + conn.recv(msgLen))
-                print(f"{rawMsg = }")
-                msg = parseMsg(rawMsg)
-                if isLeft(msg):
-                    print("Failed parsing msg: ")
-                    print(fromLeft(None, msg))
-                    continue
-                parsedMsg = fromRight(None, msg)
-                assert(parsedMsg is not None)
-                
-
-
-
-
-
-
-
-
-
-
+                for event in events:
+                    if isinstance(event, RawMessage):
+                        # OP_COMPRESSED and the legacy op codes are not served
+                        _, requestId, _, opCode = MSG_HEADER.unpack_from(event.raw, 0)
+                        logEvent(logging.WARNING, "msg.unsupported", requestId=requestId, opCode=opCode,
+                                 size=len(event.raw))
+                    elif enabled(TRACE):
+                        logEvent(TRACE, "msg.event", event=event)
+            if not stream.idle:
+                logEvent(logging.WARNING, "connection.truncated", peer=addr)
+            logEvent(logging.INFO, "connection.closed", peer=addr)
 
 
 if __name__ == "__main__":
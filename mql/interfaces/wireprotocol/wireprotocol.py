@@ -1,17 +1,18 @@
 from dataclasses import dataclass
-from abc import ABCMeta
-from typing import Iterable, List, Tuple, Sequence, Any
+from abc import ABC
+from typing import ClassVar, Dict, Iterable, Iterator, Optional, Sequence, Any
 from mql.base.bson import BSONDocument
-from mql.base.bsonBinary import parseDocument, takeNBytes, nBytesToInt
+from mql.base.bsonDecoder import Buffer, BSONDecodeError, asBuffer, decodeDocument, readDocument, readI32, readCStr, documentBounds
+from mql.base.bsonRaw import RawBSONDocument
+from mql.base.bsonEncoder import encodeInto, writeCStr
+from mql.interfaces.wireprotocol.checksum import crc32c
+from mql.interfaces.wireprotocol.instrumentation import TRACE, enabled, logEvent, preview
 from enum import Enum
+import struct
 
-from fpy.parsec.parsec import parser, one, ptrans, many, many1, just_nothing
+from fpy.parsec.parsec import parser
 from fpy.control.monad import do
-from fpy.data.maybe import Maybe, Nothing, Just
-from fpy.data.either import Either, Left, Right
-from fpy.data.function import const
-from fpy.composable.collections import trans0
-from fpy.debug.debug import trace
+from fpy.data.either import Either, Left, Right, isLeft
 
 """
 OpMsg Packet:
@@ -25,6 +26,7 @@ class OpCode(Enum):
     Insert = 2002
     Query = 2004
     GetMore = 2005
+    Compressed = 2012
     Msg = 2013
 
 @dataclass
@@ -37,15 +39,60 @@ class SectionKind(Enum):
     Document = 0
     DocumentSequence = 1
 
-class Section(ABCMeta):
-    kind: SectionKind
+class Section(ABC):
+    kind: ClassVar[SectionKind]
 
 @dataclass
 class SectionBody(Section):
+    kind: ClassVar[SectionKind] = SectionKind.Document
     document: BSONDocument
 
+class DocumentSequence:
+    """
+    The documents of a kind 1 section, decoded one at a time while iterating.
+
+    Only a view of the section's bytes is kept, so a large batch is never materialised
+    as a whole; every iteration starts over from the first document. A malformed
+    document raises BSONDecodeError when iteration reaches it.
+    """
+
+    def __init__(self, raw: Buffer):
+        self.raw = memoryview(raw)
+
+    def offsets(self) -> Iterator[int]:
+        """
+        Start offset of every document, found by hopping over the length prefixes
+        """
+        pos = 0
+        while pos < len(self.raw):
+            yield pos
+            pos = documentBounds(self.raw, pos)[1]
+
+    def __iter__(self) -> Iterator[BSONDocument]:
+        pos = 0
+        while pos < len(self.raw):
+            try:
+                doc, pos = readDocument(self.raw, pos)
+            except (struct.error, IndexError, UnicodeDecodeError) as e:
+                raise BSONDecodeError(f"Malformed document at {pos}: {e}") from e
+            yield doc
+
+    def rawDocuments(self) -> Iterator[RawBSONDocument]:
+        """
+        Lazy views over the documents instead of decoded copies
+        """
+        for pos in self.offsets():
+            yield RawBSONDocument(self.raw, pos)
+
+    def __len__(self):
+        return sum(1 for _ in self.offsets())
+
+    def __repr__(self):
+        return f"DocumentSequence({len(self.raw)} bytes)"
+
 @dataclass
 class SectionDocumentSequence(Section):
+    kind: ClassVar[SectionKind] = SectionKind.DocumentSequence
     documentSequenceIdentifier: str
     documents: Iterable[BSONDocument]
 
@@ -58,41 +105,63 @@ class OpMsg:
     flagBits: FlagBits
     sections: Iterable[Section]
 
+# the server's default maxMessageSizeBytes
+MAX_MESSAGE_SIZE = 48 * 1000 * 1000
+
+MSG_HEADER = struct.Struct("<iiii")
+FLAG_BITS = struct.Struct("<I")
+SECTION_SIZE = struct.Struct("<i")
+CHECKSUM = struct.Struct("<I")
+
+OP_CODES = {opCode.value: opCode for opCode in OpCode}
+
 @parser
-@do
-def parseFlag(msg: Sequence[int]):
-    with (nBytesToInt(2)(msg) as (lower, msg),
-          nBytesToInt(2)(msg) as (upper, msg)):
-        return Right((FlagBits(1 == lower & 1, 1 == (lower >> 1) & 1, 1 == upper & 1), msg))
+def parseFlag(b: Buffer):
+    if len(b) < FLAG_BITS.size:
+        return Left("Message too short for flag bits")
+    bits = FLAG_BITS.unpack_from(b, 0)[0]
+    return Right((FlagBits(1 == bits & 1, 1 == (bits >> 1) & 1, 1 == (bits >> 16) & 1), b[FLAG_BITS.size:]))
 
 @parser
-@do
 def parseBody(b):
-    return Left("Not Implemented Yet")
+    return decodeDocument(asBuffer(b)) | (lambda res: (SectionBody(res[0]), res[1]))
 
 @parser
-@do
 def parseDocSeq(b):
-    return Left("Not Implemented Yet")
+    """
+    int32 size, cstring identifier, then documents up to size bytes from the start.
+    The documents themselves are left undecoded, see DocumentSequence.
+    """
+    buf = memoryview(asBuffer(b))
+    try:
+        size = readI32(buf, 0)
+        if size < 5 or size > len(buf):
+            return Left(f"Invalid document sequence size {size}")
+        identifier, pos = readCStr(buf[:size], 4)
+    except BSONDecodeError as e:
+        return Left(str(e))
+    return Right((SectionDocumentSequence(identifier, DocumentSequence(buf[pos:size])), buf[size:]))
 
 @parser
-@do
 def parseSection(b):
-    with nBytesToInt(1)(b) as (kind, rest):
-        if kind == 0:
-            return parseBody(rest)
-        if kind == 1:
-            return parseDocSeq(rest)
-        return Left(f"Unknown section kind {kind}")
+    buf = memoryview(asBuffer(b))
+    if not buf:
+        return Left("Missing section kind")
+    kind = buf[0]
+    if kind == SectionKind.Document.value:
+        return parseBody(buf[1:])
+    if kind == SectionKind.DocumentSequence.value:
+        return parseDocSeq(buf[1:])
+    return Left(f"Unknown section kind {kind}")
 
 @do
-def parseSections(b: Sequence[int]) -> Either[Any, Sequence[Section]]:
+def parseSections(b: Buffer) -> Either[Any, Sequence[Section]]:
     hasBody = False
-    work_b = b
+    work_b = memoryview(asBuffer(b))
     sections: Sequence[Section] = []
     while work_b:
-        print(f"{work_b = }")
-        print(f"{bytes(work_b) = }")
+        if enabled(TRACE):
+            logEvent(TRACE, "msg.section", offset=len(b) - len(work_b), kind=work_b[0], head=preview(work_b))
         with parseSection(work_b) as (sec, rest_b):
             if isinstance(sec, SectionBody):
                 if hasBody:
@@ -102,28 +171,73 @@ def parseSections(b: Sequence[int]) -> Either[Any, Sequence[Section]]:
             work_b = rest_b
     return Right(sections)
 
+def verifyChecksum(raw: Buffer, msgSize: int, checksum: int) -> Either[str, None]:
+    """
+    Compares the CRC-32C of everything before the checksum with the transmitted value
+    """
+    actual = crc32c(raw[:msgSize - CHECKSUM.size])
+    if actual != checksum:
+        return Left(f"Checksum mismatch: expected {checksum:#010x}, computed {actual:#010x}")
+    return Right(None)
+
 @parser
 @do
-def parseMsg(msg: Sequence[int]):
-    with (trace("msgSize: ", nBytesToInt(4)(msg)) as (msgSize, msg),
-          trace("reqId: ", nBytesToInt(4)(msg)) as (reqId, msg),
-          trace("resTo: ", nBytesToInt(4)(msg)) as (resTo, msg),
-          trace("opCode: ", nBytesToInt(4)(msg)) as (rawOpCode, msg),
-          trace("flag: ", parseFlag(msg)) as (flag, msg),
-          trace("sectionBytes: ", takeNBytes(msgSize - 16 - 4 - (4 if flag.checksumPresent else 0))(msg)) as (sectionBytes, msg),
-          trace("checkSum: ", (takeNBytes(4) if flag.checksumPresent else just_nothing(None))(msg)) as (_, rest)):
-        print(f"{rawOpCode = }")
-        with parseSections(sectionBytes) as (sections, rest):
-            for opCode in OpCode:
-                if opCode.value == rawOpCode:
-                    return Right((OpMsg(msgSize, reqId, resTo, opCode, flag, sections), rest))
-            return Left(f"Unknown op code: {rawOpCode}")
-    
-
-
-if __name__ == "__main__":
-    b = [*bytearray([1,2,3,4])]
-    with takeNBytes(4)(b) as (b4, _):
-        print(b4)
-        print(bytes(b4))
+def parseMsg(raw: Buffer):
+    """
+    Parses the message at the start of raw. Accepts any buffer, the sections are parsed
+    from views into it without copying.
+    """
+    buf = memoryview(asBuffer(raw))
+    if len(buf) < MSG_HEADER.size + FLAG_BITS.size:
+        return Left(f"Message too short: {len(buf)} bytes")
+    msgSize, reqId, resTo, rawOpCode = MSG_HEADER.unpack_from(buf, 0)
+    if msgSize < MSG_HEADER.size + FLAG_BITS.size or msgSize > len(buf):
+        return Left(f"Invalid message size {msgSize} for {len(buf)} bytes")
+    if enabled(TRACE):
+        logEvent(TRACE, "msg.header", size=msgSize, requestId=reqId, responseTo=resTo, opCode=rawOpCode)
+    opCode = OP_CODES.get(rawOpCode, None)
+    if opCode is None:
+        return Left(f"Unknown op code: {rawOpCode}")
+    with parseFlag(buf[MSG_HEADER.size:msgSize]) as (flag, body):
+        checksum = None
+        if flag.checksumPresent:
+            if len(body) < CHECKSUM.size:
+                return Left("Message too short for its checksum")
+            checksum = CHECKSUM.unpack_from(body, len(body) - CHECKSUM.size)[0]
+            body = body[:-CHECKSUM.size]
+        with (verifyChecksum(buf, msgSize, checksum) if flag.checksumPresent else Right(None)) as _, \
+             parseSections(body) as sections:
+            return Right((OpMsg(msgSize, reqId, resTo, opCode, flag, sections), buf[msgSize:]))
+
+
+def encodeMsg(body: BSONDocument, requestId: int, responseTo: int = 0, moreToCome: bool = False,
+              sequences: Optional[Dict[str, Iterable[BSONDocument]]] = None, checksum: bool = False) -> Either[str, bytes]:
+    """
+    Serializes an OP_MSG with body as its kind 0 section, followed by a kind 1 section
+    for every entry of sequences. With checksum, sets checksumPresent and appends the
+    CRC-32C of the message.
+    """
+    out = bytearray(MSG_HEADER.size + FLAG_BITS.size)
+    FLAG_BITS.pack_into(out, MSG_HEADER.size, (2 if moreToCome else 0) | (1 if checksum else 0))
+    out.append(SectionKind.Document.value)
+    res = encodeInto(out, body)
+
+    for identifier, documents in (sequences or dict()).items():
+        out.append(SectionKind.DocumentSequence.value)
+        start = len(out)
+        out += b"\x00\x00\x00\x00"
+        writeCStr(out, identifier)
+        for doc in documents:
+            if isLeft(res):
+                break
+            res = encodeInto(out, doc)
+        SECTION_SIZE.pack_into(out, start, len(out) - start)
+
+    def finish(_):
+        MSG_HEADER.pack_into(out, 0, len(out) + (4 if checksum else 0), requestId, responseTo, OpCode.Msg.value)
+        if checksum:
+            out.extend(CHECKSUM.pack(crc32c(out)))
+        return bytes(out)
+
+    return res | finish
 
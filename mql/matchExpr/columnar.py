@@ -0,0 +1,126 @@
+"""
+Column extraction for evaluating match expressions over a batch of documents.
+
+A ColumnBatch pulls the leaves of every referenced path out of the documents once and
+shares them between all predicates on that path. When numpy is available, paths whose
+leaves are plain numbers are additionally turned into float64 arrays so comparisons can
+run as array operations. Rows that do not fit that shape (arrays, mixed types, NaN,
+integers float64 cannot represent exactly) are flagged and evaluated one by one instead.
+
+Masks are numpy boolean arrays when numpy is installed and lists of bools otherwise.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from mql.base.bson import BSONDocument, BSONElement, NumericTypes
+from mql.base.path import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# integers beyond this magnitude cannot round trip through a float64
+MAX_EXACT_INT = 2 ** 53
+
+def isExactNumber(value: Any) -> bool:
+    """
+    Whether a numeric python value compares the same as a python number and as a float64
+    """
+    if isinstance(value, float):
+        return value == value
+    return -MAX_EXACT_INT <= value <= MAX_EXACT_INT
+
+
+@dataclass
+class NumericColumn:
+    values: Any # np.ndarray[float64], 0 where the row is not eligible
+    eligible: Any # np.ndarray[bool], row has exactly one exact numeric leaf
+    fallback: List[int] # rows that have leaves but must be evaluated one by one
+
+
+class ColumnBatch:
+    def __init__(self, docs: Sequence[BSONDocument]):
+        self.docs = docs
+        self._leaves: Dict[str, List[List[BSONElement]]] = dict()
+        self._numeric: Dict[str, Optional[NumericColumn]] = dict()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def leaves(self, path: Path, extract: Callable[[Path], Callable[[BSONDocument], List[BSONElement]]]) -> List[List[BSONElement]]:
+        key = str(path)
+        column = self._leaves.get(key, None)
+        if column is None:
+            leavesOf = extract(path)
+            column = [leavesOf(doc) for doc in self.docs]
+            self._leaves[key] = column
+        return column
+
+    def numeric(self, path: Path, extract: Callable[[Path], Callable[[BSONDocument], List[BSONElement]]]) -> Optional[NumericColumn]:
+        """
+        The numeric view of a path's column, or None without numpy
+        """
+        if np is None:
+            return None
+        key = str(path)
+        if key in self._numeric:
+            return self._numeric[key]
+        column = self.leaves(path, extract)
+        # fill python lists and convert once, item assignment into numpy arrays is slow
+        values = [0.0] * len(column)
+        eligible = [False] * len(column)
+        fallback = []
+        for row, rowLeaves in enumerate(column):
+            if not rowLeaves:
+                continue
+            if len(rowLeaves) == 1:
+                value = rowLeaves[0].value
+                if value.bsonType in NumericTypes and isExactNumber(value.value):
+                    values[row] = value.value
+                    eligible[row] = True
+                    continue
+            fallback.append(row)
+        res = NumericColumn(np.array(values, dtype=np.float64), np.array(eligible, dtype=bool), fallback)
+        self._numeric[key] = res
+        return res
+
+    # masks
+
+    def fromBools(self, bools: Sequence[bool]):
+        if np is None:
+            return list(bools)
+        return np.fromiter(bools, dtype=bool, count=len(self.docs))
+
+    def constant(self, value: bool):
+        if np is None:
+            return [value] * len(self.docs)
+        return np.full(len(self.docs), value, dtype=bool)
+
+    def maskAnd(self, masks: List[Any]):
+        if not masks:
+            return self.constant(True)
+        if np is None:
+            return [all(row) for row in zip(*masks)]
+        return np.logical_and.reduce(masks)
+
+    def maskOr(self, masks: List[Any]):
+        if not masks:
+            return self.constant(False)
+        if np is None:
+            return [any(row) for row in zip(*masks)]
+        return np.logical_or.reduce(masks)
+
+    def maskNot(self, mask: Any):
+        if np is None:
+            return [not row for row in mask]
+        return np.logical_not(mask)
+
+    @staticmethod
+    def toList(mask: Any) -> List[bool]:
+        if np is None:
+            return list(mask)
+        return mask.tolist()
@@ -0,0 +1,306 @@
+"""
+A rewrite pass over parsed match expressions.
+
+optimize() returns an equivalent expression that is cheaper to evaluate:
+ - nested $and inside $and (and $or inside $or, or inside $nor) are flattened and
+   single child $and / $or are replaced by their child
+ - NotExpression(NotExpression(x)) becomes x
+ - the path predicates of an $and on the same path are merged into one
+   PathAndExpression, which extracts the leaves of the path once
+ - repeated children of a tree are kept once
+ - predicates that can never match, and trees decided by them, are folded into the
+   constants ALWAYS_TRUE ($and of nothing) and ALWAYS_FALSE ($or of nothing)
+ - the children of every tree are ordered so evaluation short circuits as early and as
+   cheaply as possible
+
+Contradictions are only folded where no document can satisfy them: x and its negation
+under one $and, a comparison against NaN, an $in over nothing. {a: {$gt: 5, $lt: 3}} is
+not one, an array a: [1, 10] satisfies each bound with a different element.
+
+Children are ordered by an estimated cost and selectivity (the fraction of documents an
+expression matches). An $and runs its children by ascending cost / (1 - selectivity),
+so cheap predicates that reject most documents come first; $or and $nor stop at the
+first match and run theirs by ascending cost / selectivity. Both estimates are static
+guesses from operators and paths unless a Feedback has observed the predicate enough
+times, in which case its measured selectivity is used.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from mql.base.bson import BSONDocument, NumericTypes
+from mql.base.path import Path
+from mql.matchExpr.querySelector import (MatchableExpression, PathMatchExpression, PathAndExpression, TreeExpression,
+                                         NotExpression, Predicate, TreeOperator, MatchOperator, TreeOperatorCompiler)
+
+from fpy.data.function import const
+
+# an empty $and matches everything, an empty $or nothing
+ALWAYS_TRUE = TreeExpression(TreeOperator.AND, [])
+ALWAYS_FALSE = TreeExpression(TreeOperator.OR, [])
+
+def isAlwaysTrue(expr: MatchableExpression) -> bool:
+    return isinstance(expr, TreeExpression) and expr.operator == TreeOperator.AND and not expr.children
+
+def isAlwaysFalse(expr: MatchableExpression) -> bool:
+    return isinstance(expr, TreeExpression) and expr.operator == TreeOperator.OR and not expr.children
+
+ComparisonOperators = frozenset([MatchOperator.EQ, MatchOperator.LT, MatchOperator.LTE,
+                                 MatchOperator.GT, MatchOperator.GTE])
+
+def exprKey(expr: MatchableExpression) -> Any:
+    """
+    Equal for expressions that match the same documents by construction, e.g. {a: 1} and
+    {a: 1.0}, so it identifies duplicates and predicates across queries
+    """
+    if isinstance(expr, PathMatchExpression):
+        return (tuple(expr.path.parts), expr.predicate.operator, expr.predicate.argument.value.sortKey())
+    if isinstance(expr, PathAndExpression):
+        return (tuple(expr.path.parts), TreeOperator.AND,
+                tuple((predicate.operator, predicate.argument.value.sortKey()) for predicate in expr.predicates))
+    if isinstance(expr, NotExpression):
+        return ("$not", exprKey(expr.expr))
+    if isinstance(expr, TreeExpression):
+        return (expr.operator, tuple(exprKey(child) for child in expr.children))
+    return id(expr)
+
+def neverMatches(expr: PathMatchExpression) -> bool:
+    operator = expr.predicate.operator
+    value = expr.predicate.argument.value
+    if operator in ComparisonOperators:
+        # NaN is unordered, see compareBracketed
+        return value.bsonType in NumericTypes and value.value != value.value
+    if operator == MatchOperator.IN:
+        return all(elm.value.bsonType in NumericTypes and elm.value.value != elm.value.value
+                   for elm in value.value.elements)
+    return False
+
+
+@dataclass
+class PredicateCounters:
+    evaluated: int = 0
+    matched: int = 0
+
+# observations needed before a measured selectivity replaces the static guess
+MIN_SAMPLES = 100
+
+class Feedback:
+    """
+    Runtime match counts per path predicate (or merged PathAndExpression), keyed by exprKey so they carry over to
+    every query using the same predicate. Counts are gathered by running queries
+    compiled with instrument(); a predicate is only counted when short circuiting lets
+    it run, so its selectivity is conditional on the ones ordered before it.
+    """
+    def __init__(self, minSamples: int = MIN_SAMPLES):
+        self.minSamples = minSamples
+        self.counters: Dict[Any, PredicateCounters] = dict()
+
+    def selectivity(self, expr: PathMatchExpression | PathAndExpression) -> Optional[float]:
+        counters = self.counters.get(exprKey(expr), None)
+        if counters is None or counters.evaluated < self.minSamples:
+            return None
+        return counters.matched / counters.evaluated
+
+    def instrument(self, expr: MatchableExpression) -> Callable[[BSONDocument], bool]:
+        """
+        expr.compile() with every path predicate counting its evaluations and matches
+        """
+        if isinstance(expr, (PathMatchExpression, PathAndExpression)):
+            counters = self.counters.setdefault(exprKey(expr), PredicateCounters())
+            inner = expr.compile()
+
+            def run(doc: BSONDocument) -> bool:
+                res = inner(doc)
+                counters.evaluated += 1
+                counters.matched += res
+                return res
+            return run
+        if isinstance(expr, NotExpression):
+            negated = self.instrument(expr.expr)
+            return lambda doc: not negated(doc)
+        if isinstance(expr, TreeExpression):
+            compiler = TreeOperatorCompiler.get(expr.operator, None)
+            if compiler is None:
+                return const(False)
+            return compiler([self.instrument(child) for child in expr.children])
+        return expr.compile()
+
+
+# Estimates
+#
+# Costs are in units of one comparison against one leaf, selectivities are guesses in
+# the spirit of the usual textbook defaults.
+
+OperatorCost = {MatchOperator.REGEX: 10.0}
+OperatorSelectivity = {MatchOperator.EQ: 0.1, MatchOperator.LT: 0.3, MatchOperator.LTE: 0.3,
+                       MatchOperator.GT: 0.3, MatchOperator.GTE: 0.3}
+DEFAULT_SELECTIVITY = 0.5
+
+def estimate(expr: MatchableExpression, feedback: Optional[Feedback] = None) -> Tuple[float, float]:
+    """
+    (cost, selectivity) of evaluating expr against one document
+    """
+    if isinstance(expr, PathMatchExpression):
+        operator = expr.predicate.operator
+        # every path component is a lookup
+        cost = len(expr.path.parts) + OperatorCost.get(operator, 1.0)
+        if operator == MatchOperator.IN:
+            size = len(expr.predicate.argument.value.value.elements)
+            named = expr.predicate.namedArguments
+            # numbers are a single set lookup, everything else is compared one by one
+            cost += len(named["others"]) if named is not None else size
+            selectivity = min(DEFAULT_SELECTIVITY, OperatorSelectivity[MatchOperator.EQ] * size)
+        else:
+            selectivity = OperatorSelectivity.get(operator, DEFAULT_SELECTIVITY)
+        return cost, measuredSelectivity(expr, feedback, selectivity)
+    if isinstance(expr, PathAndExpression):
+        lookups = len(expr.path.parts)
+        cost, selectivity = lookups, 1.0
+        for predicate in expr.predicates:
+            predicateCost, predicateSelectivity = estimate(PathMatchExpression(expr.path, predicate), feedback)
+            # the path is only walked once
+            cost += predicateCost - lookups
+            selectivity *= predicateSelectivity
+        return cost, measuredSelectivity(expr, feedback, selectivity)
+    if isinstance(expr, NotExpression):
+        cost, selectivity = estimate(expr.expr, feedback)
+        return cost, 1.0 - selectivity
+    if isinstance(expr, TreeExpression):
+        estimates = [estimate(child, feedback) for child in expr.children]
+        cost = sum(cost for cost, _ in estimates)
+        if expr.operator == TreeOperator.AND:
+            selectivity = 1.0
+            for _, childSelectivity in estimates:
+                selectivity *= childSelectivity
+            return cost, selectivity
+        # the chance that no child matches
+        none = 1.0
+        for _, childSelectivity in estimates:
+            none *= 1.0 - childSelectivity
+        return cost, none if expr.operator == TreeOperator.NOR else 1.0 - none
+    return 1.0, DEFAULT_SELECTIVITY
+
+def measuredSelectivity(expr: PathMatchExpression | PathAndExpression, feedback: Optional[Feedback],
+                        estimated: float) -> float:
+    if feedback is None:
+        return estimated
+    measured = feedback.selectivity(expr)
+    return estimated if measured is None else measured
+
+def rank(operator: TreeOperator, cost: float, selectivity: float) -> float:
+    """
+    Expected cost per decided document, lower runs first
+    """
+    decisive = 1.0 - selectivity if operator == TreeOperator.AND else selectivity
+    return cost / decisive if decisive > 0 else float("inf")
+
+
+# Rewrites
+
+def optimize(expr: MatchableExpression, feedback: Optional[Feedback] = None) -> MatchableExpression:
+    if isinstance(expr, PathMatchExpression):
+        return ALWAYS_FALSE if neverMatches(expr) else expr
+    if isinstance(expr, PathAndExpression):
+        return ALWAYS_FALSE if any(map(neverMatches, expr.expressions())) else expr
+    if isinstance(expr, NotExpression):
+        return negate(optimize(expr.expr, feedback))
+    if isinstance(expr, TreeExpression):
+        return optimizeTree(expr.operator, [optimize(child, feedback) for child in expr.children], feedback)
+    return expr
+
+def negate(expr: MatchableExpression) -> MatchableExpression:
+    if isinstance(expr, NotExpression):
+        return expr.expr
+    if isAlwaysTrue(expr):
+        return ALWAYS_FALSE
+    if isAlwaysFalse(expr):
+        return ALWAYS_TRUE
+    return NotExpression(expr)
+
+def optimizeTree(operator: TreeOperator, children: List[MatchableExpression],
+                 feedback: Optional[Feedback]) -> MatchableExpression:
+    # $nor is the negation of an $or of its children, so it flattens and folds like one
+    inner = TreeOperator.AND if operator == TreeOperator.AND else TreeOperator.OR
+    # a child with this value decides the tree, one with the other value can be dropped
+    decisive = isAlwaysFalse if inner == TreeOperator.AND else isAlwaysTrue
+    neutral = isAlwaysTrue if inner == TreeOperator.AND else isAlwaysFalse
+
+    flat: List[MatchableExpression] = []
+    for child in children:
+        if isinstance(child, TreeExpression) and child.operator == inner and child.children:
+            flat.extend(child.children)
+        else:
+            flat.append(child)
+
+    kept: List[MatchableExpression] = []
+    keys = set()
+    for child in flat:
+        if decisive(child):
+            return decide(operator, inner)
+        if neutral(child):
+            continue
+        key = exprKey(child)
+        if key in keys:
+            continue
+        keys.add(key)
+        kept.append(child)
+
+    # x and not x: false under $and, true under $or
+    for child in kept:
+        if isinstance(child, NotExpression) and exprKey(child.expr) in keys:
+            return decide(operator, inner)
+
+    if operator == TreeOperator.AND:
+        kept = mergePaths(kept, feedback)
+
+    estimates = {id(child): estimate(child, feedback) for child in kept}
+    kept.sort(key=lambda child: rank(inner, *estimates[id(child)]))
+
+    if not kept:
+        # every child was neutral
+        return ALWAYS_FALSE if operator == TreeOperator.OR else ALWAYS_TRUE
+    if len(kept) == 1:
+        return negate(kept[0]) if operator == TreeOperator.NOR else kept[0]
+    return TreeExpression(operator, kept)
+
+def decide(operator: TreeOperator, inner: TreeOperator) -> MatchableExpression:
+    """
+    The constant a tree takes when one of its children decides it
+    """
+    value = inner == TreeOperator.OR
+    if operator == TreeOperator.NOR:
+        value = not value
+    return ALWAYS_TRUE if value else ALWAYS_FALSE
+
+def mergePaths(children: List[MatchableExpression], feedback: Optional[Feedback]) -> List[MatchableExpression]:
+    """
+    Replaces the path predicates of an $and on one path by a single PathAndExpression,
+    in the place of the first of them
+    """
+    groups: Dict[Path, List[Predicate]] = dict()
+    for child in children:
+        if isinstance(child, PathMatchExpression):
+            groups.setdefault(child.path, []).append(child.predicate)
+        elif isinstance(child, PathAndExpression):
+            groups.setdefault(child.path, []).extend(child.predicates)
+
+    merged = []
+    for child in children:
+        if not isinstance(child, (PathMatchExpression, PathAndExpression)):
+            merged.append(child)
+            continue
+        predicates = groups.pop(child.path, None)
+        if predicates is None:
+            # merged into an earlier child
+            continue
+        if len(predicates) == 1:
+            merged.append(child)
+            continue
+        # on an array each predicate is still tested by itself, cheapest and most selective first
+        path = child.path
+        predicates.sort(key=lambda predicate: rank(TreeOperator.AND,
+                                                   *estimate(PathMatchExpression(path, predicate), feedback)))
+        merged.append(PathAndExpression(child.path, predicates))
+    return merged
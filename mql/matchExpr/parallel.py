@@ -0,0 +1,140 @@
+"""
+Evaluating a match expression over a stream of serialized documents on several cores.
+
+The input is a buffer of back to back BSON documents, e.g. a document sequence or the
+contents of a collection file. It is cut into shards of about chunkBytes at document
+boundaries, only by hopping length prefixes, and each shard goes to a worker process as
+plain bytes, which are far cheaper to pickle than a BSONDocument tree. The query travels
+serialized as well. A worker parses and compiles it the first time it sees it and keeps
+the compiled function for the following shards, then runs it over lazy RawBSONDocument
+views so only the fields the query looks at are ever decoded.
+
+Results are the offsets of the matching documents in the input, in input order: shards
+are collected in the order they were submitted, with at most a few per worker in flight
+so a large input is never copied out all at once.
+"""
+
+from __future__ import annotations
+
+import os
+import struct
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from mql.base.bson import BSONDocument
+from mql.base.bsonDecoder import Buffer, BSONDecodeError, readI32, readDocument
+from mql.base.bsonEncoder import encodeDocument
+from mql.base.bsonRaw import RawBSONDocument
+from mql.matchExpr.optimizer import optimize
+from mql.matchExpr.parser import parsePredicateTopLevel
+
+from fpy.data.either import Either, Right, Left, isLeft, fromRight
+
+CHUNK_BYTES = 1024 * 1024
+
+# shards submitted ahead of the one being collected, per worker
+IN_FLIGHT = 4
+
+# per worker process: compiled queries by their serialized form
+_compiled: Dict[bytes, Callable[[BSONDocument], bool]] = dict()
+MAX_COMPILED = 64
+
+def compiledQuery(query: bytes) -> Callable[[BSONDocument], bool]:
+    fn = _compiled.get(query, None)
+    if fn is None:
+        doc, _ = readDocument(query, 0)
+        # the query was parsed once already before it was sent
+        fn = optimize(fromRight(None, parsePredicateTopLevel(doc))).compile()
+        if len(_compiled) >= MAX_COMPILED:
+            _compiled.clear()
+        _compiled[query] = fn
+    return fn
+
+def matchShard(query: bytes, shard: bytes) -> List[int]:
+    """
+    Offsets within shard of the documents query matches
+    """
+    matches = compiledQuery(query)
+    view = memoryview(shard)
+    res = []
+    pos = 0
+    while pos < len(view):
+        doc = RawBSONDocument(view, pos)
+        if matches(doc):
+            res.append(pos)
+        pos += len(doc.raw)
+    return res
+
+def shards(raw: Buffer, chunkBytes: int) -> Iterator[Tuple[int, int]]:
+    """
+    Cuts raw into (start, end) runs of whole documents of about chunkBytes each
+    """
+    start = pos = 0
+    while pos < len(raw):
+        size = readI32(raw, pos)
+        if size < 5 or pos + size > len(raw):
+            raise BSONDecodeError(f"Invalid document size {size} at {pos}")
+        pos += size
+        if pos - start >= chunkBytes:
+            yield start, pos
+            start = pos
+    if start < pos:
+        yield start, pos
+
+def collect(start: int, future) -> Iterator[int]:
+    for offset in future.result():
+        yield start + offset
+
+
+class ParallelMatcher:
+    """
+    A pool of worker processes for matching queries against serialized documents,
+    use as a context manager or close() when done
+    """
+    def __init__(self, workers: Optional[int] = None, chunkBytes: int = CHUNK_BYTES):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunkBytes = chunkBytes
+        self.executor = ProcessPoolExecutor(self.workers)
+
+    def __enter__(self) -> ParallelMatcher:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def offsets(self, query: bytes, raw: Buffer) -> Iterator[int]:
+        view = memoryview(raw).cast("B")
+        pending = deque()
+        for start, end in shards(view, self.chunkBytes):
+            pending.append((start, self.executor.submit(matchShard, query, bytes(view[start:end]))))
+            if len(pending) >= self.workers * IN_FLIGHT:
+                yield from collect(*pending.popleft())
+        while pending:
+            yield from collect(*pending.popleft())
+
+    def match(self, query: BSONDocument, raw: Buffer) -> Either[str, List[int]]:
+        """
+        Offsets in raw of the documents query matches, in order
+        """
+        expr = parsePredicateTopLevel(query)
+        if isLeft(expr):
+            return expr
+        encoded = encodeDocument(query)
+        if isLeft(encoded):
+            return encoded
+        try:
+            return Right(list(self.offsets(fromRight(None, encoded), raw)))
+        except (BSONDecodeError, struct.error, IndexError, UnicodeDecodeError) as e:
+            return Left(str(e))
+
+def parallelMatch(query: BSONDocument, raw: Buffer, workers: Optional[int] = None,
+                  chunkBytes: int = CHUNK_BYTES) -> Either[str, List[int]]:
+    """
+    ParallelMatcher.match on a pool of its own
+    """
+    with ParallelMatcher(workers, chunkBytes) as matcher:
+        return matcher.match(query, raw)
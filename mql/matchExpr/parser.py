@@ -2,7 +2,7 @@ from fpy.data.either import Left, Right, isLeft, isRight, fromLeft, fromRight, E
 from fpy.composable.function import func
 from fpy.control.functor import fmap
 from typing import Any, List, Dict, Callable, Optional
-from mql.matchExpr.querySelector import MatchOperator, Predicate, PathMatchExpression, TreeOperator, TreeExpression, MatchableExpression, OperatorArity, OperatorKW, NotExpression
+from mql.matchExpr.querySelector import MatchOperator, Predicate, PathMatchExpression, TreeOperator, TreeExpression, MatchableExpression, OperatorArity, OperatorKW, NotExpression, prepareArguments
 from mql.base.bson import BSONElement, BSONDocument, BSONType
 from mql.base.path import Path
 
@@ -42,16 +42,16 @@ def isGeoExpr(expr: BSONDocument) -> bool:
 
 
 def isExpressionDocument(expr: BSONElement, allowIncompleteDBRef: bool) -> bool:
-    if expr.bsonType != BSONType.Document:
+    if expr.value.bsonType != BSONType.Document:
         return False
 
-    if not expr.value.elements:
+    if not expr.value.value.elements:
         return False
 
-    if not expr.value.elements[0].fieldName.startswith("$"):
+    if not expr.value.value.elements[0].fieldName.startswith("$"):
         return False
     
-    if isDBRefDocument(expr.value, allowIncompleteDBRef):
+    if isDBRefDocument(expr.value.value, allowIncompleteDBRef):
         return False
 
     return True
@@ -81,7 +81,7 @@ PredicateTopLevelExpr  := PathlessExpression
                 childrenExpr.extend(fromRight([], subExprs))
                 continue
             return subExprs
-        if elm.bsonType == BSONType.Regex:
+        if elm.value.bsonType == BSONType.Regex:
             regexExpr = parseRegexMatch(elm.fieldName, elm)
             if isRight(regexExpr):
                 childrenExpr.append(fromRight(None, regexExpr))
@@ -117,15 +117,15 @@ def parseDocumentTopLevel(fieldName: str, expr: BSONElement) -> Either[str, List
     """
     This loosely corresponds to parseSub with currentlevel = kUserDocumentTopLevel
     """
-    if isGeoExpr(expr.value):
+    if isGeoExpr(expr.value.value):
         geoRes = parseGeo(expr)
         if isRight(geoRes):
             return fmap(geoRes, lambda x: [x])
         return geoRes
 
     res = []
-    for field in expr.value.elements:
-        parsedField = parseSubField(fieldName, field, expr.value)
+    for field in expr.value.value.elements:
+        parsedField = parseSubField(fieldName, field, expr.value.value)
         if isLeft(parsedField):
             return parsedField
         res.append(fromRight(None, parsedField))
@@ -145,9 +145,9 @@ def parseSubField(fieldPath: str, expr: BSONElement, ctx: Optional[BSONDocument]
     return opParser(fieldPath, expr, ctx)
 
 def parseSubNot(fieldPath: str, expr: BSONElement) -> Either[str, MatchableExpression]:
-    if expr.bsonType == BSONType.Regex:
+    if expr.value.bsonType == BSONType.Regex:
         return parseRegexMatch(fieldPath, expr) | NotExpression
-    if expr.bsonType != BSONType.Document:
+    if expr.value.bsonType != BSONType.Document:
         return Left("$not must take a regex or object")
     inner = parseDocumentTopLevel(fieldPath, expr)
     return inner | (lambda x: NotExpression(TreeExpression(TreeOperator.AND, x)))
@@ -160,22 +160,21 @@ def parseRegexMatch(fieldName: str, expr: BSONElement) -> Either[str, MatchableE
     """
     FieldName : Regex is equivalent to FieldName : {$regex: Regex}
     """
-    regexExpr = BSONElement(BSONType.Document, fieldName, BSONDocument([BSONElement(BSONType.Regex, "$regex", expr.value)]))
-    print(f"{regexExpr = }")
-    return parseSubField(fieldName, regexExpr, None)
+    regexExpr = BSONElement("$regex", expr.value)
+    return parseSubField(fieldName, regexExpr, BSONDocument([regexExpr]))
 
 
 def parseTopLevelLogical(opCtor) -> Either[str, MatchableExpression]:
     def _res(expr: BSONElement) -> Either[Any, MatchableExpression]:
-        if expr.bsonType != BSONType.Array:
+        if expr.value.bsonType != BSONType.Array:
             return Left("Top Level Logical Expression Must Take An Array")
 
         children = []
 
-        for elm in expr.value.elements:
-            if elm.bsonType != BSONType.Document:
+        for elm in expr.value.value.elements:
+            if elm.value.bsonType != BSONType.Document:
                 return Left(f"Top Level Logical Array Element Must Be Document, Got: {elm}")
-            parsedChild = parsePredicateTopLevel(elm.value)
+            parsedChild = parsePredicateTopLevel(elm.value.value)
             if isLeft(parsedChild):
                 return parsedChild
             children.append(fromRight(None, parsedChild))
@@ -184,21 +183,21 @@ def parseTopLevelLogical(opCtor) -> Either[str, MatchableExpression]:
     return _res
 
 def parseComparison(fieldName: str, expr, operator) -> Either[str, MatchableExpression]:
-    if operator != MatchOperator.EQ and expr.bsonType == BSONType.Regex:
+    if operator != MatchOperator.EQ and expr.value.bsonType == BSONType.Regex:
         return Left("Regex can only appear in equality comparison")
 
     return Right(PathMatchExpression(Path.fromString(fieldName), Predicate(operator, expr)))
 
 def parseInArray(fieldName: str, expr: BSONElement) -> Either[str, MatchableExpression]:
-    if expr.bsonType != BSONType.Array:
+    if expr.value.bsonType != BSONType.Array:
         return Left("$in must take an array")
 
-    for elm in expr.value.elements:
+    for elm in expr.value.value.elements:
         if isExpressionDocument(elm, False):
             return Left("Cannot have $ operators within $in array")
         # in server a separation of regex value and other literal values happens here
         # but that shouldn't affect the semantics of an $in operator
-    return Right(PathMatchExpression(Path.fromString(fieldName), Predicate(MatchOperator.IN, expr)))
+    return Right(PathMatchExpression(Path.fromString(fieldName), Predicate(MatchOperator.IN, expr, prepareArguments(MatchOperator.IN, expr))))
 
 
 defPathless(TreeOperator.AND)(parseTopLevelLogical(lambda children: TreeExpression(TreeOperator.AND, children)))
@@ -0,0 +1,178 @@
+"""
+A cache of parsed queries keyed by query shape.
+
+Two queries have the same shape when they only differ in their literal values (as long
+as those literals keep their BSON types). Parsing a query of a known shape then skips
+the recursive descent in parsePredicateTopLevel: the cached binder rebuilds the
+expression tree with every predicate argument taken from the element at the same
+position of the new query.
+
+Arrays are part of the shape including their length, since the children of $and/$or/$nor
+are parsed from them. The operands of $in/$nin are the exception, their shape only
+records which element types they contain, so lists of different lengths share an entry.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from mql.base.bson import BSONDocument, BSONElement, BSONType
+from mql.matchExpr.querySelector import (MatchableExpression, PathMatchExpression, TreeExpression,
+                                         NotExpression, Predicate, MatchOperator, prepareArguments)
+from mql.matchExpr.parser import parsePredicateTopLevel, isExpressionDocument
+
+from fpy.data.either import Either, Right, isRight, fromRight
+
+# positions of an element within a query, one index per nesting level
+Slot = Tuple[int, ...]
+
+SetOperands = frozenset([MatchOperator.IN.value, MatchOperator.NIN.value])
+
+# markers delimiting nested documents / arrays in a flattened shape
+_OPEN = object()
+_CLOSE = object()
+
+def queryShape(doc: BSONDocument) -> Tuple:
+    """
+    Flat tuple of field names and value types, with nested documents and arrays bracketed
+    """
+    out = []
+    shapeInto(doc.elements, out)
+    return tuple(out)
+
+def shapeInto(elements, out: list):
+    for elm in elements:
+        value = elm.value
+        bsonType = value.bsonType
+        out.append(elm.fieldName)
+        out.append(bsonType)
+        if bsonType == BSONType.Document:
+            out.append(_OPEN)
+            shapeInto(value.value.elements, out)
+            out.append(_CLOSE)
+        elif bsonType == BSONType.Array:
+            if elm.fieldName in SetOperands:
+                out.append(frozenset(map(valueKind, value.value.elements)))
+            else:
+                out.append(_OPEN)
+                shapeInto(value.value.elements, out)
+                out.append(_CLOSE)
+
+def valueKind(elm: BSONElement) -> Any:
+    """
+    What parseInArray can tell apart about an $in operand: whether a document is an
+    operator expression it rejects, or a value such as a DBRef
+    """
+    if elm.value.bsonType == BSONType.Document:
+        return (BSONType.Document, isExpressionDocument(elm, False))
+    return elm.value.bsonType
+
+def slotsOf(doc: BSONDocument, prefix: Slot = ()) -> Dict[int, Slot]:
+    """
+    id of every element in doc -> its slot
+    """
+    res = dict()
+    for idx, elm in enumerate(doc.elements):
+        slot = prefix + (idx,)
+        res[id(elm)] = slot
+        if elm.value.bsonType in (BSONType.Document, BSONType.Array):
+            res.update(slotsOf(elm.value.value, slot))
+    return res
+
+def elementAt(doc: BSONDocument, slot: Slot) -> BSONElement:
+    elm = doc.elements[slot[0]]
+    for idx in slot[1:]:
+        elm = elm.value.value.elements[idx]
+    return elm
+
+
+Binder = Callable[[BSONDocument], MatchableExpression]
+
+def bindPredicate(operator: MatchOperator, arg: BSONElement) -> Predicate:
+    return Predicate(operator, arg, prepareArguments(operator, arg))
+
+def makeBinder(expr: MatchableExpression, slots: Dict[int, Slot]) -> Optional[Binder]:
+    """
+    Builds a function that copies expr with its predicate arguments taken from another
+    query of the same shape. Returns None if expr contains an argument that does not come
+    from the query, or an expression type we do not know how to copy.
+    """
+    if isinstance(expr, PathMatchExpression):
+        slot = slots.get(id(expr.predicate.argument), None)
+        if slot is None:
+            return None
+        path, operator = expr.path, expr.predicate.operator
+        if len(slot) == 1:
+            idx = slot[0]
+            return lambda query: PathMatchExpression(path, bindPredicate(operator, query.elements[idx]))
+        return lambda query: PathMatchExpression(path, bindPredicate(operator, elementAt(query, slot)))
+    if isinstance(expr, TreeExpression):
+        binders = []
+        for child in expr.children:
+            binder = makeBinder(child, slots)
+            if binder is None:
+                return None
+            binders.append(binder)
+        operator = expr.operator
+        return lambda query: TreeExpression(operator, [binder(query) for binder in binders])
+    if isinstance(expr, NotExpression):
+        binder = makeBinder(expr.expr, slots)
+        if binder is None:
+            return None
+        return lambda query: NotExpression(binder(query))
+    return None
+
+
+class PlanCache:
+    """
+    Bounded LRU of parsed query templates
+    """
+
+    def __init__(self, maxSize: int = 1024):
+        self.maxSize = maxSize
+        self._entries: OrderedDict[Tuple, Binder] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._entries)}
+
+    def parse(self, query: BSONDocument) -> Either[str, MatchableExpression]:
+        """
+        Same result as parsePredicateTopLevel(query)
+        """
+        shape = queryShape(query)
+        binder = self._entries.get(shape, None)
+        if binder is not None:
+            self._entries.move_to_end(shape)
+            self.hits += 1
+            return Right(binder(query))
+
+        self.misses += 1
+        parsed = parsePredicateTopLevel(query)
+        if isRight(parsed):
+            binder = makeBinder(fromRight(None, parsed), slotsOf(query))
+            # only templates we can rebind are worth keeping
+            if binder is not None:
+                self._insert(shape, binder)
+        return parsed
+
+    def _insert(self, shape: Tuple, binder: Binder):
+        self._entries[shape] = binder
+        while len(self._entries) > self.maxSize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+DEFAULT_PLAN_CACHE = PlanCache()
+
+def parsePredicateCached(query: BSONDocument, cache: Optional[PlanCache] = None) -> Either[str, MatchableExpression]:
+    return (cache if cache is not None else DEFAULT_PLAN_CACHE).parse(query)
@@ -2,11 +2,12 @@ from __future__ import annotations
 
 
 from abc import ABC, abstractmethod
-from mql.base.bson import BSONValue, BSONDocument, BSONType, BSONElement, BSONArray
+from mql.base.bson import BSONValue, BSONDocument, BSONType, BSONElement, BSONArray, NumericTypes
 from mql.base.path import Path
+from mql.matchExpr.columnar import ColumnBatch, isExactNumber, np
 from dataclasses import dataclass
 from enum import Enum
-from typing import List, Any, Callable, Generator, Dict, Optional
+from typing import List, Any, Callable, Generator, Dict, Optional, Sequence
 from fpy.data.maybe import Maybe, isJust, fromMaybe, Nothing, Just, maybe, isNothing
 from fpy.data.function import constN, uncurryN
 from fpy.composable.function import func
@@ -22,6 +23,26 @@ class MatchableExpression(ABC):
     def matches(self, doc: BSONDocument) -> bool:
         raise NotImplementedError
 
+    def compile(self) -> Callable[[BSONDocument], bool]:
+        """
+        Returns a callable equivalent to matches with everything that does not depend on the
+        document (operator lookup, path splitting, constant unwrapping) resolved up front.
+        Expressions without a specialised compilation fall back to their matches method.
+        """
+        return self.matches
+
+    def matchesBatch(self, docs: Sequence[BSONDocument]) -> List[bool]:
+        """
+        matches for every document of docs, evaluated column by column
+        """
+        return ColumnBatch.toList(self.evalBatch(ColumnBatch(docs)))
+
+    def evalBatch(self, batch: ColumnBatch) -> Any:
+        """
+        Mask of the documents in batch that match, see mql.matchExpr.columnar
+        """
+        return batch.fromBools(self.matches(doc) for doc in batch.docs)
+
 class MatchOperator(Enum):
     EQ = "$eq"
     LTE = "$lte"
@@ -38,6 +59,12 @@ class MatchOperator(Enum):
 OperatorArity: Dict[MatchOperator, int] = dict()
 OperatorKW: Dict[MatchOperator, List[str]] = dict()
 OperatorLogic: Dict[MatchOperator, Callable[[BSONElement, BSONElement, Optional[Dict]], bool]] = dict()
+# builds a single argument predicate over leaf elements from an operator's argument
+OperatorCompiler: Dict[MatchOperator, Callable[[BSONElement, Optional[Dict]], Callable[[BSONElement], bool]]] = dict()
+# precomputes the named arguments of a predicate from its argument at parse time
+OperatorPrepare: Dict[MatchOperator, Callable[[BSONElement], Dict]] = dict()
+# evaluates an operator over a numpy column of numbers, None if the argument does not allow it
+OperatorVectorised: Dict[MatchOperator, Callable[[Any, BSONElement, Optional[Dict]], Optional[Any]]] = dict()
 
 def defop(operator, arity, kw):
     global OperatorLogic
@@ -48,12 +75,38 @@ def defop(operator, arity, kw):
         return fn
     return res
 
+def defopCompiler(operator):
+    global OperatorCompiler
+    def res(fn):
+        OperatorCompiler[operator] = fn
+        return fn
+    return res
+
+def defopPrepare(operator):
+    global OperatorPrepare
+    def res(fn):
+        OperatorPrepare[operator] = fn
+        return fn
+    return res
+
+def prepareArguments(operator: MatchOperator, arg: BSONElement) -> Optional[Dict]:
+    prepare = OperatorPrepare.get(operator, None)
+    return None if prepare is None else prepare(arg)
+
+def defopVectorised(operator):
+    global OperatorVectorised
+    def res(fn):
+        OperatorVectorised[operator] = fn
+        return fn
+    return res
+
 class TreeOperator(Enum):
     AND = "$and"
     OR = "$or"
     NOR = "$nor"
 
 TreeOperatorEval = dict()
+TreeOperatorCompiler = dict()
 
 def defTreeOp(op):
     global TreeOperatorEval
@@ -62,6 +115,13 @@ def defTreeOp(op):
         return fn
     return res
 
+def defTreeCompiler(op):
+    global TreeOperatorCompiler
+    def res(fn: Callable[[List[Callable[[BSONDocument], bool]]], Callable[[BSONDocument], bool]]):
+        TreeOperatorCompiler[op] = fn
+        return fn
+    return res
+
 @dataclass
 class NotExpression(MatchableExpression):
     expr: MatchableExpression
@@ -69,6 +129,13 @@ class NotExpression(MatchableExpression):
     def matches(self, doc: BSONDocument) -> bool:
         return not self.expr.matches(doc)
 
+    def compile(self) -> Callable[[BSONDocument], bool]:
+        inner = self.expr.compile()
+        return lambda doc: not inner(doc)
+
+    def evalBatch(self, batch: ColumnBatch) -> Any:
+        return batch.maskNot(self.expr.evalBatch(batch))
+
 @dataclass
 class Predicate:
     operator: MatchOperator
@@ -79,6 +146,16 @@ class Predicate:
     def eval(self, elem: BSONElement) -> bool:
         return OperatorLogic.get(self.operator, uncurryN(3, constN(3, False)))(elem, self.argument, self.namedArguments)
 
+    def compile(self) -> Callable[[BSONElement], bool]:
+        compiler = OperatorCompiler.get(self.operator, None)
+        if compiler is not None:
+            return compiler(self.argument, self.namedArguments)
+        logic = OperatorLogic.get(self.operator, None)
+        if logic is None:
+            return const(False)
+        arg, named = self.argument, self.namedArguments
+        return lambda elem: logic(elem, arg, named)
+
 
 @dataclass
 class PathMatchExpression(MatchableExpression):
@@ -92,6 +169,35 @@ class PathMatchExpression(MatchableExpression):
                 return True
         return False
 
+    def compile(self) -> Callable[[BSONDocument], bool]:
+        leaves = compilePath(self.path)
+        pred = self.predicate.compile()
+
+        def run(doc: BSONDocument) -> bool:
+            for elem in leaves(doc):
+                if pred(elem):
+                    return True
+            return False
+        return run
+
+    def evalBatch(self, batch: ColumnBatch) -> Any:
+        pred = self.predicate.compile()
+        leaves = batch.leaves(self.path, compilePath)
+
+        mask = None
+        vectorised = OperatorVectorised.get(self.predicate.operator, None)
+        if vectorised is not None:
+            column = batch.numeric(self.path, compilePath)
+            if column is not None:
+                mask = vectorised(column.values, self.predicate.argument, self.predicate.namedArguments)
+
+        if mask is None:
+            return batch.fromBools(any(map(pred, rowLeaves)) for rowLeaves in leaves)
+
+        mask &= column.eligible
+        for row in column.fallback:
+            mask[row] = any(map(pred, leaves[row]))
+        return mask
 
     @staticmethod
     def iterPath(path: Path, doc: BSONElement) -> List[BSONElement]:
@@ -153,6 +259,133 @@ class PathMatchExpression(MatchableExpression):
                        arr.elements),
                    start = [])
 
+def compilePath(path: Path) -> Callable[[BSONDocument], List[BSONElement]]:
+    """
+    Specialises PathMatchExpression.iterPath for one path. Walking through nested documents
+    uses the pre-split components directly, anything involving arrays defers to iterArray
+    with the remaining path built ahead of time. The leaves returned are the same as
+    iterPath(path, <doc as element>).
+    """
+    parts = tuple(path.parts)
+    if not parts:
+        return lambda doc: [BSONElement("", BSONValue(BSONType.Document, doc))]
+    restPaths = tuple(Path(list(parts[idx:])) for idx in range(len(parts)))
+    last = len(parts)
+
+    def leaves(doc: BSONDocument) -> List[BSONElement]:
+        container = doc
+        idx = 0
+        while True:
+            elem = fromMaybe(None, container[parts[idx]])
+            if elem is None:
+                return []
+            idx += 1
+            value = elem.value
+            bsonType = value.bsonType
+            if idx == last:
+                if bsonType == BSONType.Array:
+                    return value.value.elements
+                if bsonType == BSONType.EOO:
+                    return []
+                return [elem]
+            if bsonType == BSONType.Document:
+                container = value.value
+                continue
+            if bsonType == BSONType.Array:
+                return PathMatchExpression.iterArray(restPaths[idx], elem)
+            if bsonType == BSONType.EOO:
+                return []
+            return [elem]
+    return leaves
+
+
+@dataclass
+class PathAndExpression(MatchableExpression):
+    """
+    Several predicates on one path under an $and, built by mql.matchExpr.optimizer.
+    Like separate PathMatchExpressions, each predicate only needs one of the leaves to
+    satisfy it ({a: {$gt: 5, $lt: 3}} matches a: [1, 10]), but the leaves are extracted
+    once. When there is a single leaf it has to satisfy all of them, and the numeric
+    bounds among the predicates are tested as one interval.
+    """
+    path: Path
+    predicates: List[Predicate]
+
+    def expressions(self) -> List[PathMatchExpression]:
+        return [PathMatchExpression(self.path, predicate) for predicate in self.predicates]
+
+    def matches(self, doc: BSONDocument) -> bool:
+        leafElms = PathMatchExpression.iterPath(self.path, BSONElement("", BSONValue(BSONType.Document, doc)))
+        for predicate in self.predicates:
+            if not any(predicate.eval(elem) for elem in leafElms):
+                return False
+        return True
+
+    def compile(self) -> Callable[[BSONDocument], bool]:
+        leaves = compilePath(self.path)
+        preds = [predicate.compile() for predicate in self.predicates]
+        single = compileInterval(self.predicates)
+
+        def run(doc: BSONDocument) -> bool:
+            elems = leaves(doc)
+            if len(elems) == 1:
+                return single(elems[0])
+            for pred in preds:
+                for elem in elems:
+                    if pred(elem):
+                        break
+                else:
+                    return False
+            return True
+        return run
+
+    def evalBatch(self, batch: ColumnBatch) -> Any:
+        # the batch extracts the leaves of the path once for all of them
+        return batch.maskAnd([expr.evalBatch(batch) for expr in self.expressions()])
+
+# a numeric interval test over one leaf, by whether the low and high bounds are inclusive
+IntervalTests = {
+    (True, True): lambda low, high: lambda elem: elem.value.bsonType in NumericTypes and low <= elem.value.value <= high,
+    (True, False): lambda low, high: lambda elem: elem.value.bsonType in NumericTypes and low <= elem.value.value < high,
+    (False, True): lambda low, high: lambda elem: elem.value.bsonType in NumericTypes and low < elem.value.value <= high,
+    (False, False): lambda low, high: lambda elem: elem.value.bsonType in NumericTypes and low < elem.value.value < high,
+}
+
+def compileInterval(predicates: List[Predicate]) -> Callable[[BSONElement], bool]:
+    """
+    Whether a single leaf satisfies all of predicates. Comparisons against numbers
+    narrow one interval, tested like the compiled comparisons: type bracketing limits it
+    to numbers and NaN falls outside any interval. Everything else is tested on its own.
+    """
+    low, high = (float("-inf"), True), (float("inf"), True)
+    bounded = False
+    tests = []
+    for predicate in predicates:
+        operator = predicate.operator
+        value = predicate.argument.value
+        if (operator not in IntervalOperators or value.bsonType not in NumericTypes
+                or value.value != value.value):
+            tests.append(predicate.compile())
+            continue
+        bounded = True
+        bound = value.value
+        if operator != MatchOperator.LT and operator != MatchOperator.LTE:
+            inclusive = operator != MatchOperator.GT
+            if bound > low[0] or (bound == low[0] and not inclusive):
+                low = (bound, inclusive)
+        if operator != MatchOperator.GT and operator != MatchOperator.GTE:
+            inclusive = operator != MatchOperator.LT
+            if bound < high[0] or (bound == high[0] and not inclusive):
+                high = (bound, inclusive)
+    if bounded:
+        tests.insert(0, IntervalTests[(low[1], high[1])](low[0], high[0]))
+    if len(tests) == 1:
+        return tests[0]
+    return lambda elem: all(test(elem) for test in tests)
+
+IntervalOperators = frozenset([MatchOperator.EQ, MatchOperator.LT, MatchOperator.LTE,
+                               MatchOperator.GT, MatchOperator.GTE])
+
 # Tree Operators
 
 @dataclass
@@ -163,6 +396,22 @@ class TreeExpression(MatchableExpression):
     def matches(self, doc: BSONDocument) -> bool:
         return TreeOperatorEval.get(self.operator, const(False))(self.children, doc)
 
+    def compile(self) -> Callable[[BSONDocument], bool]:
+        compiler = TreeOperatorCompiler.get(self.operator, None)
+        if compiler is None:
+            return const(False)
+        return compiler([child.compile() for child in self.children])
+
+    def evalBatch(self, batch: ColumnBatch) -> Any:
+        masks = [child.evalBatch(batch) for child in self.children]
+        if self.operator == TreeOperator.AND:
+            return batch.maskAnd(masks)
+        if self.operator == TreeOperator.OR:
+            return batch.maskOr(masks)
+        if self.operator == TreeOperator.NOR:
+            return batch.maskNot(batch.maskOr(masks))
+        return batch.constant(False)
+
 @defTreeOp(TreeOperator.AND)
 def treeAnd(children: List, doc: BSONDocument) -> bool:
     for child in children:
@@ -184,48 +433,181 @@ def treeNOR(children: List, doc: BSONDocument) -> bool:
             return False
     return True
 
+@defTreeCompiler(TreeOperator.AND)
+def compileAnd(children: List[Callable[[BSONDocument], bool]]) -> Callable[[BSONDocument], bool]:
+    if len(children) == 1:
+        return children[0]
+    if len(children) == 2:
+        first, second = children
+        return lambda doc: first(doc) and second(doc)
+    def run(doc: BSONDocument) -> bool:
+        for child in children:
+            if not child(doc):
+                return False
+        return True
+    return run
+
+@defTreeCompiler(TreeOperator.OR)
+def compileOr(children: List[Callable[[BSONDocument], bool]]) -> Callable[[BSONDocument], bool]:
+    if len(children) == 1:
+        return children[0]
+    def run(doc: BSONDocument) -> bool:
+        for child in children:
+            if child(doc):
+                return True
+        return False
+    return run
+
+@defTreeCompiler(TreeOperator.NOR)
+def compileNor(children: List[Callable[[BSONDocument], bool]]) -> Callable[[BSONDocument], bool]:
+    def run(doc: BSONDocument) -> bool:
+        for child in children:
+            if child(doc):
+                return False
+        return True
+    return run
+
+def compareBracketed(elem: BSONElement, arg: BSONElement) -> Maybe[int]:
+    """
+    BSONElement.compare restricted the way the comparison operators see it: values of
+    different canonical types are not ordered (type bracketing, {$lt: 5} does not match
+    null), and NaN is unordered, it matches no comparison at all
+    """
+    a, b = elem.value, arg.value
+    if a.typeRank() != b.typeRank():
+        return Nothing()
+    if a.bsonType in NumericTypes and b.bsonType in NumericTypes:
+        if a.value != a.value or b.value != b.value:
+            return Nothing()
+    return BSONElement.compare(elem, arg)
+
 @defop(MatchOperator.EQ, 1, None)
 def eq(elem: BSONElement, arg: BSONElement, _):
-    cmpRes = BSONElement.compare(elem, arg)
+    cmpRes = compareBracketed(elem, arg)
     return fromMaybe(False, cmpRes >> (lambda x: x == 0))
 
 @defop(MatchOperator.LT, 1, None)
 def lt(elem: BSONElement, arg: BSONElement, _):
-    cmpRes = BSONElement.compare(elem, arg)
+    cmpRes = compareBracketed(elem, arg)
     return fromMaybe(False, cmpRes >> (lambda x: x < 0))
 
 @defop(MatchOperator.GT, 1, None)
 def gt(elem: BSONElement, arg: BSONElement, _):
-    cmpRes = BSONElement.compare(elem, arg)
+    cmpRes = compareBracketed(elem, arg)
     return fromMaybe(False, cmpRes >> (lambda x: x > 0))
 
 @defop(MatchOperator.LTE, 1, None)
 def lte(elem: BSONElement, arg: BSONElement, _):
-    cmpRes = BSONElement.compare(elem, arg)
+    cmpRes = compareBracketed(elem, arg)
     return fromMaybe(False, cmpRes >> (lambda x: x <= 0))
 
 @defop(MatchOperator.GTE, 1, None)
 def gte(elem: BSONElement, arg: BSONElement, _):
-    cmpRes = BSONElement.compare(elem, arg)
+    cmpRes = compareBracketed(elem, arg)
     return fromMaybe(False, cmpRes >> (lambda x: x >= 0))
 
+@defopPrepare(MatchOperator.IN)
+def prepareIn(arg: BSONElement) -> Dict:
+    """
+    Splits the $in array so membership of a number is a single hash lookup.
+
+    Int32, Int64 and Double values that are equal compare equal, and python numbers
+    that are equal hash equally, so numbers go into one set as they are. NaN never
+    compares equal to anything and is left out. Regexes are kept apart, and whatever
+    else remains is matched with compareBracketed.
+    """
+    numbers = set()
+    others = []
+    regexes = []
+    hasNull = False
+    for aelm in arg.value.value.elements:
+        bsonType = aelm.value.bsonType
+        if bsonType in NumericTypes:
+            if aelm.value.value == aelm.value.value:
+                numbers.add(aelm.value.value)
+        elif bsonType == BSONType.Regex:
+            regexes.append(aelm)
+        else:
+            hasNull = hasNull or bsonType == BSONType.Null
+            others.append(aelm)
+    return {"numbers": frozenset(numbers), "others": others, "regexes": regexes, "hasNull": hasNull}
+
 @defop(MatchOperator.IN, 1, None)
-def inOp(elem: BSONElement, arg: BSONElement, _):
+def inOp(elem: BSONElement, arg: BSONElement, named: Optional[Dict]):
+    if named is None:
+        named = prepareIn(arg)
 
     # EOO matches NULL
-    if elem.value.bsonType == BSONType.EOO:
-        for aelm in arg.value.value.elements:
-            if aelm.bsonType == BSONType.Null:
-                return True
+    if elem.value.bsonType == BSONType.EOO and named["hasNull"]:
+        return True
 
-    arr = arg.value.value.elements
+    if elem.value.bsonType in NumericTypes:
+        # a number can only be equal to another number
+        return elem.value.value in named["numbers"]
 
-    for aelm in arr:
-        if aelm.value.bsonType == BSONType.Regex:
-            # TODO: implement Regex
-            continue
-        if fromMaybe(False, BSONElement.compare(elem, aelm) >> (lambda x: x == 0)):
+    for aelm in named["others"]:
+        if fromMaybe(False, compareBracketed(elem, aelm) >> (lambda x: x == 0)):
             return True
 
+    # TODO: implement Regex
     return False
 
+@defopCompiler(MatchOperator.IN)
+def compileIn(arg: BSONElement, named: Optional[Dict]) -> Callable[[BSONElement], bool]:
+    if named is None:
+        named = prepareIn(arg)
+    if named["others"]:
+        return lambda elem: inOp(elem, arg, named)
+    numbers = named["numbers"]
+    return lambda elem: elem.value.bsonType in NumericTypes and elem.value.value in numbers
+
+# Compiled comparisons
+#
+# Type bracketing means a numeric constant only ever matches numbers, so we can test the
+# leaf type and compare the raw python values directly. NaN, on either side, fails every
+# python comparison just as compareBracketed leaves it unordered.
+
+def compileComparison(operator: MatchOperator, makePred: Callable[[Any], Callable[[BSONElement], bool]]):
+    def compiler(arg: BSONElement, named: Optional[Dict]) -> Callable[[BSONElement], bool]:
+        if arg.value.bsonType not in NumericTypes:
+            logic = OperatorLogic[operator]
+            return lambda elem: logic(elem, arg, named)
+        return makePred(arg.value.value)
+    defopCompiler(operator)(compiler)
+    return compiler
+
+compileComparison(MatchOperator.EQ, lambda rhs: lambda elem: elem.value.bsonType in NumericTypes and elem.value.value == rhs)
+compileComparison(MatchOperator.LT, lambda rhs: lambda elem: elem.value.bsonType in NumericTypes and elem.value.value < rhs)
+compileComparison(MatchOperator.LTE, lambda rhs: lambda elem: elem.value.bsonType in NumericTypes and elem.value.value <= rhs)
+compileComparison(MatchOperator.GT, lambda rhs: lambda elem: elem.value.bsonType in NumericTypes and elem.value.value > rhs)
+compileComparison(MatchOperator.GTE, lambda rhs: lambda elem: elem.value.bsonType in NumericTypes and elem.value.value >= rhs)
+
+# Vectorised comparisons, used by evalBatch on columns of numbers.
+# NaN and numbers float64 cannot hold exactly never reach the column, see columnar.
+
+def vectoriseComparison(operator: MatchOperator, ufunc):
+    def fn(values, arg: BSONElement, named: Optional[Dict]):
+        if arg.value.bsonType not in NumericTypes or not isExactNumber(arg.value.value):
+            return None
+        return ufunc(values, arg.value.value)
+    defopVectorised(operator)(fn)
+    return fn
+
+if np is not None:
+    vectoriseComparison(MatchOperator.EQ, np.equal)
+    vectoriseComparison(MatchOperator.LT, np.less)
+    vectoriseComparison(MatchOperator.LTE, np.less_equal)
+    vectoriseComparison(MatchOperator.GT, np.greater)
+    vectoriseComparison(MatchOperator.GTE, np.greater_equal)
+
+    @defopVectorised(MatchOperator.IN)
+    def vectorisedIn(values, arg: BSONElement, named: Optional[Dict]):
+        members = []
+        for aelm in arg.value.value.elements:
+            if aelm.value.bsonType not in NumericTypes:
+                # a number leaf is never equal to a non number
+                continue
+            if not isExactNumber(aelm.value.value):
+                return None
+            members.append(aelm.value.value)
+        return np.isin(values, np.array(members, dtype=np.float64))
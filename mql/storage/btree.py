@@ -0,0 +1,125 @@
+"""
+An in-memory B+ tree holding an ordered set of keys.
+
+Keys live in the leaves, which are chained left to right so a range scan descends once
+and then walks the leaves. Inner nodes hold separators: the first key of every child
+but the leftmost. Removal only takes the key out of its leaf, nodes are never merged;
+the separators stay valid bounds, so lookups and scans are unaffected, and the space of
+emptied leaves is reused by later inserts into the same key range.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from typing import Any, Iterator, List, Optional, Tuple
+
+# keys per node before it splits
+ORDER = 64
+
+class Node:
+    __slots__ = ("keys", "children", "next")
+
+    def __init__(self, keys: List[Any], children: Optional[List[Node]] = None):
+        self.keys = keys
+        # None for leaves
+        self.children = children
+        self.next: Optional[Node] = None
+
+class BTree:
+    def __init__(self, order: int = ORDER):
+        self.order = order
+        self.root = Node([])
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key) -> bool:
+        leaf = self.findLeaf(key)
+        idx = bisect_left(leaf.keys, key)
+        return idx < len(leaf.keys) and leaf.keys[idx] == key
+
+    def __iter__(self) -> Iterator[Any]:
+        node = self.root
+        while node.children is not None:
+            node = node.children[0]
+        while node is not None:
+            yield from node.keys
+            node = node.next
+
+    def findLeaf(self, key) -> Node:
+        node = self.root
+        while node.children is not None:
+            node = node.children[bisect_right(node.keys, key)]
+        return node
+
+    def insert(self, key) -> bool:
+        """
+        Adds key, False if it was already present
+        """
+        path: List[Tuple[Node, int]] = []
+        node = self.root
+        while node.children is not None:
+            idx = bisect_right(node.keys, key)
+            path.append((node, idx))
+            node = node.children[idx]
+        idx = bisect_left(node.keys, key)
+        if idx < len(node.keys) and node.keys[idx] == key:
+            return False
+        node.keys.insert(idx, key)
+        self.size += 1
+
+        split = self.splitLeaf(node) if len(node.keys) > self.order else None
+        while split is not None and path:
+            parent, idx = path.pop()
+            separator, right = split
+            parent.keys.insert(idx, separator)
+            parent.children.insert(idx + 1, right)
+            split = self.splitInner(parent) if len(parent.keys) > self.order else None
+        if split is not None:
+            separator, right = split
+            self.root = Node([separator], [self.root, right])
+        return True
+
+    def splitLeaf(self, node: Node) -> Tuple[Any, Node]:
+        mid = len(node.keys) // 2
+        right = Node(node.keys[mid:])
+        del node.keys[mid:]
+        right.next = node.next
+        node.next = right
+        return right.keys[0], right
+
+    def splitInner(self, node: Node) -> Tuple[Any, Node]:
+        mid = len(node.keys) // 2
+        separator = node.keys[mid]
+        right = Node(node.keys[mid + 1:], node.children[mid + 1:])
+        del node.keys[mid:]
+        del node.children[mid + 1:]
+        return separator, right
+
+    def remove(self, key) -> bool:
+        """
+        Removes key, False if it was not present
+        """
+        leaf = self.findLeaf(key)
+        idx = bisect_left(leaf.keys, key)
+        if idx == len(leaf.keys) or leaf.keys[idx] != key:
+            return False
+        del leaf.keys[idx]
+        self.size -= 1
+        return True
+
+    def range(self, start, stop) -> Iterator[Any]:
+        """
+        Keys k with start <= k < stop, in order
+        """
+        node = self.findLeaf(start)
+        idx = bisect_left(node.keys, start)
+        while node is not None:
+            keys = node.keys
+            end = bisect_left(keys, stop, idx)
+            yield from keys[idx:end]
+            if end < len(keys):
+                return
+            node = node.next
+            idx = 0
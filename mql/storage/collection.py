@@ -0,0 +1,198 @@
+"""
+An in-memory collection with ordered secondary indexes.
+
+An index on a path holds one entry (sortKey, recordId) for every distinct leaf that
+PathMatchExpression.iterPath reaches in a document, so an array contributes one entry
+per element (a multikey index) and a document missing the path contributes none. Since
+a path predicate matches exactly when one of those leaves satisfies it, scanning the
+index for the leaves a predicate accepts finds exactly the documents it matches.
+
+The planner looks at a single path predicate, or at the children of an $and, and picks
+the one an index can answer most selectively: $eq before $in before a range. Its key
+intervals come from the comparison order of BSONValue.sortKey: type bracketing keeps a
+range within the type of its constant, and NaN, which never matches a comparison, is
+skipped. The whole query then runs as a residual filter over the documents the scan
+fetched. Anything else ($or, $nor, $not, unindexed paths) is a collection scan.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from mql.base.bson import BSONDocument, BSONElement, BSONValue, BSONType, NumericTypes, NUMBER_RANK
+from mql.base.path import Path
+from mql.matchExpr.querySelector import (MatchableExpression, PathMatchExpression, PathAndExpression, TreeExpression,
+                                         TreeOperator, MatchOperator, compilePath)
+from mql.matchExpr.optimizer import optimize
+from mql.storage.btree import BTree
+
+# sort keys k with low <= k < high, as bounds on (sortKey, recordId) entries
+Interval = Tuple[Tuple[bytes, float], Tuple[bytes, float]]
+
+BEFORE = -1
+AFTER = float("inf")
+
+class Index:
+    def __init__(self, path: Path):
+        self.path = path
+        self.leaves: Callable[[BSONDocument], List[BSONElement]] = compilePath(path)
+        self.tree = BTree()
+
+    def keys(self, doc: BSONDocument) -> set:
+        return {elem.value.sortKey() for elem in self.leaves(doc)}
+
+    def add(self, recordId: int, doc: BSONDocument):
+        for key in self.keys(doc):
+            self.tree.insert((key, recordId))
+
+    def remove(self, recordId: int, doc: BSONDocument):
+        for key in self.keys(doc):
+            self.tree.remove((key, recordId))
+
+    def scan(self, intervals: List[Interval]) -> Iterator[int]:
+        """
+        Record ids with a key in any of intervals, a multikey document may come up more than once
+        """
+        for start, stop in intervals:
+            for _, recordId in self.tree.range(start, stop):
+                yield recordId
+
+
+def isNaN(value: BSONValue) -> bool:
+    return value.bsonType in NumericTypes and value.value != value.value
+
+def pointInterval(value: BSONValue) -> Interval:
+    key = value.sortKey()
+    return (key, BEFORE), (key, AFTER)
+
+def rangeInterval(operator: MatchOperator, value: BSONValue) -> Interval:
+    key = value.sortKey()
+    rank = value.typeRank()
+    # every key of the constant's type, NaN (the lowest number) excluded
+    lowest = bytes([rank + 1, 1]) if rank == NUMBER_RANK else bytes([rank + 1])
+    end = (bytes([rank + 2]), BEFORE)
+    if operator == MatchOperator.LT:
+        return (lowest, BEFORE), (key, BEFORE)
+    if operator == MatchOperator.LTE:
+        return (lowest, BEFORE), (key, AFTER)
+    if operator == MatchOperator.GT:
+        return (key, AFTER), end
+    return (key, BEFORE), end
+
+RangeOperators = frozenset([MatchOperator.LT, MatchOperator.LTE, MatchOperator.GT, MatchOperator.GTE])
+
+# lower is more selective
+OperatorCost = {MatchOperator.EQ: 0, MatchOperator.IN: 1}
+RANGE_COST = 2
+
+def indexIntervals(expr: PathMatchExpression) -> Optional[List[Interval]]:
+    """
+    Key intervals holding exactly the leaves expr's predicate accepts, None if an index
+    cannot answer it
+    """
+    operator = expr.predicate.operator
+    value = expr.predicate.argument.value
+    if operator == MatchOperator.IN:
+        intervals = []
+        for elm in value.value.elements:
+            if elm.value.bsonType == BSONType.Regex:
+                return None
+            if not isNaN(elm.value):
+                intervals.append(pointInterval(elm.value))
+        return sorted(set(intervals))
+    if value.bsonType == BSONType.Regex:
+        return None
+    if isNaN(value):
+        # matches nothing
+        return []
+    if operator == MatchOperator.EQ:
+        return [pointInterval(value)]
+    if operator in RangeOperators:
+        return [rangeInterval(operator, value)]
+    return None
+
+
+@dataclass
+class IndexScanPlan:
+    index: Index
+    intervals: List[Interval]
+
+@dataclass
+class CollectionScanPlan:
+    pass
+
+Plan = IndexScanPlan | CollectionScanPlan
+
+def conjuncts(expr: MatchableExpression) -> List[MatchableExpression]:
+    if isinstance(expr, TreeExpression) and expr.operator == TreeOperator.AND:
+        return [leaf for child in expr.children for leaf in conjuncts(child)]
+    if isinstance(expr, PathAndExpression):
+        return expr.expressions()
+    return [expr]
+
+@dataclass
+class Collection:
+    documents: Dict[int, BSONDocument] = field(default_factory=dict)
+    indexes: Dict[Path, Index] = field(default_factory=dict)
+    nextId: int = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def insert(self, doc: BSONDocument) -> int:
+        recordId = self.nextId
+        self.nextId += 1
+        self.documents[recordId] = doc
+        for index in self.indexes.values():
+            index.add(recordId, doc)
+        return recordId
+
+    def delete(self, recordId: int) -> bool:
+        doc = self.documents.pop(recordId, None)
+        if doc is None:
+            return False
+        for index in self.indexes.values():
+            index.remove(recordId, doc)
+        return True
+
+    def createIndex(self, path: Path) -> Index:
+        index = self.indexes.get(path, None)
+        if index is None:
+            index = Index(path)
+            for recordId, doc in self.documents.items():
+                index.add(recordId, doc)
+            self.indexes[path] = index
+        return index
+
+    def dropIndex(self, path: Path) -> bool:
+        return self.indexes.pop(path, None) is not None
+
+    def plan(self, expr: MatchableExpression) -> Plan:
+        best: Optional[Tuple[Tuple[int, int], IndexScanPlan]] = None
+        for child in conjuncts(expr):
+            if not isinstance(child, PathMatchExpression):
+                continue
+            index = self.indexes.get(child.path, None)
+            if index is None:
+                continue
+            intervals = indexIntervals(child)
+            if intervals is None:
+                continue
+            cost = (OperatorCost.get(child.predicate.operator, RANGE_COST), len(intervals))
+            if best is None or cost < best[0]:
+                best = (cost, IndexScanPlan(index, intervals))
+        return CollectionScanPlan() if best is None else best[1]
+
+    def find(self, expr: MatchableExpression) -> Iterator[BSONDocument]:
+        """
+        Documents matching expr, in insertion order
+        """
+        expr = optimize(expr)
+        matches = expr.compile()
+        plan = self.plan(expr)
+        if isinstance(plan, CollectionScanPlan):
+            return filter(matches, self.documents.values())
+        documents = self.documents
+        candidates = sorted(set(plan.index.scan(plan.intervals)))
+        return filter(matches, (documents[recordId] for recordId in candidates))
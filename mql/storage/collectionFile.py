@@ -0,0 +1,211 @@
+"""
+Read only collections backed by a file of concatenated BSON documents, the format of a
+mongodump .bson file.
+
+The file is mapped with mmap and never read into the heap: documents are handed out as
+RawBSONDocument views, or decoded, straight from memoryview slices of the mapping, so
+the operating system pages a multi-GB dump in and out as a scan walks over it.
+
+Random access by document number goes through an offset index, the start of every
+document as an array of uint64. It is built by hopping length prefixes the first time
+a file is opened and persisted next to it as <file>.idx, whose header records the size
+and modification time of the data file it was built from; a sidecar that does not match
+is rebuilt. The sidecar is mapped as well and its offsets are read in place.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from typing import Callable, Iterable, Iterator, Optional, Sequence
+
+from mql.base.bson import BSONDocument
+from mql.base.bsonDecoder import BSONDecodeError, readI32, readDocument
+from mql.base.bsonEncoder import encodeDocument
+from mql.base.bsonRaw import RawBSONDocument
+
+from fpy.data.either import Either, Right, Left, isLeft, fromRight
+
+INDEX_SUFFIX = ".idx"
+
+# offsets are stored in native byte order, the magic tells which one
+INDEX_MAGIC = b"MQLIDX" + (b"LE" if sys.byteorder == "little" else b"BE")
+# magic, data file size, data file mtime in ns, document count
+INDEX_HEADER = struct.Struct("<8sQQQ")
+
+def documentOffsets(buf: memoryview) -> array:
+    """
+    Start of every document in buf, raises BSONDecodeError unless buf holds whole documents
+    """
+    offsets = array("Q")
+    pos = 0
+    while pos < len(buf):
+        size = readI32(buf, pos)
+        if size < 5 or pos + size > len(buf) or buf[pos + size - 1] != 0:
+            raise BSONDecodeError(f"Invalid document of size {size} at {pos}")
+        offsets.append(pos)
+        pos += size
+    return offsets
+
+
+class CollectionFile:
+    """
+    Use openCollectionFile. Documents returned are views into the mapping, they stay
+    valid after close() but keep the mapping alive until they are dropped.
+    """
+    def __init__(self, path: str, data: Optional[mmap.mmap], index: Optional[mmap.mmap], offsets: Sequence[int]):
+        self.path = path
+        self._data = data
+        self._index = index
+        self.raw = memoryview(data) if data is not None else memoryview(b"")
+        self.offsets = offsets
+
+    def __enter__(self) -> CollectionFile:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.offsets = []
+        self.raw.release()
+        self.raw = memoryview(b"")
+        for mapping in (self._data, self._index):
+            if mapping is None:
+                continue
+            try:
+                mapping.close()
+            except BufferError:
+                # documents still point into it, it is unmapped once they are gone
+                pass
+        self._data = self._index = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, idx: int) -> RawBSONDocument:
+        return RawBSONDocument(self.raw, self.offsets[idx])
+
+    def documentNumber(self, offset: int) -> int:
+        """
+        Number of the document starting at offset, e.g. one found by ParallelMatcher over raw
+        """
+        idx = bisect_right(self.offsets, offset) - 1
+        if idx < 0 or self.offsets[idx] != offset:
+            raise IndexError(f"No document starts at {offset}")
+        return idx
+
+    def scan(self) -> Iterator[RawBSONDocument]:
+        raw = self.raw
+        for offset in self.offsets:
+            yield RawBSONDocument(raw, offset)
+
+    def documents(self) -> Iterator[BSONDocument]:
+        """
+        Fully decoded documents, for callers that look at most of every document
+        """
+        raw = self.raw
+        for offset in self.offsets:
+            yield readDocument(raw, offset)[0]
+
+    def find(self, matches: Callable[[BSONDocument], bool]) -> Iterator[RawBSONDocument]:
+        """
+        Documents matches (e.g. a compiled MatchableExpression) accepts, in file order
+        """
+        return filter(matches, self.scan())
+
+
+def mapFile(path: str) -> Optional[mmap.mmap]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # an empty file cannot be mapped
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def loadIndex(indexPath: str, stat: os.stat_result) -> Optional[mmap.mmap]:
+    """
+    The mapped sidecar, None if it is missing or was built from another version of the data
+    """
+    try:
+        index = mapFile(indexPath)
+    except OSError:
+        return None
+    if index is None or len(index) < INDEX_HEADER.size:
+        return None
+    magic, size, mtime, count = INDEX_HEADER.unpack_from(index, 0)
+    if (magic != INDEX_MAGIC or size != stat.st_size or mtime != stat.st_mtime_ns
+            or len(index) != INDEX_HEADER.size + 8 * count):
+        index.close()
+        return None
+    return index
+
+def saveIndex(indexPath: str, stat: os.stat_result, offsets: array) -> bool:
+    """
+    Writes the sidecar through a temporary file, False if the directory is not writable
+    """
+    tmpPath = f"{indexPath}.{os.getpid()}.tmp"
+    try:
+        with open(tmpPath, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets)))
+            offsets.tofile(f)
+        os.replace(tmpPath, indexPath)
+    except OSError:
+        try:
+            os.remove(tmpPath)
+        except OSError:
+            pass
+        return False
+    return True
+
+def openCollectionFile(path: str, persistIndex: bool = True) -> Either[str, CollectionFile]:
+    """
+    Maps the collection file at path, building its offset index unless a current one
+    was persisted
+    """
+    try:
+        stat = os.stat(path)
+        data = mapFile(path)
+    except OSError as e:
+        return Left(str(e))
+    if data is None:
+        return Right(CollectionFile(path, None, None, []))
+
+    indexPath = path + INDEX_SUFFIX
+    index = loadIndex(indexPath, stat)
+    if index is not None:
+        offsets = memoryview(index)[INDEX_HEADER.size:].cast("Q")
+        return Right(CollectionFile(path, data, index, offsets))
+
+    with memoryview(data) as view:
+        try:
+            offsets = documentOffsets(view)
+        except BSONDecodeError as e:
+            error = str(e)
+        else:
+            error = None
+    if error is not None:
+        data.close()
+        return Left(error)
+    if persistIndex:
+        saveIndex(indexPath, stat, offsets)
+    return Right(CollectionFile(path, data, None, offsets))
+
+def writeCollectionFile(path: str, docs: Iterable[BSONDocument]) -> Either[str, int]:
+    """
+    Writes docs back to back to path, returns how many were written
+    """
+    count = 0
+    with open(path, "wb") as f:
+        for doc in docs:
+            encoded = encodeDocument(doc)
+            if isLeft(encoded):
+                return encoded
+            f.write(fromRight(None, encoded))
+            count += 1
+    return Right(count)
@@ -0,0 +1,64 @@
+import unittest
+
+from mql.agg.expr import FieldPathExpr, MISSING
+from mql.agg.parser import parseAggExpr
+from mql.base.bson import BSONDocument, BSONValue, BSONType
+from mql.base.bsonEncoder import encodeDocument
+from mql.base.bsonRaw import decodeRawDocument
+from mql.base.path import Path
+
+from fpy.data.either import isLeft, isRight, fromRight
+
+def evaluate(expr: str, doc: dict, variables=None):
+    parsed = fromRight(None, parseAggExpr(BSONValue.fromValue(expr)))
+    return parsed.evaluate(BSONDocument.fromDict(doc), variables or dict())
+
+def value(expr: str, doc: dict, variables=None) -> BSONValue:
+    res = evaluate(expr, doc, variables)
+    assert isRight(res)
+    return fromRight(None, res)
+
+DOC = {"a": {"b": 1, "c": [1, 2]},
+       "arr": [{"x": 1}, {"y": 2}, 5, {"x": [3, 4]}, [{"x": 6}, 7, [{"x": 8}]]],
+       "s": "str"}
+
+class TestFieldPathExpr(unittest.TestCase):
+    def testDocuments(self):
+        self.assertEqual(value("$a.b", DOC), BSONValue.fromValue(1))
+        self.assertEqual(value("$a.c", DOC), BSONValue.fromValue([1, 2]))
+        self.assertEqual(value("$a", DOC), BSONValue.fromValue({"b": 1, "c": [1, 2]}))
+        self.assertEqual(value("$nope", DOC), MISSING)
+        self.assertEqual(value("$a.b.c", DOC), MISSING)
+        self.assertEqual(value("$s.x", DOC), MISSING)
+
+    def testArrayTraversal(self):
+        # scalars and missing fields are skipped, nested arrays give nested results
+        self.assertEqual(value("$arr.x", DOC), BSONValue.fromValue([1, [3, 4], [6, [8]]]))
+        self.assertEqual(value("$a.c.x", DOC), BSONValue.fromValue([]))
+        # components are field names, not positions
+        self.assertEqual(value("$a.c.0", DOC), BSONValue.fromValue([]))
+
+    def testVariables(self):
+        self.assertEqual(value("$$ROOT.a.b", DOC), BSONValue.fromValue(1))
+        self.assertEqual(value("$$CURRENT", {"k": 1}), BSONValue.fromValue({"k": 1}))
+        self.assertEqual(value("$$REMOVE", DOC), MISSING)
+        v = BSONValue.fromValue({"z": [{"q": 1}, {"q": 2}]})
+        self.assertEqual(value("$$v.z.q", DOC, {"v": v}), BSONValue.fromValue([1, 2]))
+        self.assertEqual(value("$$v", DOC, {"v": v}), v)
+        self.assertEqual(value("$$CURRENT.k", DOC, {"CURRENT": BSONValue.fromValue({"k": 3})}), BSONValue.fromValue(3))
+        self.assertTrue(isLeft(evaluate("$$undefined", DOC)))
+
+    def testParse(self):
+        for invalid in ("$", "$a..b", "$$", "$$v..a", "$a."):
+            with self.subTest(expr=invalid):
+                self.assertTrue(isLeft(parseAggExpr(BSONValue.fromValue(invalid))))
+        expr = fromRight(None, parseAggExpr(BSONValue.fromValue("$a.b")))
+        self.assertEqual(expr, FieldPathExpr(Path(["a", "b"])))
+        self.assertEqual(expr.keys, ("a", "b"))
+
+    def testRawDocument(self):
+        raw = fromRight(None, encodeDocument(BSONDocument.fromDict(DOC)))
+        doc, _ = fromRight(None, decodeRawDocument(raw))
+        expr = fromRight(None, parseAggExpr(BSONValue(BSONType.String, "$arr.x\x00")))
+        res = fromRight(None, expr.evaluate(doc, dict()))
+        self.assertEqual([elm.value.bsonType for elm in res.value.elements], [BSONType.Int32, BSONType.Array, BSONType.Array])
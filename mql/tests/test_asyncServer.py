@@ -0,0 +1,91 @@
+import asyncio
+import struct
+import unittest
+
+from mql.base.bson import BSONDocument
+from mql.base.bsonDecoder import decodeDocument
+from mql.interfaces.wireprotocol.asyncServer import WireProtocolServer, ConnectionState, replyTo, defaultHandler
+from mql.interfaces.wireprotocol.compression import compressMsg, decompressMsg
+from mql.interfaces.wireprotocol.wireprotocol import encodeMsg, OpCode, MSG_HEADER
+
+from fpy.data.maybe import fromJust
+from fpy.data.either import fromRight
+
+def request(requestId: int, raw: dict, moreToCome: bool = False) -> bytes:
+    return fromRight(None, encodeMsg(BSONDocument.fromDict(raw), requestId, moreToCome=moreToCome))
+
+async def readReply(reader: asyncio.StreamReader):
+    prefix = await reader.readexactly(4)
+    raw = prefix + await reader.readexactly(struct.unpack("<i", prefix)[0] - 4)
+    _, _, responseTo, _ = MSG_HEADER.unpack_from(raw, 0)
+    body, _ = fromRight(None, decodeDocument(raw[MSG_HEADER.size + 5:]))
+    return responseTo, body
+
+async def echoHandler(state: ConnectionState, raw: bytes):
+    _, requestId, _, _ = MSG_HEADER.unpack_from(raw, 0)
+    if requestId % 2 == 0:
+        # let odd requests overtake even ones if ordering were not enforced
+        await asyncio.sleep(0.01)
+    return replyTo(raw, BSONDocument.fromDict({"ok": 1.0, "conn": state.connectionId, "n": state.requests}))
+
+class TestAsyncServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = WireProtocolServer(echoHandler, port=0)
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def connect(self):
+        return await asyncio.open_connection(self.server.host, self.server.port)
+
+    async def testFragmentedPipelinedRequests(self):
+        reader, writer = await self.connect()
+        payload = b"".join(request(idx, {"ping": idx}) for idx in range(1, 6))
+        for start in range(0, len(payload), 7):
+            writer.write(payload[start:start + 7])
+            await writer.drain()
+        replies = [await readReply(reader) for _ in range(5)]
+        self.assertEqual([1, 2, 3, 4, 5], [responseTo for responseTo, _ in replies])
+        self.assertEqual([1, 2, 3, 4, 5], [fromJust(body["n"]).value.value for _, body in replies])
+        writer.close()
+        await writer.wait_closed()
+
+    async def testConcurrentClients(self):
+        async def client(base: int):
+            reader, writer = await self.connect()
+            seen = []
+            for idx in range(base, base + 10):
+                writer.write(request(idx, {"ping": 1}))
+                responseTo, body = await readReply(reader)
+                seen.append(responseTo)
+            writer.close()
+            await writer.wait_closed()
+            return seen, fromJust(body["conn"]).value.value
+
+        results = await asyncio.gather(*[client(base) for base in range(0, 200, 20)])
+        for base, (seen, _) in zip(range(0, 200, 20), results):
+            self.assertEqual(list(range(base, base + 10)), seen)
+        self.assertEqual(10, len({conn for _, conn in results}))
+
+    async def testInvalidLengthClosesConnection(self):
+        reader, writer = await self.connect()
+        writer.write(struct.pack("<i", 3))
+        await writer.drain()
+        self.assertEqual(b"", await reader.read())
+        writer.close()
+
+    async def testCompressedRequest(self):
+        self.server.handler = defaultHandler
+        reader, writer = await self.connect()
+        writer.write(fromRight(None, compressMsg(request(4, {"ping": 1}), "zlib")))
+        prefix = await reader.readexactly(4)
+        raw = prefix + await reader.readexactly(struct.unpack("<i", prefix)[0] - 4)
+        self.assertEqual(OpCode.Compressed.value, MSG_HEADER.unpack_from(raw, 0)[3])
+        reply = fromRight(None, decompressMsg(raw))
+        _, _, responseTo, opCode = MSG_HEADER.unpack_from(reply, 0)
+        self.assertEqual((4, OpCode.Msg.value), (responseTo, opCode))
+        body, _ = fromRight(None, decodeDocument(reply[MSG_HEADER.size + 5:]))
+        self.assertEqual(1.0, fromJust(body["ok"]).value.value)
+        writer.close()
+        await writer.wait_closed()
@@ -1,11 +1,47 @@
+import random
 import unittest
 
-from mql.base.bson import BSONDocument, BSONType
+from mql.base.bson import BSONDocument, BSONElement, BSONValue, BSONArray, BSONBinary, BSONType
 from mql.base.bsonBinary import parseDocument
 
 from fpy.data.maybe import isJust, fromJust
 from fpy.data.either import isRight, fromRight
 
+def randomValue(rng: random.Random, depth: int = 0) -> BSONValue:
+    choice = rng.randrange(13 if depth < 2 else 11)
+    if choice == 0:
+        return BSONValue(BSONType.Int32, rng.randrange(-3, 3))
+    if choice == 1:
+        return BSONValue(BSONType.Int64, rng.choice([2 ** 53, 2 ** 53 + 1, 2 ** 63 - 1, -2 ** 63, 2]))
+    if choice == 2:
+        return BSONValue(BSONType.Number, rng.choice([-1.5, -0.0, 0.0, 2.0, float(2 ** 53), float("inf"), float("nan")]))
+    if choice == 3:
+        return BSONValue(rng.choice([BSONType.String, BSONType.Symbol]), rng.choice(["", "a", "a\x00", "ab", "b", "\u00e9"]))
+    if choice == 4:
+        return BSONValue(rng.choice([BSONType.Null, BSONType.EOO, BSONType.MinKey, BSONType.MaxKey]), None)
+    if choice == 5:
+        return BSONValue(BSONType.Boolean, rng.random() < 0.5)
+    if choice == 6:
+        return BSONValue(BSONType.ObjectId, bytes([rng.randrange(2)] * 12))
+    if choice == 7:
+        body = bytes(rng.randrange(2) for _ in range(rng.randrange(3)))
+        return BSONValue(BSONType.Binary, BSONBinary(len(body), rng.randrange(2), body))
+    if choice == 8:
+        pattern = rng.choice(["", "a", "a\x00", "ab", "b"])
+        return BSONValue(BSONType.Regex, rng.choice([pattern, (pattern, rng.choice(["", "i", "im", "m"]))]))
+    if choice == 9:
+        return BSONValue(BSONType.Code, rng.choice(["", "a", "a\x00", "ab", "b"]))
+    if choice == 10:
+        return BSONValue(BSONType.DBRef, (rng.choice(["a", "b", "ab", "db.c\x00"]), bytes([rng.randrange(2)] * 12)))
+    elements = [BSONElement(rng.choice(["a", "b"]) if choice == 11 else f"{idx}", randomValue(rng, depth + 1))
+                for idx in range(rng.randrange(3))]
+    if choice == 11:
+        return BSONValue(BSONType.Document, BSONDocument(elements))
+    return BSONValue(BSONType.Array, BSONArray(elements))
+
+def sign(x) -> int:
+    return (x > 0) - (x < 0)
+
 class TestBson(unittest.TestCase):
     def testSimpleFromDict(self):
         raw = {"a": 1}
@@ -38,3 +74,69 @@ class TestBson(unittest.TestCase):
         self.assertTrue(isJust(field))
         self.assertEqual(BSONType.String, fromJust(field).value.bsonType)
         self.assertEqual("A\x00", fromJust(field).value.value)
+
+    def testWideDocumentLookup(self):
+        raw = {f"f{idx}": idx for idx in range(100)}
+        doc = BSONDocument.fromDict(raw)
+
+        for idx in range(100):
+            self.assertEqual(idx, fromJust(doc[f"f{idx}"]).value.value)
+        self.assertFalse("missing" in doc)
+
+    def testWideDocumentDuplicateFirstWins(self):
+        doc = BSONDocument.fromDict({f"f{idx}": idx for idx in range(50)})
+        doc.elements.append(BSONElement.fromValue(-1, "f3"))
+
+        self.assertEqual(3, fromJust(doc["f3"]).value.value)
+        self.assertEqual(51, len(doc))
+
+    def testWideDocumentMutation(self):
+        doc = BSONDocument.fromDict({f"f{idx}": idx for idx in range(50)})
+        self.assertTrue("f10" in doc)
+
+        doc.elements.append(BSONElement.fromValue(50, "new"))
+        self.assertTrue("new" in doc)
+
+        doc.elements[10] = BSONElement.fromValue(10, "renamed")
+        doc.invalidateIndex()
+        self.assertTrue("renamed" in doc)
+        self.assertFalse("f10" in doc)
+
+        doc.elements = doc.elements[:5]
+        self.assertFalse("f20" in doc)
+        self.assertTrue("f4" in doc)
+
+    def testCompareAcrossTypes(self):
+        ordered = [BSONValue(BSONType.MinKey, None), BSONValue(BSONType.Null, None),
+                   BSONValue(BSONType.Number, float("nan")), BSONValue(BSONType.Number, -1.5),
+                   BSONValue(BSONType.Int64, 2 ** 53), BSONValue(BSONType.Int64, 2 ** 53 + 1),
+                   BSONValue(BSONType.String, ""), BSONValue(BSONType.String, "a"),
+                   BSONValue.fromValue({}), BSONValue.fromValue({"a": 1}), BSONValue.fromValue([]),
+                   BSONValue(BSONType.Binary, BSONBinary(0, 0, b"")), BSONValue(BSONType.ObjectId, bytes(12)),
+                   BSONValue(BSONType.Boolean, False), BSONValue(BSONType.Boolean, True),
+                   BSONValue(BSONType.MaxKey, None)]
+        for idx in range(len(ordered) - 1):
+            with self.subTest(idx=idx):
+                self.assertEqual(-1, fromJust(BSONValue.compare(ordered[idx], ordered[idx + 1])))
+                self.assertLess(ordered[idx].sortKey(), ordered[idx + 1].sortKey())
+
+    def testCompareEqualValues(self):
+        pairs = [(BSONValue(BSONType.Int32, 1), BSONValue(BSONType.Number, 1.0)),
+                 (BSONValue(BSONType.Number, -0.0), BSONValue(BSONType.Int64, 0)),
+                 (BSONValue(BSONType.Number, float("nan")), BSONValue(BSONType.Number, float("nan"))),
+                 (BSONValue.eoo(), BSONValue(BSONType.Null, None)),
+                 (BSONValue(BSONType.String, "A\x00"), BSONValue(BSONType.Symbol, "A")),
+                 (BSONValue.fromValue({"a": [1, 2.0]}), BSONValue.fromValue({"a": [1.0, 2]}))]
+        for a, b in pairs:
+            with self.subTest(a=a, b=b):
+                self.assertEqual(0, fromJust(BSONValue.compare(a, b)))
+                self.assertEqual(a.sortKey(), b.sortKey())
+
+    def testSortKeyAgreesWithCompare(self):
+        rng = random.Random(5)
+        for _ in range(3000):
+            a, b = randomValue(rng), randomValue(rng)
+            expected = fromJust(BSONValue.compare(a, b))
+            self.assertEqual(-expected, fromJust(BSONValue.compare(b, a)), (a, b))
+            keyA, keyB = a.sortKey(), b.sortKey()
+            self.assertEqual(expected, sign((keyA > keyB) - (keyA < keyB)), (a, b))
@@ -0,0 +1,96 @@
+import struct
+import unittest
+
+from mql.base.bson import BSONType, BSONBinary
+from mql.base.bsonBinary import parseDocument, TAG_PARSER
+from mql.base.bsonDecoder import decodeDocument, getDocumentParser
+
+from fpy.data.maybe import isJust, fromJust
+from fpy.data.either import isLeft, isRight, fromRight
+
+
+def cstr(s: str) -> bytes:
+    return s.encode("utf-8") + b"\x00"
+
+def element(tag: BSONType, name: str, payload: bytes) -> bytes:
+    return bytes([tag.value]) + cstr(name) + payload
+
+def document(*elements: bytes) -> bytes:
+    body = b"".join(elements)
+    return struct.pack("<i", len(body) + 5) + body + b"\x00"
+
+def string(s: str) -> bytes:
+    raw = cstr(s)
+    return struct.pack("<i", len(raw)) + raw
+
+# one sample payload for every type the combinator parser understands
+SAMPLES = {
+    BSONType.Number: struct.pack("<d", -2.5),
+    BSONType.Int32: struct.pack("<i", -7),
+    BSONType.Int64: struct.pack("<q", 1 << 40),
+    BSONType.String: string("héllo"),
+    BSONType.Document: document(element(BSONType.Int32, "x", struct.pack("<i", 1)),
+                                element(BSONType.String, "y", string("z"))),
+    BSONType.Array: document(element(BSONType.Int32, "0", struct.pack("<i", 1)),
+                             element(BSONType.Number, "1", struct.pack("<d", 2.0))),
+    BSONType.Boolean: b"\x01",
+    BSONType.Null: b"",
+    BSONType.ObjectId: bytes(range(12)),
+    BSONType.Binary: struct.pack("<i", 3) + b"\x80" + b"abc",
+}
+
+class TestBsonDecoder(unittest.TestCase):
+    def assertDecodersAgree(self, raw: bytes):
+        slow = parseDocument(list(raw))
+        fast = decodeDocument(raw)
+
+        self.assertTrue(isRight(slow))
+        self.assertTrue(isRight(fast))
+
+        slowDoc, slowRest = fromRight(None, slow)
+        fastDoc, fastRest = fromRight(None, fast)
+
+        self.assertEqual(slowDoc, fastDoc)
+        self.assertEqual(bytes(slowRest), bytes(fastRest))
+        return fastDoc
+
+    def testSamplesCoverParser(self):
+        self.assertEqual(set(TAG_PARSER.keys()), set(SAMPLES.keys()))
+
+    def testEveryTypeAgrees(self):
+        for tag, payload in SAMPLES.items():
+            with self.subTest(tag=tag):
+                doc = self.assertDecodersAgree(document(element(tag, "fld", payload)))
+                field = doc["fld"]
+                self.assertTrue(isJust(field))
+                self.assertEqual(tag, fromJust(field).value.bsonType)
+
+    def testAllTypesInOneDocument(self):
+        raw = document(*[element(tag, f"f{tag.value}", payload) for tag, payload in SAMPLES.items()])
+        doc = self.assertDecodersAgree(raw + b"trailing")
+        self.assertEqual(len(SAMPLES), len(doc))
+
+    def testNestedAndUnicodeFieldNames(self):
+        inner = document(element(BSONType.Array, "ärr", SAMPLES[BSONType.Array]))
+        self.assertDecodersAgree(document(element(BSONType.Document, "ü", inner),
+                                          element(BSONType.Boolean, "b", b"\x00")))
+
+    def testBinaryValue(self):
+        doc, _ = fromRight(None, decodeDocument(document(element(BSONType.Binary, "b", SAMPLES[BSONType.Binary]))))
+        self.assertEqual(BSONBinary(3, 0x80, b"abc"), fromJust(doc["b"]).value.value)
+
+    def testMemoryviewInput(self):
+        raw = document(element(BSONType.String, "s", string("abc")))
+        doc, rest = fromRight(None, decodeDocument(memoryview(raw + b"\x01")))
+        self.assertEqual("abc\x00", fromJust(doc["s"]).value.value)
+        self.assertEqual(b"\x01", bytes(rest))
+
+    def testMalformedInput(self):
+        raw = document(element(BSONType.Int32, "a", struct.pack("<i", 1)))
+        self.assertTrue(isLeft(decodeDocument(raw[:-1])))
+        self.assertTrue(isLeft(decodeDocument(document(element(BSONType.Undefined, "u", b"")))))
+        self.assertTrue(isLeft(decodeDocument(b"\x05\x00")))
+
+    def testSelectable(self):
+        self.assertIs(parseDocument, getDocumentParser("parsec"))
+        self.assertIs(decodeDocument, getDocumentParser("fast"))
@@ -0,0 +1,92 @@
+import random
+import struct
+import unittest
+
+from mql.base.bson import BSONDocument, BSONArray, BSONElement, BSONValue, BSONType, BSONBinary
+from mql.base.bsonBinary import parseDocument
+from mql.base.bsonDecoder import decodeDocument
+from mql.base.bsonRaw import RawBSONDocument
+from mql.base.bsonEncoder import encodeDocument, encodeInto, TAG_ENCODER
+from mql.tests.test_bsonDecoder import SAMPLES, document, element
+
+from fpy.data.maybe import fromJust
+from fpy.data.either import isLeft, isRight, fromRight
+
+
+def randomValue(rng: random.Random, depth: int) -> BSONValue:
+    choices = list(TAG_ENCODER.keys())
+    if depth <= 0:
+        choices = [t for t in choices if t not in (BSONType.Document, BSONType.Array)]
+    tag = rng.choice(choices)
+    if tag == BSONType.Document:
+        return BSONValue(tag, randomDocument(rng, depth - 1))
+    if tag == BSONType.Array:
+        return BSONValue(tag, BSONArray(randomDocument(rng, depth - 1, array=True).elements))
+    if tag == BSONType.Number:
+        return BSONValue(tag, rng.uniform(-1e9, 1e9))
+    if tag == BSONType.Int32:
+        return BSONValue(tag, rng.randrange(-2**31, 2**31))
+    if tag == BSONType.Int64:
+        return BSONValue(tag, rng.randrange(-2**63, 2**63))
+    if tag == BSONType.String:
+        # decoded strings carry their terminating NUL
+        return BSONValue(tag, "".join(rng.choice("abcé€\U0001F600") for _ in range(rng.randrange(8))) + "\x00")
+    if tag == BSONType.Boolean:
+        return BSONValue(tag, rng.random() < 0.5)
+    if tag == BSONType.ObjectId:
+        return BSONValue(tag, bytes(rng.randrange(256) for _ in range(12)))
+    if tag == BSONType.Null:
+        return BSONValue(tag, None)
+    body = bytes(rng.randrange(256) for _ in range(rng.randrange(16)))
+    return BSONValue(tag, BSONBinary(len(body), rng.randrange(256), body))
+
+def randomDocument(rng: random.Random, depth: int, array: bool = False) -> BSONDocument:
+    return BSONDocument([BSONElement(str(idx) if array else f"f{rng.randrange(1000)}", randomValue(rng, depth))
+                         for idx in range(rng.randrange(6))])
+
+
+class TestBsonEncoder(unittest.TestCase):
+    def testCoversParserTypes(self):
+        self.assertEqual(set(SAMPLES.keys()), set(TAG_ENCODER.keys()))
+
+    def testEncodesSamples(self):
+        for tag, payload in SAMPLES.items():
+            raw = document(element(tag, "fld", payload))
+            doc, _ = fromRight(None, decodeDocument(raw))
+            with self.subTest(tag=tag):
+                self.assertEqual(raw, fromRight(None, encodeDocument(doc)))
+
+    def testRoundTripProperty(self):
+        rng = random.Random(20240611)
+        for _ in range(300):
+            doc = randomDocument(rng, 3)
+            raw = fromRight(None, encodeDocument(doc))
+            self.assertEqual(struct.unpack_from("<i", raw)[0], len(raw))
+
+            parsed, rest = fromRight(None, parseDocument(list(raw)))
+            self.assertEqual(doc, parsed)
+            self.assertEqual(0, len(rest))
+
+            decoded, _ = fromRight(None, decodeDocument(raw))
+            self.assertEqual(doc, decoded)
+            self.assertEqual(raw, fromRight(None, encodeDocument(decoded)))
+
+    def testFromDict(self):
+        doc = BSONDocument.fromDict({"a": 1, "b": "x", "c": [1.5, {"d": "e"}]})
+        decoded, _ = fromRight(None, decodeDocument(fromRight(None, encodeDocument(doc))))
+        self.assertEqual(doc["a"], decoded["a"])
+        self.assertEqual(BSONType.Array, fromJust(decoded["c"]).value.bsonType)
+        self.assertEqual("x\x00", fromJust(decoded["b"]).value.value)
+
+    def testRawDocumentIsCopied(self):
+        raw = document(element(BSONType.Int32, "a", struct.pack("<i", 5)))
+        outer = BSONDocument([BSONElement("inner", BSONValue(BSONType.Document, RawBSONDocument(raw)))])
+        self.assertEqual(document(element(BSONType.Document, "inner", raw)), fromRight(None, encodeDocument(outer)))
+
+    def testErrors(self):
+        out = bytearray(b"keep")
+        self.assertTrue(isLeft(encodeInto(out, BSONDocument([BSONElement("a", BSONValue(BSONType.Int32, 2**40))]))))
+        self.assertEqual(b"keep", bytes(out))
+        self.assertTrue(isLeft(encodeDocument(BSONDocument([BSONElement("a\x00", BSONValue(BSONType.Int32, 1))]))))
+        self.assertTrue(isLeft(encodeDocument(BSONDocument([BSONElement("a", BSONValue(BSONType.Regex, "x"))]))))
+        self.assertTrue(isRight(encodeDocument(BSONDocument([]))))
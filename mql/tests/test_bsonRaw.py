@@ -0,0 +1,85 @@
+import struct
+import unittest
+
+from mql.base.bson import BSONElement, BSONType
+from mql.base.bsonDecoder import decodeDocument, getDocumentParser, BSONDecodeError
+from mql.base.bsonRaw import RawBSONDocument, RawBSONArray, decodeRawDocument
+from mql.base.path import Path
+from mql.matchExpr.querySelector import MatchOperator, Predicate, PathMatchExpression
+from mql.tests.test_bsonDecoder import document, element, string
+
+from fpy.data.maybe import isNothing, fromJust
+from fpy.data.either import isLeft, isRight, fromRight
+
+def i32(v: int) -> bytes:
+    return struct.pack("<i", v)
+
+def arr(*payloads) -> bytes:
+    return document(*[element(tag, str(idx), p) for idx, (tag, p) in enumerate(payloads)])
+
+# {a: 1, b: {c: 2, d: [3, {e: 4}]}, f: [{g: 5}, {g: 6}], s: "x"}
+RAW = document(
+    element(BSONType.Int32, "a", i32(1)),
+    element(BSONType.Document, "b", document(
+        element(BSONType.Int32, "c", i32(2)),
+        element(BSONType.Array, "d", arr((BSONType.Int32, i32(3)),
+                                         (BSONType.Document, document(element(BSONType.Int32, "e", i32(4)))))))),
+    element(BSONType.Array, "f", arr((BSONType.Document, document(element(BSONType.Int32, "g", i32(5)))),
+                                     (BSONType.Document, document(element(BSONType.Int32, "g", i32(6)))))),
+    element(BSONType.String, "s", string("x")),
+)
+
+class TestBsonRaw(unittest.TestCase):
+    def testLookup(self):
+        doc = RawBSONDocument(RAW)
+        self.assertTrue("a" in doc)
+        self.assertFalse("z" in doc)
+        self.assertTrue(isNothing(doc["z"]))
+        self.assertEqual(1, fromJust(doc["a"]).value.value)
+        b = fromJust(doc["b"]).value
+        self.assertEqual(BSONType.Document, b.bsonType)
+        self.assertIsInstance(b.value, RawBSONDocument)
+        d = fromJust(b.value["d"]).value.value
+        self.assertIsInstance(d, RawBSONArray)
+        self.assertEqual(2, len(d))
+        self.assertTrue(1 in d)
+        self.assertFalse(2 in d)
+        self.assertEqual(4, len(doc))
+
+    def testMatchesDecoded(self):
+        raw = RawBSONDocument(RAW)
+        decoded, _ = fromRight(None, decodeDocument(RAW))
+        self.assertEqual(decoded, raw.toDocument())
+        self.assertEqual(decoded.elements, raw.elements)
+
+        for path, value in [("a", 1), ("b.c", 2), ("b.d", 3), ("b.d.e", 4), ("b.d.1.e", 4),
+                            ("f.g", 6), ("f.1.g", 5), ("s", 1), ("missing.x", 1)]:
+            expr = PathMatchExpression(Path.fromString(path), Predicate(MatchOperator.EQ, BSONElement.fromValue(value, "$eq")))
+            with self.subTest(path=path):
+                self.assertEqual(expr.matches(decoded), expr.matches(raw))
+
+    def testLazyDecoding(self):
+        # the value of "bad" cannot be decoded, but it is never looked at
+        raw = document(element(BSONType.Int32, "a", i32(1)),
+                       element(BSONType.Datetime, "bad", struct.pack("<q", 0)))
+        self.assertTrue(isLeft(decodeDocument(raw)))
+
+        doc = RawBSONDocument(raw)
+        self.assertEqual(1, fromJust(doc["a"]).value.value)
+        self.assertEqual([], doc._positions[1:])
+        self.assertTrue("bad" in doc)
+        with self.assertRaises(BSONDecodeError):
+            doc["bad"]
+
+    def testDuplicateFieldsFirstWins(self):
+        doc = RawBSONDocument(document(element(BSONType.Int32, "a", i32(1)),
+                                       element(BSONType.Int32, "a", i32(2))))
+        self.assertEqual(1, fromJust(doc["a"]).value.value)
+        self.assertEqual(2, len(doc))
+
+    def testDecodeRawDocument(self):
+        res = getDocumentParser("raw")(memoryview(RAW + b"rest"))
+        self.assertTrue(isRight(res))
+        doc, rest = fromRight(None, res)
+        self.assertEqual(b"rest", bytes(rest))
+        self.assertTrue(isLeft(decodeRawDocument(RAW[:-2])))
@@ -0,0 +1,72 @@
+import random
+import struct
+import unittest
+
+from mql.base.bson import BSONDocument
+from mql.base.bsonDecoder import BSONDecodeError, decodeDocument
+from mql.base.bsonEncoder import encodeDocument
+from mql.base.bsonStream import StreamingDecoder, ElementDecoded, DocumentDecoded
+from mql.tests.test_bsonDecoder import SAMPLES, element, document
+
+from fpy.data.either import fromRight
+
+DOCS = [BSONDocument.fromDict({"_id": idx, "name": f"doc{idx}", "nested": {"a": [idx, 2.5, "x"]}}) for idx in range(5)]
+RAW = b"".join(fromRight(None, encodeDocument(doc)) for doc in DOCS)
+
+def decoded(raw: bytes) -> BSONDocument:
+    return fromRight(None, decodeDocument(raw))[0]
+
+def feedAll(decoder: StreamingDecoder, raw: bytes, sizes):
+    events, pos = [], 0
+    for size in sizes:
+        events += decoder.feed(raw[pos:pos + size])
+        pos += size
+    events += decoder.feed(raw[pos:])
+    return events
+
+class TestStreamingDecoder(unittest.TestCase):
+    def testEverySplit(self):
+        expected = [decoded(fromRight(None, encodeDocument(doc))) for doc in DOCS]
+        for split in range(len(RAW) + 1):
+            with self.subTest(split=split):
+                decoder = StreamingDecoder()
+                events = feedAll(decoder, RAW, [split])
+                self.assertEqual(expected, [event.document for event in events if isinstance(event, DocumentDecoded)])
+                self.assertTrue(decoder.idle)
+
+    def testByteAtATime(self):
+        decoder = StreamingDecoder()
+        events = feedAll(decoder, RAW, [1] * len(RAW))
+        elements = [event.element for event in events if isinstance(event, ElementDecoded)]
+        self.assertEqual(3 * len(DOCS), len(elements))
+        # an element comes out before the rest of its document has arrived
+        first = next(idx for idx, event in enumerate(events) if isinstance(event, DocumentDecoded))
+        self.assertTrue(all(isinstance(event, ElementDecoded) for event in events[:first]))
+        self.assertEqual(3, first)
+
+    def testAllTypes(self):
+        raw = document(*(element(tag, f"f{tag.value}", payload) for tag, payload in SAMPLES.items()))
+        rng = random.Random(4)
+        events = feedAll(StreamingDecoder(emitElements=False), raw, [rng.randrange(1, 7) for _ in range(40)])
+        self.assertEqual([DocumentDecoded(decoded(raw))], events)
+
+    def testBuffersOneElement(self):
+        decoder = StreamingDecoder()
+        big = fromRight(None, encodeDocument(BSONDocument.fromDict({f"f{idx}": "v" * 100 for idx in range(1000)})))
+        for pos in range(0, len(big), 1000):
+            decoder.feed(big[pos:pos + 1000])
+            self.assertLess(decoder.buffered, 1200)
+        self.assertTrue(decoder.idle)
+
+    def testMalformed(self):
+        with self.assertRaises(BSONDecodeError):
+            StreamingDecoder(maxDocumentSize=100).feed(struct.pack("<i", 101))
+        with self.assertRaises(BSONDecodeError):
+            StreamingDecoder().feed(struct.pack("<i", 3))
+        # element claims more bytes than its document has
+        with self.assertRaises(BSONDecodeError):
+            StreamingDecoder().feed(struct.pack("<i", 13) + b"\x02a\x00" + struct.pack("<i", 100) + b"xx")
+        decoder = StreamingDecoder()
+        decoder.feed(RAW[:10])
+        with self.assertRaises(BSONDecodeError):
+            decoder.close()
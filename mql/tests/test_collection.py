@@ -0,0 +1,96 @@
+import random
+import unittest
+
+from mql.base.bson import BSONDocument, BSONValue, BSONType
+from mql.base.path import Path
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.storage.btree import BTree
+from mql.storage.collection import Collection, IndexScanPlan, CollectionScanPlan
+
+from fpy.data.either import fromRight
+
+def query(raw: dict):
+    return fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict(raw)))
+
+def randomValue(rng: random.Random):
+    return rng.choice([rng.randrange(10), rng.randrange(10) + 0.5, f"s{rng.randrange(5)}", float("nan"),
+                       BSONValue(BSONType.Null, None), [rng.randrange(10), f"s{rng.randrange(5)}"],
+                       {"c": rng.randrange(10)}, [{"c": rng.randrange(10)}, {"c": [rng.randrange(10)]}]])
+
+QUERIES = [
+    {"a": 3},
+    {"a": "s1"},
+    {"a": {"$gte": 2, "$lt": 6}},
+    {"a": {"$gt": 4.5}},
+    {"a": {"$lte": "s2"}},
+    {"a": {"$in": [1, "s3", 7.5, BSONValue(BSONType.Null, None)]}},
+    {"a": {"$eq": {"c": 4}}},
+    {"a": [3, "s1"]},
+    {"a.c": {"$lt": 3}},
+    {"a": float("nan")},
+    {"a": {"$gt": float("nan")}},
+    {"a": 2, "b": {"$gt": 5}},
+    {"$or": [{"a": 1}, {"b": 2}]},
+]
+
+class TestBTree(unittest.TestCase):
+    def testMatchesSortedSet(self):
+        rng = random.Random(1)
+        tree, expected = BTree(order=4), set()
+        for _ in range(5000):
+            key = rng.randrange(2000)
+            if rng.random() < 0.3:
+                self.assertEqual(key in expected, tree.remove(key))
+                expected.discard(key)
+            else:
+                self.assertEqual(key not in expected, tree.insert(key))
+                expected.add(key)
+        self.assertEqual(sorted(expected), list(tree))
+        self.assertEqual(len(expected), len(tree))
+        for _ in range(200):
+            low, high = sorted([rng.randrange(2100), rng.randrange(2100)])
+            self.assertEqual([key for key in sorted(expected) if low <= key < high], list(tree.range(low, high)))
+
+class TestCollection(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(9)
+        self.collection = Collection()
+        for idx in range(600):
+            raw = {"_id": idx, "b": rng.randrange(10)}
+            if rng.random() < 0.9:
+                raw["a"] = randomValue(rng)
+            self.collection.insert(BSONDocument.fromDict(raw))
+
+    def scanned(self, raw: dict):
+        expr = query(raw)
+        return [doc for doc in self.collection.documents.values() if expr.matches(doc)]
+
+    def testIndexMatchesScan(self):
+        expected = {str(raw): self.scanned(raw) for raw in QUERIES}
+        self.collection.createIndex(Path.fromString("a"))
+        self.collection.createIndex(Path.fromString("a.c"))
+        for raw in QUERIES:
+            with self.subTest(query=raw):
+                self.assertEqual(expected[str(raw)], list(self.collection.find(query(raw))))
+
+    def testPlans(self):
+        self.collection.createIndex(Path.fromString("a"))
+        self.collection.createIndex(Path.fromString("b"))
+        plan = self.collection.plan(query({"a": {"$gt": 1}, "b": 4}))
+        self.assertIsInstance(plan, IndexScanPlan)
+        self.assertEqual(Path.fromString("b"), plan.index.path)
+        plan = self.collection.plan(query({"a": {"$in": [1, 2]}}))
+        self.assertEqual(2, len(plan.intervals))
+        self.assertIsInstance(self.collection.plan(query({"$or": [{"a": 1}, {"b": 2}]})), CollectionScanPlan)
+        self.assertIsInstance(self.collection.plan(query({"c": 1})), CollectionScanPlan)
+
+    def testMaintainedOnWrite(self):
+        index = self.collection.createIndex(Path.fromString("a"))
+        for recordId in range(0, 600, 2):
+            self.collection.delete(recordId)
+        recordId = self.collection.insert(BSONDocument.fromDict({"_id": "new", "a": [42, 42, "x"]}))
+        self.assertEqual(2, sum(1 for key, rid in index.tree if rid == recordId))
+        for raw in ({"a": 42}, {"a": {"$lt": 5}}, {"a": "x"}):
+            with self.subTest(query=raw):
+                self.assertEqual(self.scanned(raw), list(self.collection.find(query(raw))))
+        self.assertFalse(self.collection.delete(0))
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from mql.base.bson import BSONDocument
+from mql.base.bsonDecoder import decodeDocument
+from mql.base.bsonEncoder import encodeDocument
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.storage.collectionFile import openCollectionFile, writeCollectionFile, INDEX_SUFFIX
+
+from fpy.data.either import fromRight, isLeft
+
+DOCS = [BSONDocument.fromDict({"_id": idx, "a": idx % 5, "b": {"c": ["x" * (idx % 4), idx]}}) for idx in range(200)]
+# strings come back from the decoder with their terminator
+DECODED = [fromRight(None, decodeDocument(fromRight(None, encodeDocument(doc))))[0] for doc in DOCS]
+
+class TestCollectionFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "coll.bson")
+        writeCollectionFile(self.path, DOCS)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open(self):
+        return fromRight(None, openCollectionFile(self.path))
+
+    def testRandomAccessAndScan(self):
+        with self.open() as coll:
+            self.assertEqual(len(DOCS), len(coll))
+            self.assertEqual(DECODED[137], coll[137].toDocument())
+            self.assertEqual(DECODED[-1], coll[-1].toDocument())
+            self.assertEqual(DECODED, list(coll.documents()))
+            self.assertEqual(DECODED, [doc.toDocument() for doc in coll.scan()])
+            self.assertEqual(42, coll.documentNumber(coll.offsets[42]))
+
+    def testFind(self):
+        expr = fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict({"a": 3, "b.c": {"$gt": 100}})))
+        with self.open() as coll:
+            found = [doc.toDocument() for doc in coll.find(expr.compile())]
+        self.assertEqual([doc for doc in DECODED if expr.matches(doc)], found)
+
+    def testIndexPersisted(self):
+        self.open().close()
+        indexPath = self.path + INDEX_SUFFIX
+        self.assertTrue(os.path.exists(indexPath))
+        with self.open() as coll:
+            self.assertIsInstance(coll.offsets, memoryview)
+            self.assertEqual(DECODED[10], coll[10].toDocument())
+        # appending makes the sidecar stale
+        writeCollectionFile(self.path, DOCS + DOCS[:3])
+        with self.open() as coll:
+            self.assertEqual(len(DOCS) + 3, len(coll))
+            self.assertEqual(DECODED[2], coll[-1].toDocument())
+
+    def testDocumentsOutliveClose(self):
+        coll = self.open()
+        doc = coll[5]
+        coll.close()
+        self.assertEqual(DECODED[5], doc.toDocument())
+
+    def testInvalidFiles(self):
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 2)
+        self.assertTrue(isLeft(openCollectionFile(self.path)))
+        self.assertTrue(isLeft(openCollectionFile(os.path.join(self.tmp.name, "missing.bson"))))
+        writeCollectionFile(self.path, [])
+        with self.open() as coll:
+            self.assertEqual([], list(coll.scan()))
@@ -0,0 +1,51 @@
+import unittest
+
+from mql.base.bson import BSONDocument
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.matchExpr import columnar
+from mql.tests.test_compile import QUERIES, DOCS
+
+from fpy.data.either import fromRight
+
+EXTRA_DOCS = [
+    {"a": 2 ** 60},
+    {"a": 2 ** 60 + 1},
+    {"a": -0.0},
+    {"a": float("inf")},
+    {"a": 4, "b": 2.5, "c": 0},
+]
+
+EXTRA_QUERIES = [
+    {"a": {"$gt": 2 ** 60}},
+    {"a": {"$in": [2 ** 60 + 1, 0]}},
+    {"a": {"$lte": float("inf")}},
+    {"a": 0},
+]
+
+class TestColumnar(unittest.TestCase):
+    def assertBatchAgrees(self):
+        docs = [BSONDocument.fromDict(raw) for raw in DOCS + EXTRA_DOCS]
+        for rawQuery in QUERIES + EXTRA_QUERIES:
+            query = fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict(rawQuery)))
+            with self.subTest(query=rawQuery):
+                self.assertEqual([query.matches(doc) for doc in docs], query.matchesBatch(docs))
+
+    def testBatchMatchesScalar(self):
+        self.assertBatchAgrees()
+
+    def testBatchWithoutNumpy(self):
+        saved = columnar.np
+        columnar.np = None
+        try:
+            self.assertBatchAgrees()
+        finally:
+            columnar.np = saved
+
+    def testHomogeneousColumn(self):
+        docs = [BSONDocument.fromDict({"a": idx, "b": idx % 3}) for idx in range(100)]
+        query = fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict({"a": {"$gte": 10, "$lt": 20}, "b": {"$in": [0, 2]}})))
+        self.assertEqual([10 <= idx < 20 and idx % 3 != 1 for idx in range(100)], query.matchesBatch(docs))
+
+    def testEmptyBatch(self):
+        query = fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict({"a": 1})))
+        self.assertEqual([], query.matchesBatch([]))
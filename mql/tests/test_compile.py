@@ -0,0 +1,67 @@
+import unittest
+
+from mql.base.bson import BSONDocument
+from mql.base.bsonEncoder import encodeDocument
+from mql.base.bsonRaw import RawBSONDocument
+from mql.matchExpr.parser import parsePredicateTopLevel
+
+from fpy.data.either import isRight, fromRight
+
+QUERIES = [
+    {"a": 1},
+    {"a": 1, "b": {"$gt": 1}},
+    {"a": {"$gte": 2, "$lt": 10}},
+    {"a.b": {"$lte": 3}},
+    {"a.0": {"$gt": 0}},
+    {"a.1.b": 2},
+    {"a.b.c": {"$eq": 1.5}},
+    {"a": {"$gt": float("nan")}},
+    {"a": {"$in": [1, 4, "x"]}},
+    {"a": {"$nin": [1, 4]}},
+    {"a": {"$not": {"$gt": 2}}},
+    {"a": "x"},
+    {"$or": [{"a": 1}, {"b": {"$lt": 0}}]},
+    {"$nor": [{"a": 1}, {"a.b": 2}]},
+    {"$and": [{"$or": [{"a": 2}, {"b": 3}]}, {"c": {"$gt": 1}}]},
+    {"$and": [{"a": {"$gt": 0}}]},
+    {"$or": []},
+]
+
+DOCS = [
+    {},
+    {"a": 1},
+    {"a": 2.0, "b": 3, "c": 4},
+    {"a": float("nan")},
+    {"a": [1, 5, 9]},
+    {"a": [{"b": 2}, {"b": 3}]},
+    {"a": [[1, 2], {"b": [2, 3]}]},
+    {"a": {"b": 3, "c": 1}},
+    {"a": {"b": {"c": 1.5}}},
+    {"a": {"b": [{"c": 1.5}]}},
+    {"a": 5, "b": -1},
+    {"a": "x"},
+    {"a": True},
+    {"a": {"b": 1}, "b": 3},
+    {"a": [], "c": 2},
+]
+
+class TestCompile(unittest.TestCase):
+    def testCompiledMatchesInterpreted(self):
+        for rawQuery in QUERIES:
+            parsed = parsePredicateTopLevel(BSONDocument.fromDict(rawQuery))
+            self.assertTrue(isRight(parsed), rawQuery)
+            query = fromRight(None, parsed)
+            compiled = query.compile()
+            for rawDoc in DOCS:
+                doc = BSONDocument.fromDict(rawDoc)
+                with self.subTest(query=rawQuery, doc=rawDoc):
+                    self.assertEqual(query.matches(doc), compiled(doc))
+
+    def testCompiledOnRawDocuments(self):
+        query = fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict({"a.b": {"$gt": 2}})))
+        compiled = query.compile()
+        for rawDoc in DOCS:
+            doc = BSONDocument.fromDict(rawDoc)
+            raw = RawBSONDocument(fromRight(None, encodeDocument(doc)))
+            with self.subTest(doc=rawDoc):
+                self.assertEqual(query.matches(doc), compiled(raw))
@@ -0,0 +1,55 @@
+import struct
+import unittest
+
+from mql.base.bson import BSONDocument
+from mql.interfaces.wireprotocol.compression import (compressMsg, decompressMsg, MessageDecompressor, availableCodecs,
+                                                     COMPRESSED_HEADER, OP_COMPRESSED)
+from mql.interfaces.wireprotocol.wireprotocol import encodeMsg, OpCode, MSG_HEADER
+
+from fpy.data.either import isLeft, fromRight
+
+def message(requestId: int, width: int = 10) -> bytes:
+    return fromRight(None, encodeMsg(BSONDocument.fromDict({f"f{idx}": "x" * idx for idx in range(width)}), requestId))
+
+class TestCompression(unittest.TestCase):
+    def testRoundTrip(self):
+        raw = message(5, 50)
+        for codec in availableCodecs():
+            with self.subTest(codec=codec):
+                compressed = fromRight(None, compressMsg(raw, codec))
+                size, requestId, _, opCode, originalOpCode, uncompressedSize, _ = COMPRESSED_HEADER.unpack_from(compressed, 0)
+                self.assertEqual((len(compressed), requestId, opCode), (size, 5, OP_COMPRESSED))
+                self.assertEqual((originalOpCode, uncompressedSize), (OpCode.Msg.value, len(raw) - MSG_HEADER.size))
+                self.assertEqual(fromRight(None, decompressMsg(compressed)), raw)
+        self.assertLess(len(fromRight(None, compressMsg(raw, "zlib"))), len(raw))
+
+    def testReusedBuffer(self):
+        decompressor = MessageDecompressor()
+        large, small = message(1, 80), message(2, 5)
+        self.assertEqual(bytes(fromRight(None, decompressor.decompress(fromRight(None, compressMsg(large, "zlib"))))), large)
+        buffer = decompressor.buffer
+        self.assertEqual(bytes(fromRight(None, decompressor.decompress(fromRight(None, compressMsg(small, "zlib"))))), small)
+        self.assertIs(decompressor.buffer, buffer)
+
+    def testInvalid(self):
+        raw = message(1)
+        self.assertTrue(isLeft(compressMsg(raw, "lz4")))
+        compressed = bytearray(fromRight(None, compressMsg(raw, "zlib")))
+        self.assertTrue(isLeft(compressMsg(compressed, "zlib")))
+        self.assertTrue(isLeft(decompressMsg(raw)))
+        self.assertTrue(isLeft(decompressMsg(compressed[:10])))
+
+        unknown = bytearray(compressed)
+        unknown[COMPRESSED_HEADER.size - 1] = 42
+        self.assertTrue(isLeft(decompressMsg(unknown)))
+
+        # announced size smaller than the actual payload
+        lying = bytearray(compressed)
+        struct.pack_into("<i", lying, 20, 10)
+        self.assertTrue(isLeft(decompressMsg(lying)))
+
+        # larger than the decompressor accepts
+        self.assertTrue(isLeft(MessageDecompressor(maxSize=10).decompress(compressed)))
+
+        corrupt = compressed[:COMPRESSED_HEADER.size] + b"garbage"
+        self.assertTrue(isLeft(decompressMsg(corrupt)))
@@ -0,0 +1,133 @@
+import random
+import subprocess
+import sys
+import unittest
+from typing import List
+
+from mql.agg.pipeline import parsePipeline, PipelineOptions
+from mql.base.bson import BSONDocument, BSONValue, BSONType
+from mql.base.bsonDecoder import decodeDocument
+from mql.base.bsonEncoder import encodeDocument
+
+from fpy.data.maybe import fromJust
+from fpy.data.either import isLeft, fromLeft, fromRight
+
+def group(spec: dict, docs, options=None):
+    pipeline = fromRight(None, parsePipeline([BSONDocument.fromDict({"$group": spec})], options))
+    return pipeline.run([BSONDocument.fromDict(doc) if isinstance(doc, dict) else doc for doc in docs])
+
+def byId(res) -> dict:
+    out = {}
+    for doc in fromRight(None, res):
+        key = fromJust(doc["_id"]).value
+        out[key.value if key.bsonType != BSONType.Document else repr(key)] = {
+            elm.fieldName: elm.value for elm in doc.elements[1:]}
+    return out
+
+def numbers(value: BSONValue):
+    return [elm.value.value for elm in value.value.elements]
+
+SPEC = {"_id": "$k", "total": {"$sum": "$v"}, "avg": {"$avg": "$v"}, "lo": {"$min": "$v"}, "hi": {"$max": "$v"},
+        "all": {"$push": "$v"}, "n": {"$count": {}}}
+
+class TestGroup(unittest.TestCase):
+    def testAccumulators(self):
+        docs = [{"k": "a", "v": 1}, {"k": "b", "v": 2.5}, {"k": "a", "v": 3}, {"k": "a", "v": "x"}, {"k": "a"}]
+        res = byId(group(SPEC, docs))
+        a = res["a"]
+        self.assertEqual(a["total"], BSONValue(BSONType.Int32, 4))
+        self.assertEqual(a["avg"], BSONValue(BSONType.Number, 2.0))
+        self.assertEqual(a["lo"], BSONValue(BSONType.Int32, 1))
+        self.assertEqual(a["hi"], BSONValue(BSONType.String, "x"))
+        self.assertEqual(numbers(a["all"]), [1, 3, "x"])
+        self.assertEqual(a["n"], BSONValue(BSONType.Int32, 4))
+        self.assertEqual(res["b"]["total"], BSONValue(BSONType.Number, 2.5))
+
+    def testSumWidens(self):
+        res = byId(group({"_id": None, "s": {"$sum": "$v"}}, [{"v": 2 ** 31 - 1}, {"v": 1}]))
+        self.assertEqual(res[None]["s"], BSONValue(BSONType.Int64, 2 ** 31))
+        res = byId(group({"_id": None, "a": {"$avg": "$v"}, "m": {"$min": "$v"}}, [{"x": 1}]))
+        self.assertEqual(res[None]["a"], BSONValue(BSONType.Null, None))
+        self.assertEqual(res[None]["m"], BSONValue(BSONType.Null, None))
+
+    def testCanonicalKeys(self):
+        docs = [{"k": 1}, {"k": 1.0}, {"k": "1"}, {"k": None}, {}, {"k": {"x": 1}}, {"k": {"x": 1.0}},
+                {"k": float("nan")}, {"k": float("nan")}]
+        res = fromRight(None, group({"_id": "$k", "n": {"$sum": 1}}, docs))
+        counts = sorted(fromJust(doc["n"]).value.value for doc in res)
+        self.assertEqual([1, 2, 2, 2, 2], counts)
+
+    def testCompoundKey(self):
+        docs = [{"a": idx % 2, "b": idx % 3} for idx in range(12)]
+        res = fromRight(None, group({"_id": {"a": "$a", "b": "$b"}, "n": {"$sum": 1}}, docs))
+        self.assertEqual(6, len(res))
+        self.assertTrue(all(fromJust(doc["n"]).value.value == 2 for doc in res))
+
+    def testMemoryLimit(self):
+        docs = [{"k": idx, "v": idx} for idx in range(500)]
+        res = group(SPEC, docs, PipelineOptions(maxMemoryBytes=10000))
+        self.assertTrue(isLeft(res))
+        self.assertIn("allowDiskUse", fromLeft(None, res))
+
+    def assertSpillMatchesInMemory(self, docs, maxMemoryBytes: int) -> List[int]:
+        """
+        Returns the hash seed of every spill
+        """
+        expected = byId(group(SPEC, docs))
+        pipeline = fromRight(None, parsePipeline([BSONDocument.fromDict({"$group": SPEC})],
+                                                 PipelineOptions(allowDiskUse=True, maxMemoryBytes=maxMemoryBytes)))
+        stage = pipeline.stages[0]
+        seeds = []
+        spill = stage.spill
+        stage.spill = lambda groups, partitions, seed: (seeds.append(seed), spill(groups, partitions, seed))
+        res = pipeline.run([BSONDocument.fromDict(doc) for doc in docs])
+        actual = byId(res)
+        self.assertEqual(expected.keys(), actual.keys())
+        for key, fields in expected.items():
+            with self.subTest(key=key):
+                # partial float sums are added up in a different order
+                self.assertAlmostEqual(fields["total"].value, actual[key]["total"].value)
+                self.assertAlmostEqual(fields["avg"].value, actual[key]["avg"].value)
+                self.assertEqual(fields["n"], actual[key]["n"])
+                self.assertEqual(sorted(map(str, numbers(fields["all"]))), sorted(map(str, numbers(actual[key]["all"]))))
+        self.assertEqual(len(seeds), stage.spills)
+        return seeds
+
+    def testSpillMatchesInMemory(self):
+        rng = random.Random(7)
+        docs = [{"k": rng.randrange(300), "v": rng.choice([rng.randrange(100), rng.random(), "s"])} for _ in range(3000)]
+        self.assertGreater(len(self.assertSpillMatchesInMemory(docs, 20000)), 1)
+
+    def testMergeRepartitions(self):
+        rng = random.Random(8)
+        docs = [{"k": rng.randrange(2000), "v": rng.randrange(100)} for _ in range(6000)]
+        seeds = self.assertSpillMatchesInMemory(docs, 4000)
+        # partitions were split again while merging, each level with its own seed
+        self.assertGreater(max(seeds), 0)
+
+    def testSingleGroupOverLimit(self):
+        docs = [{"k": 1, "v": "x" * 200} for _ in range(100)]
+        res = group(SPEC, docs, PipelineOptions(allowDiskUse=True, maxMemoryBytes=2000))
+        self.assertTrue(isLeft(res))
+        self.assertIn("merging", fromLeft(None, res))
+
+    def testInvalid(self):
+        for spec in ({"n": {"$sum": 1}}, {"_id": 1, "n": 1}, {"_id": 1, "n": {"$bogus": 1}},
+                     {"_id": 1, "n": {"$count": 1}}, {"_id": 1, "a.b": {"$sum": 1}}, {"_id": 1, "n": {"$sum": [1, 2]}}):
+            with self.subTest(spec=spec):
+                self.assertTrue(isLeft(parsePipeline([BSONDocument.fromDict({"$group": spec})])))
+
+    def testNullRoundTrip(self):
+        doc = BSONDocument.fromDict({"a": BSONValue(BSONType.Null, None)})
+        decoded, _ = fromRight(None, decodeDocument(fromRight(None, encodeDocument(doc))))
+        self.assertEqual(doc, decoded)
+
+class TestStageModules(unittest.TestCase):
+    def testImportedFirst(self):
+        # a fresh interpreter, so nothing else has pulled in the pipeline module yet
+        for module in ("mql.agg.group", "mql.agg.sort"):
+            with self.subTest(module=module):
+                res = subprocess.run([sys.executable, "-c", f"import {module}; from mql.agg.pipeline import StageParsers;"
+                                      f" assert '$group' in StageParsers and '$sort' in StageParsers"],
+                                     capture_output=True, text=True)
+                self.assertEqual(0, res.returncode, res.stderr)
@@ -0,0 +1,120 @@
+import unittest
+
+from mql.base.bson import BSONDocument
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.matchExpr.querySelector import PathMatchExpression, PathAndExpression, TreeExpression, TreeOperator
+from mql.matchExpr.optimizer import optimize, Feedback, isAlwaysFalse, isAlwaysTrue
+from mql.tests.test_compile import QUERIES, DOCS
+
+from fpy.data.either import fromRight
+
+def query(raw: dict):
+    return fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict(raw)))
+
+def paths(expr: TreeExpression):
+    return [str(child.path) for child in expr.children]
+
+MORE_QUERIES = [
+    {"$and": [{"$and": [{"a": 1}, {"b": 3}]}, {"$and": [{"c": {"$gt": 1}}]}]},
+    {"$or": [{"$or": [{"a": 1}, {"a": 1.0}]}, {"b": 3}]},
+    {"$nor": [{"$nor": [{"a": 1}]}]},
+    {"$nor": [{"$or": [{"a": 1}, {"b": 3}]}, {"c": 4}]},
+    {"a": {"$not": {"$not": {"$gt": 2}}}},
+    {"a": {"$gt": 5, "$lt": 3}},
+    {"$and": [{"a": 1}, {"$nor": [{"a": 1}]}]},
+    {"$or": [{"a": {"$in": []}}, {"b": 3}]},
+    {"$nor": [{"a": float("nan")}]},
+]
+
+class TestOptimizer(unittest.TestCase):
+    def testEquivalent(self):
+        for rawQuery in QUERIES + MORE_QUERIES:
+            expr = query(rawQuery)
+            optimized = optimize(expr)
+            compiled = optimized.compile()
+            for rawDoc in DOCS:
+                doc = BSONDocument.fromDict(rawDoc)
+                with self.subTest(query=rawQuery, doc=rawDoc):
+                    self.assertEqual(expr.matches(doc), optimized.matches(doc))
+                    self.assertEqual(expr.matches(doc), compiled(doc))
+
+    def testFlattenAndDedupe(self):
+        flat = optimize(query(MORE_QUERIES[0]))
+        self.assertEqual(TreeOperator.AND, flat.operator)
+        self.assertEqual(["a", "b", "c"], sorted(paths(flat)))
+        deduped = optimize(query(MORE_QUERIES[1]))
+        self.assertEqual(["a", "b"], sorted(paths(deduped)))
+        self.assertIsInstance(optimize(query(MORE_QUERIES[2])), PathMatchExpression)
+        self.assertIsInstance(optimize(query(MORE_QUERIES[4])), PathMatchExpression)
+
+    def testContradictions(self):
+        self.assertTrue(isAlwaysFalse(optimize(query({"$and": [{"a": 1}, {"$nor": [{"a": 1}]}]}))))
+        self.assertTrue(isAlwaysTrue(optimize(query({"$or": [{"$nor": [{"a": 1}]}, {"a": 1}]}))))
+        self.assertTrue(isAlwaysFalse(optimize(query({"a": {"$gt": float("nan")}, "b": 1}))))
+        self.assertTrue(isAlwaysTrue(optimize(query({"$nor": [{"a": {"$in": []}}]}))))
+        self.assertIsInstance(optimize(query(MORE_QUERIES[7])), PathMatchExpression)
+        # an array can satisfy both bounds with different elements
+        self.assertEqual(2, len(optimize(query(MORE_QUERIES[5])).predicates))
+
+    def testOrder(self):
+        expr = query({"x.y.z": {"$gt": 1}, "d": {"$lt": 100}, "e": 1})
+        self.assertEqual(["e", "d", "x.y.z"], paths(optimize(expr)))
+        # an $or wants the likeliest match first
+        anyOf = query({"$or": [{"x.y.z": {"$gt": 1}}, {"d": {"$lt": 100}}, {"e": 1}]})
+        self.assertEqual(["d", "x.y.z", "e"], paths(optimize(anyOf)))
+
+    def testFeedback(self):
+        expr = query({"d": 1, "x": {"$lt": 10}})
+        self.assertEqual(["d", "x"], paths(optimize(expr)))
+        feedback = Feedback()
+        matches = feedback.instrument(optimize(expr))
+        docs = [BSONDocument.fromDict({"d": 1, "x": idx}) for idx in range(200)]
+        self.assertEqual(10, sum(map(matches, docs)))
+        # d matched every document, x rejects most of them
+        self.assertEqual(["x", "d"], paths(optimize(expr, feedback)))
+
+RANGE_QUERIES = [
+    {"a": {"$gt": 5, "$lt": 3}},
+    {"a": {"$gte": 1, "$lte": 1.0}},
+    {"a": {"$gt": 1, "$gte": 1, "$lt": 10}},
+    {"a": {"$gt": 2, "$lt": "z"}},
+    {"a": {"$gte": 1, "$in": [1, 5, "x"], "$lt": 9}},
+    {"a": {"$eq": 5, "$gt": 4}},
+    {"a": {"$gt": float("nan"), "$lt": 3}},
+    {"a.b": {"$gt": 1, "$lt": 3}},
+    {"a": {"$lt": 3, "$not": {"$gt": 1}}},
+    {"$and": [{"a": {"$gte": 2}}, {"b": 3}, {"a": {"$lt": 10}}]},
+]
+
+RANGE_DOCS = DOCS + [
+    {"a": [1, 10]},
+    {"a": [4]},
+    {"a": 1.0},
+    {"a": 4.5},
+    {"a": "y"},
+    {"a": [2, "y"]},
+    {"a": {"b": [0, 4]}},
+    {"a": [{"b": 2}]},
+    {"a": 2 ** 62},
+]
+
+class TestPathAnd(unittest.TestCase):
+    def testMerged(self):
+        expr = optimize(query(RANGE_QUERIES[-1]))
+        self.assertEqual(2, len(expr.children))
+        merged = next(child for child in expr.children if isinstance(child, PathAndExpression))
+        self.assertEqual("a", str(merged.path))
+        self.assertEqual(2, len(merged.predicates))
+        self.assertIsInstance(optimize(query({"a": {"$gt": 1}, "b": {"$lt": 2}})), TreeExpression)
+
+    def testEquivalent(self):
+        for rawQuery in RANGE_QUERIES:
+            expr = query(rawQuery)
+            optimized = optimize(expr)
+            compiled = optimized.compile()
+            docs = [BSONDocument.fromDict(rawDoc) for rawDoc in RANGE_DOCS]
+            expected = [expr.matches(doc) for doc in docs]
+            with self.subTest(query=rawQuery):
+                self.assertEqual(expected, [optimized.matches(doc) for doc in docs])
+                self.assertEqual(expected, [compiled(doc) for doc in docs])
+                self.assertEqual(expected, optimized.matchesBatch(docs))
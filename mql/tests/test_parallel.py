@@ -0,0 +1,52 @@
+import unittest
+
+from mql.base.bson import BSONDocument
+from mql.base.bsonEncoder import encodeDocument
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.matchExpr.parallel import ParallelMatcher, shards
+
+from fpy.data.either import fromRight, isLeft
+
+DOCS = [BSONDocument.fromDict({"_id": idx, "a": idx % 7, "b": {"c": [idx % 3, "x" * (idx % 5)]}}) for idx in range(300)]
+ENCODED = [fromRight(None, encodeDocument(doc)) for doc in DOCS]
+RAW = b"".join(ENCODED)
+OFFSETS = [sum(len(enc) for enc in ENCODED[:idx]) for idx in range(len(ENCODED))]
+
+QUERIES = [
+    {"a": 3},
+    {"a": {"$gte": 2, "$lt": 5}, "b.c": 1},
+    {"$or": [{"a": 0}, {"b.c": "xxxx"}]},
+    {"missing": 1},
+]
+
+class TestParallelMatcher(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # small shards so every query is spread over many of them
+        cls.matcher = ParallelMatcher(workers=2, chunkBytes=512)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.matcher.close()
+
+    def testMatchesSerial(self):
+        for raw in QUERIES:
+            query = BSONDocument.fromDict(raw)
+            expr = fromRight(None, parsePredicateTopLevel(query))
+            expected = [OFFSETS[idx] for idx, doc in enumerate(DOCS) if expr.matches(doc)]
+            with self.subTest(query=raw):
+                self.assertEqual(expected, fromRight(None, self.matcher.match(query, RAW)))
+
+    def testShardsOnDocumentBoundaries(self):
+        cuts = list(shards(RAW, 512))
+        self.assertGreater(len(cuts), 1)
+        self.assertEqual(0, cuts[0][0])
+        self.assertEqual(len(RAW), cuts[-1][1])
+        for (_, end), (start, _) in zip(cuts, cuts[1:]):
+            self.assertEqual(end, start)
+            self.assertIn(start, OFFSETS)
+
+    def testErrors(self):
+        self.assertEqual([], fromRight(None, self.matcher.match(BSONDocument.fromDict({"a": 1}), b"")))
+        self.assertTrue(isLeft(self.matcher.match(BSONDocument.fromDict({"a": {"$bogus": 1}}), RAW)))
+        self.assertTrue(isLeft(self.matcher.match(BSONDocument.fromDict({"a": 1}), RAW[:-3])))
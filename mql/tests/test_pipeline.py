@@ -0,0 +1,103 @@
+import unittest
+
+from mql.agg.pipeline import (parsePipeline, Pipeline, MatchStage, LimitStage, SkipStage, ProjectStage,
+                              AddFieldsStage, AggregationError)
+from mql.base.bson import BSONDocument
+from mql.matchExpr.querySelector import TreeExpression
+
+from fpy.data.either import isLeft, isRight, fromLeft, fromRight
+
+def pipeline(*stages) -> Pipeline:
+    res = parsePipeline([BSONDocument.fromDict(stage) for stage in stages])
+    assert isRight(res), fromLeft(None, res)
+    return fromRight(None, res)
+
+def run(stages, docs):
+    return fromRight(None, pipeline(*stages).optimize().run([BSONDocument.fromDict(doc) for doc in docs]))
+
+DOCS = [{"_id": idx, "a": idx % 3, "b": {"c": idx, "d": "x"}, "arr": [{"c": 1, "e": 2}, 3]} for idx in range(10)]
+
+class CountingSource:
+    def __init__(self, docs):
+        self.docs = [BSONDocument.fromDict(doc) for doc in docs]
+        self.pulled = 0
+
+    def __iter__(self):
+        for doc in self.docs:
+            self.pulled += 1
+            yield doc
+
+class TestPipeline(unittest.TestCase):
+    def testMatchSkipLimit(self):
+        res = run([{"$match": {"a": 1}}, {"$skip": 1}, {"$limit": 2}], DOCS)
+        self.assertEqual([4, 7], [doc.elements[0].value.value for doc in res])
+
+    def testLimitStopsUpstream(self):
+        source = CountingSource(DOCS)
+        res = list(pipeline({"$addFields": {"z": 1}}, {"$limit": 3}).optimize().stream(source))
+        self.assertEqual(3, len(res))
+        self.assertEqual(3, source.pulled)
+
+        source = CountingSource(DOCS)
+        stream = pipeline({"$match": {"a": 0}}).stream(source)
+        next(stream)
+        self.assertEqual(1, source.pulled)
+
+    def testInclusionProjection(self):
+        res = run([{"$project": {"b.c": 1, "arr.c": True, "k": {"$literal": 5}}}], DOCS[:1])
+        self.assertEqual(res[0], BSONDocument.fromDict({"_id": 0, "b": {"c": 0}, "arr": [{"c": 1}], "k": 5}))
+        res = run([{"$project": {"_id": 0, "a": 1, "b": {"d": 1}}}], DOCS[:1])
+        self.assertEqual(res[0], BSONDocument.fromDict({"a": 0, "b": {"d": "x"}}))
+
+    def testExclusionProjection(self):
+        res = run([{"$project": {"b.c": 0, "arr": {"e": 0}, "_id": 0}}], DOCS[:1])
+        self.assertEqual(res[0], BSONDocument.fromDict({"a": 0, "b": {"d": "x"}, "arr": [{"c": 1}, 3]}))
+        res = run([{"$project": {"_id": 0}}], DOCS[:1])
+        self.assertEqual(["a", "b", "arr"], [elm.fieldName for elm in res[0].elements])
+
+    def testAddFields(self):
+        res = run([{"$addFields": {"a": {"$literal": "new"}, "z": [1, {"$literal": 2}], "b.e": 7, "arr.f": 1}}], DOCS[:1])
+        self.assertEqual(res[0], BSONDocument.fromDict(
+            {"_id": 0, "a": "new", "b": {"c": 0, "d": "x", "e": 7}, "arr": [{"c": 1, "e": 2, "f": 1}, {"f": 1}], "z": [1, 2]}))
+
+    def testInvalidPipelines(self):
+        for stages in ([{"$limit": 0}], [{"$limit": 1.5}], [{"$skip": -1}], [{"$limit": float("nan")}],
+                       [{"$skip": float("inf")}], [{"$limit": float("-inf")}], [{"$bogus": 1}],
+                       [{"$project": {"a": 1, "b": 0}}], [{"$project": {}}], [{"$project": {"a": 1, "a.b": 1}}],
+                       [{"$match": 1}], [{"$limit": 1, "$skip": 1}], [{"$addFields": {"a": {"$nope": 1}}}]):
+            with self.subTest(stages=stages):
+                self.assertTrue(isLeft(parsePipeline([BSONDocument.fromDict(stage) for stage in stages])))
+
+    def testOptimize(self):
+        opt = pipeline({"$addFields": {"z": 1}}, {"$match": {"a": 1}}, {"$match": {"b.c": 4}},
+                       {"$project": {"a": 1}}, {"$skip": 2}, {"$limit": 5}, {"$limit": 3}).optimize()
+        kinds = [type(stage) for stage in opt.stages]
+        self.assertEqual([MatchStage, LimitStage, SkipStage, AddFieldsStage, ProjectStage], kinds)
+        self.assertIsInstance(opt.stages[0].expr, TreeExpression)
+        self.assertEqual(5, opt.stages[1].limit)
+
+        # the match reads a field the stage before it produces
+        opt = pipeline({"$addFields": {"a": 1}}, {"$match": {"a": 1}}).optimize()
+        self.assertEqual([AddFieldsStage, MatchStage], [type(stage) for stage in opt.stages])
+        opt = pipeline({"$match": {"a": 1}}, {"$limit": 1}).optimize()
+        self.assertEqual([MatchStage, LimitStage], [type(stage) for stage in opt.stages])
+
+    def testOptimizePreservesResults(self):
+        stages = [{"$project": {"a": 1, "b": 1}}, {"$skip": 1}, {"$match": {"a": {"$gte": 1}}},
+                  {"$match": {"b.c": {"$lt": 8}}}, {"$skip": 1}, {"$limit": 4}, {"$limit": 3}]
+        docs = [BSONDocument.fromDict(doc) for doc in DOCS]
+        plain = fromRight(None, pipeline(*stages).run(docs))
+        optimized = fromRight(None, pipeline(*stages).optimize().run(docs))
+        self.assertEqual(plain, optimized)
+        self.assertEqual(3, len(plain))
+
+    def testErrorsSurfaceAsLeft(self):
+        res = pipeline({"$project": {"x": "$$nope"}}).run([BSONDocument.fromDict({"a": 1})])
+        self.assertTrue(isLeft(res))
+        with self.assertRaises(AggregationError):
+            list(pipeline({"$project": {"x": "$$nope"}}).stream([BSONDocument.fromDict({"a": 1})]))
+
+    def testFieldPaths(self):
+        res = run([{"$project": {"_id": 0, "c": "$b.c", "cs": "$arr.c", "root": "$$ROOT.a"}},
+                   {"$addFields": {"copy": "$c", "gone": "$missing"}}], DOCS[2:3])
+        self.assertEqual(res[0], BSONDocument.fromDict({"c": 2, "cs": [1], "root": 2, "copy": 2}))
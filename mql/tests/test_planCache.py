@@ -0,0 +1,74 @@
+import unittest
+
+from mql.base.bson import BSONDocument
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.matchExpr.planCache import PlanCache, queryShape
+from mql.tests.test_compile import DOCS
+
+from fpy.data.either import isLeft, fromRight
+
+def bdoc(raw):
+    return BSONDocument.fromDict(raw)
+
+class TestPlanCache(unittest.TestCase):
+    def testHitRebindsConstants(self):
+        cache = PlanCache()
+        first = fromRight(None, cache.parse(bdoc({"a": 1, "b": {"$gt": 1}})))
+        second = fromRight(None, cache.parse(bdoc({"a": 2, "b": {"$gt": 5}})))
+
+        self.assertEqual({"hits": 1, "misses": 1, "evictions": 0, "size": 1}, cache.stats())
+        self.assertEqual(fromRight(None, parsePredicateTopLevel(bdoc({"a": 2, "b": {"$gt": 5}}))), second)
+        self.assertNotEqual(first, second)
+
+    def testResultsMatchUncached(self):
+        cache = PlanCache()
+        queries = [
+            {"a": {"$in": [1, 2]}}, {"a": {"$in": [3, 4, 5]}},
+            {"a": {"$nin": [1]}}, {"a": {"$nin": [2]}},
+            {"$or": [{"a": 1}, {"b": 2}]}, {"$or": [{"a": 5}, {"b": 9}]},
+            {"$or": [{"a": 1}, {"b": 2}, {"c": 3}]},
+            {"a": {"$not": {"$lt": 3}}}, {"a": {"$not": {"$lt": 4}}},
+            {"a.b": 1.5}, {"a.b": 2.5}, {"a.b": "x"},
+        ]
+        for rawQuery in queries:
+            cached = fromRight(None, cache.parse(bdoc(rawQuery)))
+            fresh = fromRight(None, parsePredicateTopLevel(bdoc(rawQuery)))
+            with self.subTest(query=rawQuery):
+                self.assertEqual(fresh, cached)
+                for rawDoc in DOCS:
+                    self.assertEqual(fresh.matches(bdoc(rawDoc)), cached.matches(bdoc(rawDoc)))
+        self.assertEqual(5, cache.hits)
+
+    def testShapeDependsOnTypes(self):
+        self.assertNotEqual(queryShape(bdoc({"a": 1})), queryShape(bdoc({"a": "1"})))
+        self.assertNotEqual(queryShape(bdoc({"a": {"$gt": 1}})), queryShape(bdoc({"a": {"x": 1}})))
+        self.assertEqual(queryShape(bdoc({"a": {"$in": [1]}})), queryShape(bdoc({"a": {"$in": [1, 2, 3]}})))
+        self.assertNotEqual(queryShape(bdoc({"$or": [{"a": 1}]})), queryShape(bdoc({"$or": [{"a": 1}, {"a": 2}]})))
+
+    def testErrorsAreNotCached(self):
+        cache = PlanCache()
+        self.assertTrue(isLeft(cache.parse(bdoc({"a": {"$in": 1}}))))
+        self.assertTrue(isLeft(cache.parse(bdoc({"a": {"$in": 2}}))))
+        self.assertEqual(0, len(cache))
+        self.assertEqual(2, cache.misses)
+
+    def testDBRefOperandIsNotAnOperator(self):
+        cache = PlanCache()
+        dbRef = bdoc({"a": {"$in": [{"$ref": "c", "$id": 1}]}})
+        operator = bdoc({"a": {"$in": [{"$gt": 1}]}})
+        self.assertNotEqual(queryShape(dbRef), queryShape(operator))
+        self.assertFalse(isLeft(cache.parse(dbRef)))
+        self.assertTrue(isLeft(cache.parse(operator)))
+        self.assertTrue(isLeft(parsePredicateTopLevel(operator)))
+
+    def testEviction(self):
+        cache = PlanCache(maxSize=2)
+        cache.parse(bdoc({"a": 1}))
+        cache.parse(bdoc({"b": 1}))
+        cache.parse(bdoc({"a": 2}))
+        cache.parse(bdoc({"c": 1}))
+        self.assertEqual(1, cache.evictions)
+        cache.parse(bdoc({"a": 3}))
+        self.assertEqual(2, cache.hits)
+        cache.parse(bdoc({"b": 3}))
+        self.assertEqual(2, cache.hits)
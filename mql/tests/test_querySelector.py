@@ -0,0 +1,72 @@
+import unittest
+
+from mql.base.bson import BSONDocument, BSONElement, BSONValue, BSONArray, BSONType
+from mql.matchExpr.parser import parsePredicateTopLevel
+from mql.matchExpr.querySelector import MatchOperator, Predicate, prepareArguments
+
+from fpy.data.either import fromRight
+
+def inArray(*values: BSONValue) -> BSONElement:
+    return BSONElement("$in", BSONValue(BSONType.Array, BSONArray([BSONElement(str(idx), v) for idx, v in enumerate(values)])))
+
+def leaf(value: BSONValue) -> BSONElement:
+    return BSONElement("a", value)
+
+class TestInOperator(unittest.TestCase):
+    def testNumericTypesCompareEqual(self):
+        arg = inArray(BSONValue(BSONType.Int32, 1), BSONValue(BSONType.Int64, 2 ** 40), BSONValue(BSONType.Number, 2.5))
+        pred = Predicate(MatchOperator.IN, arg, prepareArguments(MatchOperator.IN, arg))
+        self.assertTrue(pred.eval(leaf(BSONValue(BSONType.Number, 1.0))))
+        self.assertTrue(pred.eval(leaf(BSONValue(BSONType.Int64, 1))))
+        self.assertTrue(pred.eval(leaf(BSONValue(BSONType.Number, float(2 ** 40)))))
+        self.assertTrue(pred.eval(leaf(BSONValue(BSONType.Number, 2.5))))
+        self.assertFalse(pred.eval(leaf(BSONValue(BSONType.Int32, 2))))
+        self.assertFalse(pred.eval(leaf(BSONValue(BSONType.String, "1"))))
+
+    def testNaNNeverMatches(self):
+        nan = float("nan")
+        arg = inArray(BSONValue(BSONType.Number, nan))
+        pred = Predicate(MatchOperator.IN, arg, prepareArguments(MatchOperator.IN, arg))
+        self.assertFalse(pred.eval(leaf(BSONValue(BSONType.Number, nan))))
+
+    def testUnpreparedPredicate(self):
+        arg = inArray(BSONValue(BSONType.Int32, 3))
+        self.assertTrue(Predicate(MatchOperator.IN, arg).eval(leaf(BSONValue(BSONType.Number, 3.0))))
+
+    def testLargeInList(self):
+        ids = list(range(0, 20000, 3))
+        query = fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict({"a": {"$in": ids}})))
+        compiled = query.compile()
+        for value in [0, 1, 3, 19998, 19999, 3.0, 4.5]:
+            doc = BSONDocument.fromDict({"a": value})
+            expected = value in ids
+            self.assertEqual(expected, query.matches(doc))
+            self.assertEqual(expected, compiled(doc))
+
+    def testNinOverArrays(self):
+        query = fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict({"a": {"$nin": [1, 2]}})))
+        self.assertFalse(query.matches(BSONDocument.fromDict({"a": [5, 2]})))
+        self.assertTrue(query.matches(BSONDocument.fromDict({"a": [5, 6]})))
+        self.assertTrue(query.matches(BSONDocument.fromDict({})))
+
+
+class TestComparisons(unittest.TestCase):
+    def matches(self, query: dict, doc: dict) -> bool:
+        parsed = fromRight(None, parsePredicateTopLevel(BSONDocument.fromDict(query)))
+        res = parsed.matches(BSONDocument.fromDict(doc))
+        self.assertEqual(res, parsed.compile()(BSONDocument.fromDict(doc)))
+        return res
+
+    def testEqualityBeyondNumbers(self):
+        self.assertTrue(self.matches({"a": "x"}, {"a": "x"}))
+        self.assertFalse(self.matches({"a": "x"}, {"a": "y"}))
+        self.assertTrue(self.matches({"a": {"$eq": {"b": 1}}}, {"a": {"b": 1.0}}))
+        self.assertTrue(self.matches({"a": {"$in": ["y", "x"]}}, {"a": "x"}))
+        self.assertTrue(self.matches({"a": {"$gte": "m"}}, {"a": "x"}))
+        self.assertTrue(self.matches({"a": BSONValue(BSONType.Null, None)}, {"a": BSONValue(BSONType.Null, None)}))
+
+    def testTypeBracketing(self):
+        self.assertFalse(self.matches({"a": {"$lt": 5}}, {"a": BSONValue(BSONType.Null, None)}))
+        self.assertFalse(self.matches({"a": {"$gt": 5}}, {"a": "x"}))
+        self.assertFalse(self.matches({"a": {"$gt": float("nan")}}, {"a": 1}))
+        self.assertFalse(self.matches({"a": {"$gt": 1}}, {"a": float("nan")}))
@@ -0,0 +1,106 @@
+import random
+import unittest
+
+from mql.agg.pipeline import parsePipeline, PipelineOptions
+from mql.agg.sort import SortStage
+from mql.base.bson import BSONDocument, BSONValue, BSONType
+
+from fpy.data.maybe import fromJust
+from fpy.data.either import isLeft, isRight, fromLeft, fromRight
+
+def pipeline(stages, options=None):
+    return fromRight(None, parsePipeline([BSONDocument.fromDict(stage) for stage in stages], options))
+
+NULL = BSONValue(BSONType.Null, None)
+
+def ids(docs):
+    return [fromJust(doc["_id"]).value.value for doc in docs]
+
+class TestSort(unittest.TestCase):
+    def testMixedTypes(self):
+        docs = [{"_id": 0, "v": "b"}, {"_id": 1, "v": 2}, {"_id": 2}, {"_id": 3, "v": 1.5}, {"_id": 4, "v": {"x": 1}},
+                {"_id": 5, "v": NULL}, {"_id": 6, "v": BSONValue(BSONType.Boolean, True)}, {"_id": 7, "v": "a"}]
+        res = pipeline([{"$sort": {"v": 1}}]).run([BSONDocument.fromDict(doc) for doc in docs])
+        self.assertEqual([2, 5, 3, 1, 7, 0, 4, 6], ids(fromRight(None, res)))
+
+    def testCompoundAndStable(self):
+        docs = [{"_id": idx, "a": idx % 3, "b": idx % 2} for idx in range(12)]
+        res = fromRight(None, pipeline([{"$sort": {"a": -1, "b": 1}}]).run([BSONDocument.fromDict(doc) for doc in docs]))
+        self.assertEqual([2, 8, 5, 11, 4, 10, 1, 7, 0, 6, 3, 9], ids(res))
+
+    def testArrays(self):
+        docs = [{"_id": 0, "v": [5, 1]}, {"_id": 1, "v": 3}, {"_id": 2, "v": [2, 4]}, {"_id": 3, "v": []},
+                {"_id": 4, "v": NULL}]
+        asc = pipeline([{"$sort": {"v": 1}}]).run([BSONDocument.fromDict(doc) for doc in docs])
+        self.assertEqual([3, 4, 0, 2, 1], ids(fromRight(None, asc)))
+        desc = pipeline([{"$sort": {"v": -1}}]).run([BSONDocument.fromDict(doc) for doc in docs])
+        self.assertEqual([0, 2, 1, 4, 3], ids(fromRight(None, desc)))
+
+    def testArrayPositions(self):
+        docs = [{"_id": 0, "a": [3, 1]}, {"_id": 1, "a": [2, 9]}, {"_id": 2, "a": 5}, {"_id": 3, "a": {"0": 4}},
+                {"_id": 4, "a": [[0], 8]}, {"_id": 5, "a": []}]
+        asc = pipeline([{"$sort": {"a.0": 1}}]).run([BSONDocument.fromDict(doc) for doc in docs])
+        self.assertEqual([2, 5, 4, 1, 0, 3], ids(fromRight(None, asc)))
+        docs = [{"_id": 0, "a": [{"b": 1}, {"b": 7}]}, {"_id": 1, "a": [{"b": 5}, {"c": 1}]}, {"_id": 2, "a": [{"c": 1}]}]
+        desc = pipeline([{"$sort": {"a.1.b": -1}}]).run([BSONDocument.fromDict(doc) for doc in docs])
+        self.assertEqual([0, 1, 2], ids(fromRight(None, desc)))
+        desc = pipeline([{"$sort": {"a.b": -1}}]).run([BSONDocument.fromDict(doc) for doc in docs])
+        self.assertEqual([0, 1, 2], ids(fromRight(None, desc)))
+
+    def testTopK(self):
+        p = pipeline([{"$sort": {"v": -1}}, {"$skip": 2}, {"$limit": 3}]).optimize()
+        self.assertIsInstance(p.stages[0], SortStage)
+        self.assertEqual(5, p.stages[0].limit)
+        rng = random.Random(3)
+        docs = [{"_id": idx, "v": rng.randrange(50)} for idx in range(400)]
+        expected = sorted(docs, key=lambda doc: -doc["v"])[2:5]
+        res = p.run([BSONDocument.fromDict(doc) for doc in docs])
+        self.assertEqual([doc["_id"] for doc in expected], ids(fromRight(None, res)))
+
+    def testMemoryLimit(self):
+        docs = [{"_id": idx, "v": idx} for idx in range(500)]
+        res = pipeline([{"$sort": {"v": 1}}], PipelineOptions(maxMemoryBytes=10000)).run(
+            [BSONDocument.fromDict(doc) for doc in docs])
+        self.assertTrue(isLeft(res))
+        self.assertIn("allowDiskUse", fromLeft(None, res))
+
+    def testExternalMatchesInMemory(self):
+        rng = random.Random(11)
+        docs = [{"_id": idx, "a": rng.randrange(20), "b": rng.choice([rng.random(), "s", NULL])} for idx in range(2000)]
+        spec = [{"$sort": {"a": 1, "b": -1}}]
+        expected = fromRight(None, pipeline(spec).run([BSONDocument.fromDict(doc) for doc in docs]))
+        p = pipeline(spec, PipelineOptions(allowDiskUse=True, maxMemoryBytes=20000))
+        res = p.run([BSONDocument.fromDict(doc) for doc in docs])
+        self.assertGreater(p.stages[0].spills, 1)
+        # documents read back from disk are the ones that were written, strings included
+        self.assertEqual(expected, fromRight(None, res))
+
+    def testMultiLevelMerge(self):
+        rng = random.Random(5)
+        docs = [{"_id": idx, "v": rng.randrange(100)} for idx in range(3000)]
+        spec = [{"$sort": {"v": 1}}]
+        expected = ids(fromRight(None, pipeline(spec).run([BSONDocument.fromDict(doc) for doc in docs])))
+        p = pipeline(spec, PipelineOptions(allowDiskUse=True, maxMemoryBytes=5000))
+        p.stages[0].fanIn = 3
+        res = p.run([BSONDocument.fromDict(doc) for doc in docs])
+        self.assertEqual(expected, ids(fromRight(None, res)))
+
+    def testTopKMemoryLimit(self):
+        rng = random.Random(7)
+        docs = [{"_id": idx, "v": rng.randrange(100)} for idx in range(2000)]
+        spec = [{"$sort": {"v": -1}}, {"$limit": 1500}]
+        expected = ids(fromRight(None, pipeline(spec).optimize().run([BSONDocument.fromDict(doc) for doc in docs])))
+        res = pipeline(spec, PipelineOptions(maxMemoryBytes=20000)).optimize().run(
+            [BSONDocument.fromDict(doc) for doc in docs])
+        self.assertTrue(isLeft(res))
+        self.assertIn("allowDiskUse", fromLeft(None, res))
+        p = pipeline(spec, PipelineOptions(allowDiskUse=True, maxMemoryBytes=20000)).optimize()
+        res = p.run([BSONDocument.fromDict(doc) for doc in docs])
+        self.assertGreater(p.stages[0].spills, 0)
+        self.assertEqual(expected, ids(fromRight(None, res)))
+
+    def testInvalid(self):
+        for spec in ({}, {"a": 2}, {"a": "asc"}, {"$a": 1}, {"a..b": 1}, 1):
+            with self.subTest(spec=spec):
+                self.assertTrue(isLeft(parsePipeline([BSONDocument.fromDict({"$sort": spec})])))
+        self.assertTrue(isRight(parsePipeline([BSONDocument.fromDict({"$sort": {"a.b": -1, "c": 1.0}})])))
@@ -0,0 +1,178 @@
+import contextlib
+import io
+import struct
+import unittest
+
+from mql.base.bson import BSONDocument
+from mql.base.bsonDecoder import BSONDecodeError
+from mql.base.bsonEncoder import encodeDocument
+from mql.base.bsonRaw import RawBSONDocument
+from mql.interfaces.wireprotocol.wireprotocol import (parseMsg, parseDocSeq, encodeMsg, OpCode, SectionKind,
+                                                      SectionBody, SectionDocumentSequence, DocumentSequence)
+from mql.interfaces.wireprotocol.checksum import crc32c, crc32cSlicing
+from mql.interfaces.wireprotocol.msgStream import MessageStream, MessageStart, SectionStart, MessageEnd, RawMessage
+from mql.base.bsonStream import DocumentDecoded, ElementDecoded
+from mql.interfaces.wireprotocol.instrumentation import LOGGER, TRACE
+from mql.tests.test_bsonDecoder import cstr
+
+from fpy.data.either import isLeft, isRight, fromRight
+
+def docSeq(identifier: str, payload: bytes) -> bytes:
+    body = cstr(identifier) + payload
+    return struct.pack("<i", len(body) + 4) + body
+
+class TestWireProtocol(unittest.TestCase):
+    def testBodyAndDocumentSequence(self):
+        docs = [BSONDocument.fromDict({"_id": idx, "x": idx * 2}) for idx in range(100)]
+        raw = fromRight(None, encodeMsg(BSONDocument.fromDict({"insert": "coll"}), 7, sequences={"documents": docs}))
+        msg, rest = fromRight(None, parseMsg(raw))
+        self.assertEqual(len(rest), 0)
+        self.assertEqual(msg.opCode, OpCode.Msg)
+        self.assertEqual(msg.requestId, 7)
+        body, seq = msg.sections
+        self.assertIsInstance(body, SectionBody)
+        self.assertEqual(body.kind, SectionKind.Document)
+        # decoded strings keep their terminating NUL
+        self.assertEqual(body.document, BSONDocument.fromDict({"insert": "coll\x00"}))
+        self.assertIsInstance(seq, SectionDocumentSequence)
+        self.assertEqual(seq.kind, SectionKind.DocumentSequence)
+        self.assertEqual(seq.documentSequenceIdentifier, "documents")
+        self.assertEqual(len(seq.documents), 100)
+        self.assertEqual(list(seq.documents), docs)
+        # iterating again starts over
+        self.assertEqual(next(iter(seq.documents)), docs[0])
+        raws = list(seq.documents.rawDocuments())
+        self.assertIsInstance(raws[5], RawBSONDocument)
+        self.assertEqual(raws[5].toDocument(), docs[5])
+
+    def testLazyDecoding(self):
+        good = fromRight(None, encodeDocument(BSONDocument.fromDict({"a": 1})))
+        # valid length prefix, truncated element
+        bad = struct.pack("<i", 8) + b"\x10a\x00\x00"
+        section, rest = fromRight(None, parseDocSeq(docSeq("documents", good + good + bad)))
+        seq = section.documents
+        self.assertEqual(len(rest), 0)
+        it = iter(seq)
+        self.assertEqual(next(it), BSONDocument.fromDict({"a": 1}))
+        self.assertEqual(next(it), BSONDocument.fromDict({"a": 1}))
+        with self.assertRaises(BSONDecodeError):
+            next(it)
+
+    def testInvalidDocumentSequence(self):
+        self.assertTrue(isLeft(parseDocSeq(struct.pack("<i", 100) + b"documents\x00")))
+        self.assertTrue(isLeft(parseDocSeq(struct.pack("<i", 6) + b"ab")))
+        self.assertTrue(isRight(parseDocSeq(docSeq("documents", b""))))
+        self.assertEqual(len(DocumentSequence(b"")), 0)
+
+    def testMultipleBodies(self):
+        raw = bytearray(fromRight(None, encodeMsg(BSONDocument.fromDict({"ping": 1}), 1)))
+        section = raw[20:]
+        raw += section
+        struct.pack_into("<i", raw, 0, len(raw))
+        self.assertTrue(isLeft(parseMsg(raw)))
+
+    def testChecksum(self):
+        body = BSONDocument.fromDict({"ping": 1})
+        raw = fromRight(None, encodeMsg(body, 3, checksum=True))
+        self.assertEqual(struct.unpack_from("<I", raw, 16)[0] & 1, 1)
+        self.assertEqual(struct.unpack_from("<i", raw, 0)[0], len(raw))
+        self.assertEqual(struct.unpack_from("<I", raw, len(raw) - 4)[0], crc32c(raw[:-4]))
+        msg, _ = fromRight(None, parseMsg(raw))
+        self.assertTrue(msg.flagBits.checksumPresent)
+        self.assertEqual(msg.sections[0].document, body)
+
+        corrupted = bytearray(raw)
+        corrupted[-8] ^= 0xFF
+        self.assertTrue(isLeft(parseMsg(corrupted)))
+
+    def testBufferInput(self):
+        raw = fromRight(None, encodeMsg(BSONDocument.fromDict({"ping": 1}), 9))
+        msg, rest = fromRight(None, parseMsg(memoryview(raw + b"next")))
+        self.assertEqual(msg.requestId, 9)
+        self.assertEqual(bytes(rest), b"next")
+        self.assertTrue(isLeft(parseMsg(raw[:-1])))
+        self.assertTrue(isLeft(parseMsg(raw[:10])))
+
+    def testTraceLogging(self):
+        raw = fromRight(None, encodeMsg(BSONDocument.fromDict({"ping": 1}), 9))
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            parseMsg(raw)
+        self.assertEqual(out.getvalue(), "")
+        with self.assertLogs(LOGGER, TRACE) as logs:
+            parseMsg(raw)
+        events = [record.event for record in logs.records]
+        self.assertEqual(events, ["msg.header", "msg.section"])
+        self.assertEqual(logs.records[0].fields["requestId"], 9)
+
+class TestChecksum(unittest.TestCase):
+    def testKnownValues(self):
+        self.assertEqual(crc32cSlicing(b""), 0)
+        self.assertEqual(crc32cSlicing(b"123456789"), 0xE3069283)
+        self.assertEqual(crc32cSlicing(b"\x00" * 32), 0x8A9136AA)
+        self.assertEqual(crc32cSlicing(b"\xff" * 32), 0x62A8AB43)
+
+    def testIncremental(self):
+        data = bytes(range(256)) * 5
+        for split in (0, 1, 7, 8, 9, 100, len(data)):
+            self.assertEqual(crc32cSlicing(data[split:], crc32cSlicing(data[:split])), crc32cSlicing(data))
+        self.assertEqual(crc32c(data), crc32cSlicing(data))
+
+class TestMessageStream(unittest.TestCase):
+    def message(self, checksum: bool = False) -> bytes:
+        docs = [BSONDocument.fromDict({"_id": idx}) for idx in range(3)]
+        return fromRight(None, encodeMsg(BSONDocument.fromDict({"insert": "coll"}), 5, checksum=checksum,
+                                         sequences={"documents": docs, "updates": []}))
+
+    def summary(self, events):
+        out = []
+        for event in events:
+            if isinstance(event, MessageStart):
+                out.append(("start", event.requestId, event.flagBits.checksumPresent))
+            elif isinstance(event, SectionStart):
+                out.append((event.kind, event.identifier))
+            elif isinstance(event, DocumentDecoded):
+                out.append(len(event.document))
+            elif isinstance(event, MessageEnd):
+                out.append(("end", event.requestId))
+        return out
+
+    def testEverySplit(self):
+        for checksum in (False, True):
+            raw = self.message(checksum) * 2
+            expected = [("start", 5, checksum), (SectionKind.Document, None), 1, (SectionKind.DocumentSequence, "documents"),
+                        1, 1, 1, (SectionKind.DocumentSequence, "updates"), ("end", 5)] * 2
+            for split in range(len(raw) + 1):
+                with self.subTest(checksum=checksum, split=split):
+                    stream = MessageStream()
+                    events = stream.feed(raw[:split]) + stream.feed(raw[split:])
+                    self.assertEqual(expected, self.summary(events))
+                    self.assertTrue(stream.idle)
+
+    def testByteAtATime(self):
+        raw = self.message(True)
+        stream = MessageStream()
+        events = [event for idx in range(len(raw)) for event in stream.feed(raw[idx:idx + 1])]
+        self.assertIsInstance(events[0], MessageStart)
+        self.assertIsInstance(events[-1], MessageEnd)
+        body = [event.element for event in events if isinstance(event, ElementDecoded)][0]
+        self.assertEqual("insert", body.fieldName)
+
+    def testChecksumMismatch(self):
+        raw = bytearray(self.message(True))
+        raw[-6] ^= 1
+        with self.assertRaises(BSONDecodeError):
+            MessageStream().feed(raw)
+
+    def testOtherOpCodes(self):
+        raw = struct.pack("<iiii", 20, 1, 0, OpCode.Compressed.value) + b"abcd"
+        stream = MessageStream()
+        self.assertEqual([], stream.feed(raw[:10]))
+        self.assertEqual([RawMessage(raw)], stream.feed(raw[10:]))
+        self.assertTrue(stream.idle)
+
+    def testInvalid(self):
+        raw = bytearray(self.message())
+        # the body claims more bytes than the message has
+        struct.pack_into("<i", raw, 21, 1000)
+        with self.assertRaises(BSONDecodeError):
+            MessageStream().feed(raw)